@@ -15,6 +15,20 @@ class AbstractCalibrationDataProvider(object):
         self.readbackParameters = ['par0vd', 'par1vd', 'par0va', 'par1va', 'par0rbia', 'par1rbia', 'par0tbia',
                                    'par1tbia', 'par2tbia', 'par0ia', 'par1ia', 'par2ia']
 
+    # optional: fetch data for many modules at once, to speed up the following calls for single modules
+    def prefetchModuleData(self, ModuleIDs, options = {}):
+        pass
+
+    # optional: download files for many modules at once into a persistent cache
+    def prefetchModuleFiles(self, ModuleIDs, options = {}):
+        pass
+
+    # optional: identification of the input data of one data kind ('dac', 'trim', 'tbm', 'mask', 'iana') of a module,
+    # e.g. test IDs or file modification times, which has to change if the data changes. it has to be JSON serializable.
+    # used to skip modules which did not change since the last conversion. None: unknown, the module is always converted
+    def getInputFingerprint(self, ModuleID, dataKind, options = {}):
+        return None
+
     def getRocDacs(self, ModuleID, options = {}):
         raise NotImplementedError('getRocDacs() not implemented!')
 
@@ -1,26 +1,47 @@
 from PisaDB import CalibrationDataProvider as PisaDBCalibrationDataProvider
+from PisaDBConcurrent import CalibrationDataProvider as PisaDBConcurrentCalibrationDataProvider
 from PisaDBparametersForBBTest import CalibrationDataProvider as PisaDBforBBCalibrationDataProvider
 from LocalData import CalibrationDataProvider as LocalCalibrationDataProvider
 from DefaultValues import CalibrationDataProvider as DefaultCalibrationDataProvider
+from SnapshotData import CalibrationDataProvider as SnapshotCalibrationDataProvider
 
 class CalibrationDataProviderFactory(object):
 
     def __init__(self):
         pass
 
-    def init(self, dataSource, verbose=False):
-        if ('http://' in dataSource and 'BBTEST:' in dataSource):
+    def init(self, dataSource, verbose=False, options={}):
+        if dataSource.startswith('BBTEST:sqlite:'):
+            print "  -> selected data source: local DB mirror / \x1b[33mBB test parameters\x1b[0m"
+            return PisaDBforBBCalibrationDataProvider(dataSource=dataSource.replace('BBTEST:',''), verbose=verbose, options=options)
+        elif dataSource.startswith('CONCURRENT:sqlite:'):
+            # local mirror of Pisa DB, fetch many modules at once
+            print "  -> selected data source: local DB mirror / concurrent fetching"
+            return PisaDBConcurrentCalibrationDataProvider(dataSource=dataSource.replace('CONCURRENT:',''), verbose=verbose, options=options)
+        elif dataSource.startswith('snapshot:'):
+            # binary snapshot of a configuration written with --snapshot
+            print "  -> selected data source: configuration snapshot"
+            return SnapshotCalibrationDataProvider(dataSource=dataSource, verbose=verbose, options=options)
+        elif dataSource.startswith('sqlite:'):
+            # local mirror of Pisa DB, files are still downloaded from the DB server
+            print "  -> selected data source: local DB mirror"
+            return PisaDBCalibrationDataProvider(dataSource=dataSource, verbose=verbose, options=options)
+        elif ('http://' in dataSource and 'BBTEST:' in dataSource):
             print "  -> selected data source: MySQL database / \x1b[33mBB test parameters\x1b[0m"
-            return PisaDBforBBCalibrationDataProvider(dataSource=dataSource.replace('BBTEST:',''), verbose=verbose)
+            return PisaDBforBBCalibrationDataProvider(dataSource=dataSource.replace('BBTEST:',''), verbose=verbose, options=options)
+        elif 'http://' in dataSource and 'CONCURRENT:' in dataSource:
+            # connect to Pisa DB, fetch many modules at once
+            print "  -> selected data source: MySQL database / concurrent fetching"
+            return PisaDBConcurrentCalibrationDataProvider(dataSource=dataSource.replace('CONCURRENT:',''), verbose=verbose, options=options)
         elif 'http://' in dataSource:
             # connect to Pisa DB
             print "  -> selected data source: MySQL database"
-            return PisaDBCalibrationDataProvider(dataSource=dataSource, verbose=verbose)
+            return PisaDBCalibrationDataProvider(dataSource=dataSource, verbose=verbose, options=options)
         elif dataSource.lower() == 'default':
             # just default values
             print "  -> selected data source: default values"
-            return DefaultCalibrationDataProvider(dataSource=dataSource, verbose=verbose)
+            return DefaultCalibrationDataProvider(dataSource=dataSource, verbose=verbose, options=options)
         else:
             # or fetch data locally
             print "  -> selected data source: local pXar test folders"
-            return LocalCalibrationDataProvider(dataSource=dataSource, verbose=verbose)
+            return LocalCalibrationDataProvider(dataSource=dataSource, verbose=verbose, options=options)
@@ -0,0 +1,182 @@
+from ModuleCalibration import PixelArray, PixelBitset, ParameterMatrix
+from LocalDataIndex import decodeStrings
+import tempfile
+import operator
+import zipfile
+import array
+import json
+import time
+import sys
+import os
+
+# ----------------------------------------------------------------------------------------------------------------------
+#  binary snapshot of the calibration data of a whole configuration
+# ----------------------------------------------------------------------------------------------------------------------
+#  zip file (like numpy .npz) with one member per module and data kind, holding the raw buffers of the containers of
+#  ModuleCalibration, and a JSON header with the layout of all members:
+#    snapshot.json    {"version": 1, "info": {...}, "modules": {"M1234": {"position": [...], "kinds": {"dac": {...}}}}}
+#    M1234/dac.bin    ParameterMatrix: values (array.array machine format) followed by the present flags
+#    M1234/trim.bin   PixelArray: two pixels per byte if all values are < 16 (trimbits), one byte per pixel otherwise
+#    M1234/mask.bin   PixelBitset: one bit per pixel
+#    M1234/tbm.bin    ParameterMatrix
+#    M1234/iana.bin   ParameterMatrix
+#  the snapshot holds the values as they were written to the POS files, after interpolation and transformations
+# ----------------------------------------------------------------------------------------------------------------------
+
+snapshotVersion = 1
+headerFileName = 'snapshot.json'
+
+# data kind -> ModuleCalibration attribute
+calibrationKinds = [('dac', 'dacs'), ('trim', 'trims'), ('mask', 'masks'), ('tbm', 'tbm'), ('iana', 'readback')]
+
+# byte -> byte shifted into the high nibble, high nibble of byte, low nibble of byte
+nibbleShiftTable = ''.join([chr((x << 4) & 0xFF) for x in range(256)])
+highNibbleTable = ''.join([chr(x >> 4) for x in range(256)])
+lowNibbleTable = ''.join([chr(x & 0x0F) for x in range(256)])
+
+
+# values < 16, two values per byte, first one in the high nibble
+def packNibbles(data):
+    data = str(data) + ('\x00' if len(data) % 2 else '')
+    return bytearray(map(operator.or_, bytearray(data[0::2].translate(nibbleShiftTable)), bytearray(data[1::2])))
+
+
+def unpackNibbles(packedData, size):
+    packedData = str(packedData)
+    data = bytearray(len(packedData) * 2)
+    data[0::2] = packedData.translate(highNibbleTable)
+    data[1::2] = packedData.translate(lowNibbleTable)
+    return data[:size]
+
+
+# returns (meta data for the header, binary data) of a container
+def encodeContainer(container):
+    if isinstance(container, ParameterMatrix):
+        meta = {
+            'type': 'ParameterMatrix',
+            'rocs': container.rocs,
+            'names': container.names,
+            'typecode': container.typecode,
+            'itemsize': container.values.itemsize,
+            'byteorder': sys.byteorder,
+        }
+        return meta, container.values.tostring() + str(container.present)
+    elif isinstance(container, PixelArray):
+        packed = len(container.data) < 1 or max(bytearray(container.data)) < 16
+        meta = {'type': 'PixelArray', 'rocs': container.rocs, 'nPix': container.nPix, 'packed': packed}
+        return meta, str(packNibbles(container.data) if packed else container.data)
+    elif isinstance(container, PixelBitset):
+        meta = {'type': 'PixelBitset', 'rocs': container.rocs, 'nPix': container.nPix}
+        return meta, str(container.data)
+    raise TypeError("can't store %r in snapshot"%type(container))
+
+
+def decodeContainer(meta, data):
+    if meta['type'] == 'ParameterMatrix':
+        parameterMatrix = ParameterMatrix([], meta['names'], meta['typecode'])
+        if parameterMatrix.values.itemsize != meta['itemsize']:
+            raise ValueError("snapshot was written with %d bytes per value for type '%s', this machine uses %d"%(meta['itemsize'], meta['typecode'], parameterMatrix.values.itemsize))
+        nValues = len(meta['rocs']) * len(meta['names'])
+        parameterMatrix.values.fromstring(data[:nValues * meta['itemsize']])
+        if meta['byteorder'] != sys.byteorder:
+            parameterMatrix.values.byteswap()
+        parameterMatrix.present = bytearray(data[nValues * meta['itemsize']:])
+        parameterMatrix.rocs = list(meta['rocs'])
+        parameterMatrix.rocIndex = dict([(roc, i) for i, roc in enumerate(parameterMatrix.rocs)])
+        if len(parameterMatrix.values) != nValues or len(parameterMatrix.present) != nValues:
+            raise ValueError("size of ParameterMatrix does not match snapshot header")
+        return parameterMatrix
+    elif meta['type'] == 'PixelArray':
+        size = len(meta['rocs']) * meta['nPix']
+        return PixelArray(meta['rocs'], meta['nPix'], unpackNibbles(data, size) if meta['packed'] else bytearray(data))
+    elif meta['type'] == 'PixelBitset':
+        return PixelBitset(meta['rocs'], meta['nPix'], bytearray(data))
+    raise ValueError("unknown container type '%s' in snapshot"%meta['type'])
+
+
+# returns {data kind: (meta, data)} for all containers of the ModuleCalibration which were read
+def encodeModule(calibration):
+    return dict([(dataKind, encodeContainer(getattr(calibration, attribute))) for dataKind, attribute in calibrationKinds if getattr(calibration, attribute) is not None])
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# writes a snapshot file
+#   modules: list of (ModuleID, module position, encoded module data from encodeModule())
+#   info:    additional information stored in the header, e.g. data source, temperature and trim value
+# ----------------------------------------------------------------------------------------------------------------------
+def writeSnapshot(fileName, modules, info = {}):
+    header = {'version': snapshotVersion, 'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'info': info, 'modules': {}}
+    outputFolder = os.path.dirname(fileName)
+    temporaryFile, temporaryFileName = tempfile.mkstemp(dir=outputFolder if outputFolder else '.', prefix='.' + os.path.basename(fileName) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(temporaryFile, 'wb') as outputFile:
+            snapshotFile = zipfile.ZipFile(outputFile, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+            for ModuleID, modulePosition, moduleData in modules:
+                kinds = {}
+                for dataKind, (meta, data) in sorted(moduleData.items()):
+                    snapshotFile.writestr('%s/%s.bin'%(ModuleID, dataKind), data)
+                    kinds[dataKind] = meta
+                header['modules'][ModuleID] = {'position': modulePosition, 'kinds': kinds}
+            snapshotFile.writestr(headerFileName, json.dumps(header, sort_keys=True))
+            snapshotFile.close()
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temporaryFileName, 0666 & ~umask)
+        if os.name == 'nt' and os.path.isfile(fileName):
+            os.remove(fileName)
+        os.rename(temporaryFileName, fileName)
+    except:
+        try:
+            os.remove(temporaryFileName)
+        except OSError:
+            pass
+        raise
+    return len(header['modules'])
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#  read access to a snapshot file, the header is read once
+# ----------------------------------------------------------------------------------------------------------------------
+class CalibrationSnapshot(object):
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.snapshotFile = None
+        self.pid = None
+        header = json.loads(self.getSnapshotFile().read(headerFileName), object_hook=decodeStrings)
+        if header['version'] != snapshotVersion:
+            raise ValueError("snapshot %s has version %r, only version %d is supported"%(fileName, header['version'], snapshotVersion))
+        self.created = header['created']
+        self.info = header['info']
+        self.modules = header['modules']
+
+    # worker processes forked after the file was opened must not share its file position
+    def getSnapshotFile(self):
+        if self.snapshotFile is None or self.pid != os.getpid():
+            self.snapshotFile = zipfile.ZipFile(self.fileName, 'r')
+            self.pid = os.getpid()
+        return self.snapshotFile
+
+    def getModuleIDs(self):
+        return sorted(self.modules.keys())
+
+    def getModulePosition(self, ModuleID):
+        return self.modules[ModuleID]['position'] if ModuleID in self.modules else None
+
+    def hasData(self, ModuleID, dataKind):
+        return ModuleID in self.modules and dataKind in self.modules[ModuleID]['kinds']
+
+    # returns container of the data kind of the module
+    def getData(self, ModuleID, dataKind):
+        if not self.hasData(ModuleID, dataKind):
+            if ModuleID in self.info.get('excludedModules', []):
+                raise NameError("module %s is not in snapshot %s, since its conversion had errors"%(ModuleID, self.fileName))
+            raise NameError("no %s data for module %s in snapshot %s"%(dataKind, ModuleID, self.fileName))
+        return decodeContainer(self.modules[ModuleID]['kinds'][dataKind], self.getSnapshotFile().read('%s/%s.bin'%(ModuleID, dataKind)))
+
+    # CRC and size of the stored data, None if it is not in the snapshot
+    def getFingerprint(self, ModuleID, dataKind):
+        if not self.hasData(ModuleID, dataKind):
+            return None
+        zipInfo = self.getSnapshotFile().getinfo('%s/%s.bin'%(ModuleID, dataKind))
+        return {'snapshot': self.created, 'crc': zipInfo.CRC, 'size': zipInfo.file_size}
@@ -0,0 +1,70 @@
+import threading
+import Queue
+import time
+import os
+
+# ----------------------------------------------------------------------------------------------------------------------
+#  pool of database connections, opened when needed and reused for all queries of the process
+# ----------------------------------------------------------------------------------------------------------------------
+#  connect: function which opens a new connection
+#  maxConnections: number of connections used at the same time, None for no limit (single threaded use)
+#  pingInterval: connections which were idle for longer are checked with ping() before they are used again, and
+#                replaced by a new one if the server closed them (only connections which have ping(), e.g. not SQLite)
+#  After fork() each process opens its own connections. The connections of the parent process are kept, but never
+#  used or closed in the child, since closing them would also close them for the parent.
+# ----------------------------------------------------------------------------------------------------------------------
+class ConnectionPool(object):
+
+    def __init__(self, connect, maxConnections = None, pingInterval = 60):
+        self.connect = connect
+        self.maxConnections = maxConnections
+        self.pingInterval = pingInterval
+        self.semaphore = threading.BoundedSemaphore(maxConnections) if maxConnections else None
+
+        # idle connections: (connection, time when it was released)
+        self.idleConnections = Queue.Queue()
+        self.pid = os.getpid()
+        self.parentConnections = []
+
+    def acquire(self):
+        if self.semaphore:
+            self.semaphore.acquire()
+        try:
+            if self.pid != os.getpid():
+                self.parentConnections.append(self.idleConnections)
+                self.idleConnections = Queue.Queue()
+                self.pid = os.getpid()
+
+            try:
+                connection, releaseTime = self.idleConnections.get_nowait()
+            except Queue.Empty:
+                return self.connect()
+
+            if time.time() - releaseTime > self.pingInterval and hasattr(connection, 'ping'):
+                try:
+                    connection.ping()
+                except Exception:
+                    self.close(connection)
+                    connection = self.connect()
+            return connection
+        except:
+            if self.semaphore:
+                self.semaphore.release()
+            raise
+
+    # broken=True: connection is closed instead of being used again
+    def release(self, connection, broken = False):
+        try:
+            if broken:
+                self.close(connection)
+            else:
+                self.idleConnections.put((connection, time.time()))
+        finally:
+            if self.semaphore:
+                self.semaphore.release()
+
+    def close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
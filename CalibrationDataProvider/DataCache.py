@@ -0,0 +1,81 @@
+from CalibrationDataProvider import AbstractCalibrationDataProvider
+from ModuleCalibration import toDacs, toTrims, toMasks, toTbm, toReadback
+
+# ----------------------------------------------------------------------------------------------------------------------
+#  in-memory cache in front of another data source
+# ----------------------------------------------------------------------------------------------------------------------
+#  used to write several configurations (e.g. different temperatures and trim values) from one data fetch: every
+#  distinct (method, module, options) is read only once from the data source, also the -20/+17 data needed for
+#  temperature interpolation. Failures are cached as well, so missing data is not requested again for each
+#  configuration. Data is kept until clear() is called, e.g. after all configurations of a module are written.
+# ----------------------------------------------------------------------------------------------------------------------
+class DataCache(AbstractCalibrationDataProvider):
+
+    def __init__(self, dataSource):
+        super(DataCache, self).__init__()
+        self.dataSource = dataSource
+
+        # (method, ModuleID, options key) -> (data, exception)
+        self.data = {}
+        # (ModuleIDs, options key) of bulk fetches which were already done
+        self.prefetched = set()
+
+        # statistics
+        self.nFetched = 0
+        self.nShared = 0
+
+    # options which select the input data, transformations are applied by the converter afterwards
+    @staticmethod
+    def getOptionsKey(options):
+        return repr(sorted([(key, value) for key, value in options.items() if key != 'Transformations']))
+
+    # removes the data of the given modules (or all data) from the cache
+    def clear(self, ModuleIDs = None):
+        if ModuleIDs is None:
+            self.data = {}
+            self.prefetched = set()
+        else:
+            self.data = dict([(key, value) for key, value in self.data.items() if key[1] not in ModuleIDs])
+
+    def getData(self, method, ModuleID, options, convert):
+        key = (method, ModuleID, self.getOptionsKey(options))
+        if key in self.data:
+            self.nShared += 1
+        else:
+            self.nFetched += 1
+            try:
+                self.data[key] = (convert(getattr(self.dataSource, method)(ModuleID=ModuleID, options=options)), None)
+            except Exception as e:
+                self.data[key] = (None, e)
+        data, exception = self.data[key]
+        if exception is not None:
+            raise exception
+        return data
+
+    def prefetchModuleData(self, ModuleIDs, options = {}):
+        key = (tuple(ModuleIDs), self.getOptionsKey(options))
+        if key not in self.prefetched:
+            self.prefetched.add(key)
+            self.dataSource.prefetchModuleData(ModuleIDs=ModuleIDs, options=options)
+
+    def prefetchModuleFiles(self, ModuleIDs, options = {}):
+        self.dataSource.prefetchModuleFiles(ModuleIDs=ModuleIDs, options=options)
+
+    def getInputFingerprint(self, ModuleID, dataKind, options = {}):
+        return self.dataSource.getInputFingerprint(ModuleID=ModuleID, dataKind=dataKind, options=options)
+
+    # DACs are changed by the transformations, each configuration gets its own copy
+    def getRocDacs(self, ModuleID, options = {}):
+        return self.getData('getRocDacs', ModuleID, options, toDacs).copy()
+
+    def getTrimBits(self, ModuleID, options = {}):
+        return self.getData('getTrimBits', ModuleID, options, toTrims)
+
+    def getTbmParameters(self, ModuleID, options = {}):
+        return self.getData('getTbmParameters', ModuleID, options, toTbm)
+
+    def getMaskBits(self, ModuleID, options = {}):
+        return self.getData('getMaskBits', ModuleID, options, toMasks)
+
+    def getReadbackCalibration(self, ModuleID, options = {}):
+        return self.getData('getReadbackCalibration', ModuleID, options, toReadback)
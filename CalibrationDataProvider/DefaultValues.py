@@ -1,17 +1,42 @@
 from CalibrationDataProvider import AbstractCalibrationDataProvider
+from ModuleCalibration import PixelArray, PixelBitset, ParameterMatrix
 import os
 
 class CalibrationDataProvider(AbstractCalibrationDataProvider):
 
-    def __init__(self, dataSource=None, verbose=False):
+    def __init__(self, dataSource=None, verbose=False, options={}):
         super(CalibrationDataProvider, self).__init__()
         self.verbose = verbose
 
+        # default values are the same for all modules, create them only once
+        self.defaultDacs = {}
+        self.defaultReadback = None
+
+    # default values don't depend on any input data
+    def getInputFingerprint(self, ModuleID, dataKind, options = {}):
+        return 'default'
+
     # initialize DACs with default value
     def getRocDacs(self, ModuleID, options = {}):
-        dacs = []
+        isL1Module = ModuleID.upper().startswith('M1')
+        if isL1Module not in self.defaultDacs:
+            self.defaultDacs[isL1Module] = self.createDefaultDacs(isL1Module)
+
+        # the converter modifies DACs in place, so return a copy of the default matrix
+        dacs = self.defaultDacs[isL1Module].copy()
+        if self.verbose:
+            for roc in dacs.rocs:
+                print "    -> ROC ", roc
+                for dacName, dacValue in dacs.getRoc(roc):
+                    print "      -> {Name: <13}{Value}".format(Name=dacName, Value=dacValue)
+
+        print "  -> created list of default DACs for %d ROCs"%self.nROCs
+        return dacs
+
+    def createDefaultDacs(self, isL1Module):
+        dacs = ParameterMatrix([], [], 'i')
         for roc in range(self.nROCs):
-            if ModuleID.upper().startswith('M1'):
+            if isL1Module:
                 rocDACs = [
                     {'Name': 'Vdd', 'Value': '10'},
                     {'Name': 'Vana', 'Value': '81'},
@@ -59,21 +84,13 @@ class CalibrationDataProvider(AbstractCalibrationDataProvider):
                 ]
 
 
-            dacs.append({'ROC': roc, 'DACs': rocDACs})
-            if self.verbose:
-                print "    -> ROC ", roc
-                for p in rocDACs:
-                    print "      -> {Name: <13}{Value}".format(Name=p['Name'], Value=p['Value'])
-
-        print "  -> created list of default DACs for %d ROCs"%self.nROCs
+            for rocDAC in rocDACs:
+                dacs.set(roc, rocDAC['Name'], rocDAC['Value'])
         return dacs
 
-    # default trimbit configuration
+    # default trimbit configuration, all modules share the same immutable array
     def getTrimBits(self, ModuleID, options={}):
-        trims = []
-        for iRoc in range(self.nROCs):
-            rocTrims = [self.defaultTrim] * self.nPix
-            trims.append({'ROC': iRoc, 'Trims': rocTrims})
+        trims = PixelArray.filled(range(self.nROCs), self.nPix, self.defaultTrim)
         print "  -> created list of default trimbits(=%d) for %d ROCs"%(self.defaultTrim, self.nROCs)
         return trims
 
@@ -95,18 +112,16 @@ class CalibrationDataProvider(AbstractCalibrationDataProvider):
             {'Name': 'TBMBDelay', 'Value': 100},
         ]
 
-        if ModuleID.upper().startswith('M1'):
-            # just duplicate
-            return [tbmParameters, tbmParameters]
-        else:
-            return tbmParameters
+        tbm = ParameterMatrix([], [], 'i')
+        # L1 modules: just duplicate for the second TBM
+        for tbmId in (range(2) if ModuleID.upper().startswith('M1') else range(1)):
+            for tbmParameter in tbmParameters:
+                tbm.set(tbmId, tbmParameter['Name'], tbmParameter['Value'])
+        return tbm
 
     # default mask bits, 0=unmasked, 1=masked
     def getMaskBits(self, ModuleID, options={}):
-        masks = []
-        for iRoc in range(self.nROCs):
-            rocMasks = [self.defaultMask] * self.nPix
-            masks.append({'ROC': iRoc, 'Masks': rocMasks})
+        masks = PixelBitset.filled(range(self.nROCs), self.nPix, self.defaultMask)
         print "  -> created list of default maskbits(=%d) for %d ROCs"%(self.defaultMask, self.nROCs)
         return masks
 
@@ -131,5 +146,9 @@ class CalibrationDataProvider(AbstractCalibrationDataProvider):
         if self.verbose:
             for p in readbackParameters:
                 print "    -> {Name: <10}{Value:0.3e}+/-{Uncertainty:0.1e}".format(Name=p['Name'], Value=p['Value'], Uncertainty=p['Uncertainty'])
-        readbackParametersModule = [{'ROC': i, 'ReadbackCalibration': readbackParameters} for i in range(16)]
-        return readbackParametersModule
\ No newline at end of file
+        if self.defaultReadback is None:
+            self.defaultReadback = ParameterMatrix([], [], 'd')
+            for iRoc in range(self.nROCs):
+                for p in readbackParameters:
+                    self.defaultReadback.set(iRoc, p['Name'], p['Value'])
+        return self.defaultReadback.copy()
\ No newline at end of file
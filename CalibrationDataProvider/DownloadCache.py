@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import urllib2
+import tempfile
+import threading
+
+# ----------------------------------------------------------------------------------------------------------------------
+#  persistent cache for files downloaded from the DB server
+# ----------------------------------------------------------------------------------------------------------------------
+#  files are stored under the hash of remote url and version (e.g. the fulltest analysis ID), so a new analysis of a
+#  module never reuses old files. Each file has a .json file next to it with ETag/Last-Modified/size of the remote file.
+#  revalidate=False: cached files are used without asking the server (version changes if the analysis changes)
+#  revalidate=True:  conditional request with If-None-Match/If-Modified-Since, or comparison of the size if the
+#                    server sends neither ETag nor Last-Modified
+#  the least recently used files are removed if the cache grows above maxSize bytes
+# ----------------------------------------------------------------------------------------------------------------------
+class DownloadCache(object):
+
+    def __init__(self, cachePath, maxSize = 2000 * 1024 * 1024, revalidate = False, verbose = False):
+        self.cachePath = cachePath
+        self.maxSize = maxSize
+        self.revalidate = revalidate
+        self.verbose = verbose
+        self.timeout = 60
+
+        # size of the cache, determined on first insert
+        self.cacheSize = None
+        self.sizeLock = threading.Lock()
+
+        try:
+            os.makedirs(self.cachePath)
+        except OSError:
+            pass
+
+    def getCacheFileName(self, remoteUrl, version = ''):
+        urlHash = hashlib.sha1('%s|%s'%(remoteUrl, version)).hexdigest()
+        extension = os.path.splitext(remoteUrl)[1]
+        return os.path.join(self.cachePath, urlHash[0:2], urlHash + extension)
+
+    def readMetadata(self, cacheFileName):
+        try:
+            with open(cacheFileName + '.json', 'r') as metadataFile:
+                return json.load(metadataFile)
+        except:
+            return None
+
+    # mark file as recently used
+    def touch(self, cacheFileName):
+        try:
+            os.utime(cacheFileName, None)
+        except OSError:
+            pass
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # returns None if the cached file is still the same as the remote one, otherwise the open response of a GET request
+    # with the current content, so a changed file is only transferred once
+    # ------------------------------------------------------------------------------------------------------------------
+    def openIfChanged(self, remoteUrl, cacheFileName, metadata):
+        if metadata is None or not os.path.isfile(cacheFileName):
+            return urllib2.urlopen(remoteUrl, timeout=self.timeout)
+        if not self.revalidate:
+            return None
+
+        # without ETag/Last-Modified only the size can be compared, with a HEAD request
+        if not metadata.get('ETag') and not metadata.get('Last-Modified'):
+            request = urllib2.Request(remoteUrl)
+            request.get_method = lambda: 'HEAD'
+            response = urllib2.urlopen(request, timeout=self.timeout)
+            try:
+                contentLength = response.info().getheader('Content-Length')
+            finally:
+                response.close()
+            if contentLength is not None and int(contentLength) == os.path.getsize(cacheFileName):
+                return None
+            return urllib2.urlopen(remoteUrl, timeout=self.timeout)
+
+        request = urllib2.Request(remoteUrl)
+        if metadata.get('ETag'):
+            request.add_header('If-None-Match', metadata['ETag'])
+        if metadata.get('Last-Modified'):
+            request.add_header('If-Modified-Since', metadata['Last-Modified'])
+        try:
+            return urllib2.urlopen(request, timeout=self.timeout)
+        except urllib2.HTTPError as e:
+            if e.code == 304:
+                return None
+            raise
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # returns file name of the cached copy of the remote file, downloads it if necessary. raises exception on failure
+    # ------------------------------------------------------------------------------------------------------------------
+    def getFile(self, remoteUrl, version = ''):
+        cacheFileName = self.getCacheFileName(remoteUrl, version)
+        metadata = self.readMetadata(cacheFileName)
+
+        response = self.openIfChanged(remoteUrl, cacheFileName, metadata)
+        if response is None:
+            if self.verbose:
+                print "    -> cached:", remoteUrl
+            self.touch(cacheFileName)
+            return cacheFileName
+
+        try:
+            os.makedirs(os.path.dirname(cacheFileName))
+        except OSError:
+            pass
+
+        # download to temporary files first, so parallel runs and threads never see a partially written file
+        temporaryFileNames = []
+        try:
+            try:
+                temporaryFile, temporaryFileName = tempfile.mkstemp(dir=os.path.dirname(cacheFileName), prefix='.', suffix='.tmp')
+                temporaryFileNames.append(temporaryFileName)
+                with os.fdopen(temporaryFile, 'wb') as outputFile:
+                    shutil.copyfileobj(response, outputFile)
+                headers = response.info()
+                metadata = {
+                    'Url': remoteUrl,
+                    'Version': '%s'%version,
+                    'ETag': headers.getheader('ETag'),
+                    'Last-Modified': headers.getheader('Last-Modified'),
+                    'Size': os.path.getsize(temporaryFileName),
+                    'Downloaded': time.time(),
+                }
+            finally:
+                response.close()
+
+            metadataFile, metadataFileName = tempfile.mkstemp(dir=os.path.dirname(cacheFileName), prefix='.', suffix='.json.tmp')
+            temporaryFileNames.append(metadataFileName)
+            with os.fdopen(metadataFile, 'w') as outputFile:
+                json.dump(metadata, outputFile)
+            os.rename(temporaryFileName, cacheFileName)
+            os.rename(metadataFileName, cacheFileName + '.json')
+        except:
+            for fileName in temporaryFileNames:
+                try:
+                    os.remove(fileName)
+                except OSError:
+                    pass
+            raise
+
+        self.addSize(metadata['Size'])
+        return cacheFileName
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # keep track of cache size and remove least recently used files if it gets too large
+    # ------------------------------------------------------------------------------------------------------------------
+    #   called by all download threads of the data source, the size is only changed by one thread at a time
+    def addSize(self, fileSize):
+        with self.sizeLock:
+            if self.cacheSize is None:
+                self.cacheSize = sum([x[2] for x in self.getCachedFiles()])
+            else:
+                self.cacheSize += fileSize
+
+            if self.cacheSize > self.maxSize:
+                self.evict()
+
+    # returns list of [last used, file name, size] for all cached files
+    def getCachedFiles(self):
+        cachedFiles = []
+        for directoryPath, directoryNames, fileNames in os.walk(self.cachePath):
+            for fileName in fileNames:
+                if fileName.endswith('.json') and fileName[:-5] in fileNames:
+                    continue
+                fullFileName = os.path.join(directoryPath, fileName)
+                try:
+                    fileStat = os.stat(fullFileName)
+                    cachedFiles.append([fileStat.st_mtime, fullFileName, fileStat.st_size])
+                except OSError:
+                    pass
+        return cachedFiles
+
+    def evict(self):
+        cachedFiles = sorted(self.getCachedFiles())
+        cacheSize = sum([x[2] for x in cachedFiles])
+
+        # remove down to 90% of the maximum size, to not evict again on the next download
+        nFilesRemoved = 0
+        for lastUsed, fileName, fileSize in cachedFiles:
+            if cacheSize <= 0.9 * self.maxSize:
+                break
+            for fileNameToRemove in [fileName, fileName + '.json']:
+                try:
+                    os.remove(fileNameToRemove)
+                except OSError:
+                    pass
+            cacheSize -= fileSize
+            nFilesRemoved += 1
+
+        self.cacheSize = cacheSize
+        if self.verbose or nFilesRemoved > 0:
+            print "  -> download cache: %d files removed, %1.1f MB used"%(nFilesRemoved, cacheSize / 1024.0 / 1024.0)
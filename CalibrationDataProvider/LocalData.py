@@ -1,13 +1,25 @@
 from CalibrationDataProvider import AbstractCalibrationDataProvider
-import glob
+from ModuleCalibration import PixelArray, PixelBitset, ParameterMatrix
+from LocalDataIndex import LocalDataIndex
+from PxarParameterFiles import readParameterFile, readTrimFile, readMaskFile, parseInteger
 import os
 
 class CalibrationDataProvider(AbstractCalibrationDataProvider):
 
-    def __init__(self, dataSource="", verbose=False):
+    def __init__(self, dataSource="", verbose=False, options={}):
         super(CalibrationDataProvider, self).__init__()
 
+        self.verbose = verbose
         self.dataPath = dataSource
+
+        # index of all module folders and parameter files, optionally stored in a file for the next runs
+        self.index = LocalDataIndex(
+            dataPath=self.dataPath,
+            indexFileName=options['LocalDataIndex'].strip() if 'LocalDataIndex' in options and len(options['LocalDataIndex'].strip()) > 0 else None,
+            filePatterns=['dacParameters*.dat', 'trimParameters*.dat', 'tbmParameters*.dat', 'readbackCal*.dat', 'maskFile*.dat'],
+            verbose=verbose,
+        )
+
         self.dacTable = {
             'vdig': 'Vdd',
             'vana': 'Vana',
@@ -30,91 +42,203 @@ class CalibrationDataProvider(AbstractCalibrationDataProvider):
             'readback': 'Readback',
         }
 
+        # TBM registers which are not read from the pxar files
+        self.defaultTbmParameters = [
+            ('TBMABase0', 0),
+            ('TBMBBase0', 0),
+            ('TBMAAutoReset', 0),
+            ('TBMBAutoReset', 0),
+            ('TBMANoTokenPass', 0),
+            ('TBMBNoTokenPass', 0),
+            ('TBMADisablePKAMCounter', 1),
+            ('TBMBDisablePKAMCounter', 1),
+            ('TBMAPKAMCount', 5),
+            ('TBMBPKAMCount', 5),
+        ]
+
+        # TBM parameter -> (TBM core, register in pxar file), and default value if no file is found
+        self.tbmTable = [
+            ('TBMPLLDelay', 'a', 'basee', 52),
+            ('TBMADelay', 'a', 'basea', 100),
+            ('TBMBDelay', 'b', 'basea', 100),
+        ]
+
+    # test folders of the module: fulltests, followed by X-ray qualifications
     def getLocalModuleDataPath(self, ModuleID, options = {}):
-
-        pathParts = self.dataPath.split('/')
-        pathParts.append("%s_FullQualification_*"%ModuleID)
-        pathParts.append("*_%s"%(options['Test'] if 'Test' in options else 'm20'))
-
-        if len(pathParts[0]) == 0 or pathParts[0][-1] == ":":
-            pathParts[0] = pathParts[0] + '/'
-
-        globPath = os.path.join(*pathParts)
-        folders = glob.glob(globPath)
-        folders.sort()
-
-        # add Xray qualifications
-        pathParts = self.dataPath.split('/')
-        pathParts.append("%s_Xray*_*"%ModuleID)
-        pathParts.append("*_%s"%options['tempnominal'])
-        if len(pathParts[0]) == 0 or pathParts[0][-1] == ":":
-            pathParts[0] = pathParts[0] + '/'
-        globPath = os.path.join(*pathParts)
-        foldersXray = glob.glob(globPath)
-        if len(foldersXray) > 0:
-            foldersXray.sort()
-            folders += foldersXray
-
-
+        folders = self.index.getTestFolders(ModuleID, "%s_FullQualification_*"%ModuleID, "*_%s"%(options['Test'] if 'Test' in options else 'm20'))
+        folders += self.index.getTestFolders(ModuleID, "%s_Xray*_*"%ModuleID, "*_%s"%options['tempnominal'])
         return folders
 
+    # test folders of all X-ray qualifications of the module, the hot pixels don't depend on the temperature
+    def getLocalModuleXrayPath(self, ModuleID):
+        return self.index.getTestFolders(ModuleID, "%s_Xray*_*"%ModuleID, "*")
 
-    def getRocDacs(self, ModuleID, options = {}):
-        dacs = []
-
-        localModuleDataPaths = self.getLocalModuleDataPath(ModuleID=ModuleID, options=options)
-
-        dacsFound = False
+    # first folder which contains one of the files, None if there is none
+    def getParameterFolder(self, localModuleDataPaths, fileNames):
         for localModuleDataPath in localModuleDataPaths:
-            for iROC in range(self.nROCs):
-                dacFileName = os.path.join(localModuleDataPath, "dacParameters%s_C%d.dat"%(options['TrimValue'] if 'TrimValue' in options else '', iROC))
-                rocDACs = []
-                if os.path.isfile(dacFileName):
-                    with open(dacFileName, 'r') as dacFile:
-                        for line in dacFile:
-                            dacLine = [x.lower() for x in line.strip().split(' ') if len(x) > 0]
-                            if dacLine[1] in self.dacTable:
-                                rocDACs.append({'Name': self.dacTable[dacLine[1]], 'Value': dacLine[2]})
-                    dacsFound = True
-                    dacs.append({'ROC': iROC, 'DACs': rocDACs})
-            if dacsFound:
+            if any(self.index.hasFile(localModuleDataPath, fileName) for fileName in fileNames):
                 if len(localModuleDataPaths) > 1:
                     print "more than one folder found, using this one:"
                     print "  ->", localModuleDataPath
-                break
+                return localModuleDataPath
+        return None
+
+    # names, modification times and sizes of all files of the module which are read for this data kind
+    def getInputFingerprint(self, ModuleID, dataKind, options = {}):
+        filePatterns = {
+            'dac': ['dacParameters{TrimValue}_C*.dat'],
+            'trim': ['trimParameters{TrimValue}_C*.dat'],
+            'tbm': ['tbmParameters{TrimValue}_C*.dat', 'tbmParameters_C*.dat'],
+            'mask': ['maskFile*.dat'],
+            'iana': ['readbackCal_C*.dat'],
+        }
+        if dataKind not in filePatterns:
+            return None
 
+        if dataKind == 'mask':
+            localModuleDataPaths = self.getLocalModuleXrayPath(ModuleID)
+        else:
+            localModuleDataPaths = self.getLocalModuleDataPath(ModuleID=ModuleID, options=options)
 
-        return dacs
+        inputFiles = []
+        for localModuleDataPath in localModuleDataPaths:
+            fileNames = []
+            for filePattern in filePatterns[dataKind]:
+                fileNames += self.index.getFiles(localModuleDataPath, filePattern.format(TrimValue=options['TrimValue'] if 'TrimValue' in options else ''))
+            for fileName in sorted(set(fileNames)):
+                fileStat = os.stat(fileName)
+                inputFiles.append([fileName, fileStat.st_mtime, fileStat.st_size])
+        return inputFiles
+
+    def getRocDacs(self, ModuleID, options = {}):
+        dacs = ParameterMatrix([], [], 'i')
 
+        dacFileNames = ["dacParameters%s_C%d.dat"%(options['TrimValue'] if 'TrimValue' in options else '', iROC) for iROC in range(self.nROCs)]
+        localModuleDataPath = self.getParameterFolder(self.getLocalModuleDataPath(ModuleID=ModuleID, options=options), dacFileNames)
+        if localModuleDataPath:
+            for iROC in range(self.nROCs):
+                if self.index.hasFile(localModuleDataPath, dacFileNames[iROC]):
+                    dacs.addRoc(iROC)
+                    for dacName, dacValue in readParameterFile(os.path.join(localModuleDataPath, dacFileNames[iROC])):
+                        if dacName in self.dacTable:
+                            dacs.set(iROC, self.dacTable[dacName], dacValue)
 
-    def getTrimBits(self, ModuleID, options = {}):
+        return dacs
 
-        trims = []
-        localModuleDataPaths = self.getLocalModuleDataPath(ModuleID=ModuleID, options=options)
+    def getTrimBits(self, ModuleID, options = {}):
+        trims = PixelArray([], self.nPix)
 
-        trimsFound = False
-        for localModuleDataPath in localModuleDataPaths:
+        trimFileNames = ["trimParameters%s_C%d.dat"%(options['TrimValue'] if 'TrimValue' in options else '', iROC) for iROC in range(self.nROCs)]
+        localModuleDataPath = self.getParameterFolder(self.getLocalModuleDataPath(ModuleID=ModuleID, options=options), trimFileNames)
+        if localModuleDataPath:
             for iROC in range(self.nROCs):
-                trimFileName = os.path.join(localModuleDataPath, "trimParameters%s_C%d.dat" %(options['TrimValue'] if 'TrimValue' in options else '', iROC))
-                rocTrims = [self.defaultTrim]*self.nPix
-                if os.path.isfile(trimFileName):
-                    trimsFound = True
-                    with open(trimFileName, 'r') as trimFile:
-                        for line in trimFile:
-                            trimLine = [x.lower() for x in line.strip().split(' ') if len(x) > 0]
-                            if trimLine[1].lower() == 'pix':
-                                iPix = int(trimLine[2]) * self.nRows + int(trimLine[3])
-                                rocTrims[iPix] = int(trimLine[0])
-                            else:
-                                raise NameError('invalid trim bits file format!')
-                    trims.append({'ROC': iROC, 'Trims': rocTrims})
-            if trimsFound:
-                if len(localModuleDataPaths) > 1:
-                    print "more than one folder found, using this one:"
-                    print "  ->", localModuleDataPath
-                break
+                if self.index.hasFile(localModuleDataPath, trimFileNames[iROC]):
+                    trims.setRoc(iROC, readTrimFile(os.path.join(localModuleDataPath, trimFileNames[iROC]), self.nRows, self.nPix, self.defaultTrim))
 
         return trims
 
+    # ------------------------------------------------------------------------------------------------------------------
+    # TBM registers from tbmParameters[trim]_C{TBM}{core}.dat, for L1 modules for both TBMs
+    # ------------------------------------------------------------------------------------------------------------------
     def getTbmParameters(self, ModuleID, options={}):
-        raise NotImplementedError('getTbmParameters() not implemented!')
\ No newline at end of file
+        tbm = ParameterMatrix([], [], 'i')
+        trimValue = options['TrimValue'] if 'TrimValue' in options else ''
+        tbmIds = range(2) if ModuleID.upper().startswith('M1') else range(1)
+
+        # files are written with and without trim value
+        tbmFileNames = dict([((tbmId, tbmCore), ["tbmParameters%s_C%d%s.dat"%(trimValue, tbmId, tbmCore), "tbmParameters_C%d%s.dat"%(tbmId, tbmCore)]) for tbmId in tbmIds for tbmCore in 'ab'])
+        localModuleDataPath = self.getParameterFolder(self.getLocalModuleDataPath(ModuleID=ModuleID, options=options), sum(tbmFileNames.values(), []))
+
+        for tbmId in tbmIds:
+            for tbmParameterName, tbmParameterValue in self.defaultTbmParameters:
+                tbm.set(tbmId, tbmParameterName, tbmParameterValue)
+
+            if localModuleDataPath:
+                registers = {}
+                for tbmCore in 'ab':
+                    for tbmFileName in tbmFileNames[(tbmId, tbmCore)]:
+                        if self.index.hasFile(localModuleDataPath, tbmFileName):
+                            registers[tbmCore] = dict(readParameterFile(os.path.join(localModuleDataPath, tbmFileName)))
+                            break
+                for tbmParameterName, tbmCore, tbmRegister, tbmParameterDefault in self.tbmTable:
+                    try:
+                        tbmParameterValue = parseInteger(registers[tbmCore][tbmRegister])
+                    except:
+                        raise NameError("can't read TBM parameter {tbmRegister} of TBM core {tbmId}{tbmCore} from {path}".format(tbmRegister=tbmRegister, tbmId=tbmId, tbmCore=tbmCore, path=localModuleDataPath))
+                    if self.verbose:
+                        print '    -> TBM: Core{tbmId}{tbmCore}_{tbmRegister} = {value}'.format(tbmId=tbmId, tbmCore=tbmCore, tbmRegister=tbmRegister, value=tbmParameterValue)
+                    tbm.set(tbmId, tbmParameterName, tbmParameterValue)
+            else:
+                for tbmParameterName, tbmCore, tbmRegister, tbmParameterDefault in self.tbmTable:
+                    tbm.set(tbmId, tbmParameterName, tbmParameterDefault)
+
+        if localModuleDataPath:
+            print "  -> TBM parameters read for {ModuleID}".format(ModuleID=ModuleID)
+        else:
+            print "WARNING: no TBM parameter files found, using default 160/400 phases + channel delays"
+        return tbm
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # mask bits from the hot pixel mask file maskFile*.dat of the last X-ray test, as for the DB: 0=unmasked, 1=masked
+    # ------------------------------------------------------------------------------------------------------------------
+    def getMaskBits(self, ModuleID, options={}):
+        masks = PixelBitset.filled(range(self.nROCs), self.nPix, self.defaultMask)
+
+        maskFileNames = []
+        for localModuleDataPath in self.getLocalModuleXrayPath(ModuleID):
+            maskFileNames = self.index.getFiles(localModuleDataPath, 'maskFile*.dat') or maskFileNames
+
+        if len(maskFileNames) < 1:
+            print "WARNING: no X-ray test found for this module, using unmasked configuration!"
+            return masks
+
+        print "    -> X-ray hot pixels from", maskFileNames[0]
+        for maskType, maskAddress in readMaskFile(maskFileNames[0]):
+            rocPos = maskAddress[0]
+            if rocPos not in masks.rocIndex:
+                raise NameError("ERROR: mask file contains pixels of ROC %d, which does not exist on the module!"%rocPos)
+            if maskType == 'pix':
+                maskedPixels = [maskAddress[1] * self.nRows + maskAddress[2]]
+            elif maskType == 'col':
+                maskedPixels = range(maskAddress[1] * self.nRows, (maskAddress[1] + 1) * self.nRows)
+            elif maskType == 'row':
+                maskedPixels = range(maskAddress[1], self.nPix, self.nRows)
+            else:
+                maskedPixels = range(self.nPix)
+            if self.verbose:
+                print "%d pixels MASKED on ROC %d:"%(len(maskedPixels), rocPos), maskType, maskAddress[1:]
+            for maskedPixel in maskedPixels:
+                masks.set(rocPos, maskedPixel, 1)
+
+        return masks
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # readback calibration constants from readbackCal_C{ROC}.dat of the fulltest
+    # ------------------------------------------------------------------------------------------------------------------
+    def getReadbackCalibration(self, ModuleID, options = {}):
+        readbackCalibration = ParameterMatrix([], [], 'd')
+
+        readbackFileNames = ["readbackCal_C%d.dat"%iRoc for iRoc in range(self.nROCs)]
+        localModuleDataPath = self.getParameterFolder(self.getLocalModuleDataPath(ModuleID=ModuleID, options=options), readbackFileNames)
+        if not localModuleDataPath:
+            print "WARNING: no readback calibration files found for this module!"
+            return readbackCalibration
+
+        for iRoc in range(self.nROCs):
+            readbackCalibration.addRoc(iRoc)
+            readbackFileName = os.path.join(localModuleDataPath, readbackFileNames[iRoc])
+            if not self.index.hasFile(localModuleDataPath, readbackFileNames[iRoc]):
+                print "\x1b[31mERROR: readback calibration file %s not found -> setting all parameters to 0!\x1b[0m"%readbackFileName
+                for readbackParameter in self.readbackParameters:
+                    readbackCalibration.set(iRoc, readbackParameter, 0)
+                continue
+            data = dict(readParameterFile(readbackFileName))
+            for readbackParameter in self.readbackParameters:
+                try:
+                    parameterValue = float(data[readbackParameter])
+                except:
+                    print "\x1b[31mERROR: failed to extract parameter '%s' for ROC%d from file %s -> setting it to 0!\x1b[0m"%(readbackParameter, iRoc, readbackFileName)
+                    parameterValue = 0
+                readbackCalibration.set(iRoc, readbackParameter, parameterValue)
+
+        return readbackCalibration
\ No newline at end of file
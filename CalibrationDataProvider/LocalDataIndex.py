@@ -0,0 +1,220 @@
+import fnmatch
+import tempfile
+import json
+import time
+import os
+
+# folder and file names as str, as returned by os.listdir()
+def decodeStrings(values):
+    decode = lambda x: x.encode('utf-8') if isinstance(x, unicode) else x
+    return dict([(decode(key), [decode(x) for x in value] if isinstance(value, list) else decode(value)) for key, value in values.items()])
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#  index of the pxar data folder: module -> qualification folders -> test folders -> parameter files
+# ----------------------------------------------------------------------------------------------------------------------
+#  the folder tree is listed once, after that all lookups of the LocalData data source are dictionary hits. The index
+#  is built when the data source is created, so worker processes forked later share it.
+#    {dataPath}/{ModuleID}_{qualification}/{test folder}/{file}
+#  indexFileName: the index is stored in this file and reused by the next runs, None to keep it only in memory
+#  filePatterns:  only file names matching one of these patterns are indexed
+#  Folders are checked with their modification time, which changes when entries are added or removed: the data path
+#  when the index is loaded, the folders of a module when it is looked up for the first time. Changed folders are
+#  listed again, so a persisted index stays valid while new tests are added to the tree.
+# ----------------------------------------------------------------------------------------------------------------------
+class LocalDataIndex(object):
+
+    indexVersion = 1
+
+    def __init__(self, dataPath, indexFileName = None, filePatterns = ['*.dat'], verbose = False):
+        self.dataPath = dataPath
+        self.indexFileName = indexFileName
+        self.filePatterns = list(filePatterns)
+        self.verbose = verbose
+
+        # folders modified less than this number of seconds before they were listed are listed again next time, since
+        # a change within the same second would not change the modification time
+        self.racyInterval = 2
+
+        # qualification folder -> {'mtime': ..., 'tests': {test folder -> {'mtime': ..., 'files': [...]}}}
+        self.qualifications = {}
+        self.rootMtime = None
+        # ModuleID -> qualification folders, derived from self.qualifications
+        self.moduleQualifications = {}
+        # modules whose folders were already checked in this process
+        self.validatedModules = set()
+
+        self.nListed = 0
+        self.load()
+        self.update()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # persistence
+    # ------------------------------------------------------------------------------------------------------------------
+    def load(self):
+        if not self.indexFileName or not os.path.isfile(self.indexFileName):
+            return
+        try:
+            with open(self.indexFileName, 'r') as indexFile:
+                index = json.load(indexFile, object_hook=decodeStrings)
+            if index['version'] == self.indexVersion and index['dataPath'] == os.path.abspath(self.dataPath) and index['filePatterns'] == self.filePatterns:
+                self.qualifications = index['qualifications']
+                self.rootMtime = index['mtime']
+        except Exception as e:
+            print "\x1b[31mcould not read local data index %s: %s\x1b[0m"%(self.indexFileName, e)
+            self.qualifications = {}
+            self.rootMtime = None
+
+    def save(self):
+        if not self.indexFileName:
+            return
+        index = {
+            'version': self.indexVersion,
+            'dataPath': os.path.abspath(self.dataPath),
+            'filePatterns': self.filePatterns,
+            'mtime': self.rootMtime,
+            'qualifications': self.qualifications,
+        }
+        outputFolder = os.path.dirname(self.indexFileName)
+        try:
+            temporaryFile, temporaryFileName = tempfile.mkstemp(dir=outputFolder if outputFolder else '.', prefix='.' + os.path.basename(self.indexFileName) + '.', suffix='.tmp')
+            with os.fdopen(temporaryFile, 'w') as indexFile:
+                json.dump(index, indexFile, separators=(',', ':'))
+            # mkstemp() creates the file only readable by the user, the index can be shared
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temporaryFileName, 0666 & ~umask)
+            if os.name == 'nt' and os.path.isfile(self.indexFileName):
+                os.remove(self.indexFileName)
+            os.rename(temporaryFileName, self.indexFileName)
+        except Exception as e:
+            print "\x1b[31mcould not write local data index %s: %s\x1b[0m"%(self.indexFileName, e)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # listing of folders
+    # ------------------------------------------------------------------------------------------------------------------
+
+    # modification time of the folder, None if it does not exist or was modified just now
+    def getFolderMtime(self, folderName):
+        try:
+            mtime = os.stat(folderName).st_mtime
+        except OSError:
+            return None
+        return mtime if mtime < time.time() - self.racyInterval else None
+
+    # names of the sub folders, or of the files matching the file patterns, hidden entries are ignored like by glob
+    def listFolder(self, folderName, folders):
+        self.nListed += 1
+        try:
+            names = os.listdir(folderName)
+        except OSError:
+            return []
+        names = [x for x in names if not x.startswith('.')]
+        if folders:
+            return sorted([x for x in names if os.path.isdir(os.path.join(folderName, x))])
+        else:
+            return sorted([x for x in names if any(fnmatch.fnmatchcase(x, pattern) for pattern in self.filePatterns)])
+
+    def listQualification(self, qualificationName, qualification = None):
+        qualificationPath = os.path.join(self.dataPath, qualificationName)
+        oldTests = qualification['tests'] if qualification else {}
+        tests = {}
+        for testName in self.listFolder(qualificationPath, folders=True):
+            test = oldTests[testName] if testName in oldTests else None
+            self.validateTest(os.path.join(qualificationPath, testName), test)
+            tests[testName] = test if test else self.listTest(os.path.join(qualificationPath, testName))
+        return {'mtime': self.getFolderMtime(qualificationPath), 'tests': tests}
+
+    def listTest(self, testPath):
+        return {'mtime': self.getFolderMtime(testPath), 'files': self.listFolder(testPath, folders=False)}
+
+    # updates the test entry if the folder was changed, returns True if it was
+    def validateTest(self, testPath, test):
+        if test is None:
+            return False
+        mtime = self.getFolderMtime(testPath)
+        if mtime is None or mtime != test['mtime']:
+            test.update(self.listTest(testPath))
+            return True
+        return False
+
+    # lists the data path again if it was changed, new qualification folders are listed completely
+    def update(self):
+        mtime = self.getFolderMtime(self.dataPath)
+        if mtime is not None and mtime == self.rootMtime:
+            self.indexModules()
+            return
+
+        startTime = time.time()
+        qualifications = {}
+        for qualificationName in self.listFolder(self.dataPath, folders=True):
+            if '_' in qualificationName:
+                if qualificationName in self.qualifications:
+                    qualifications[qualificationName] = self.qualifications[qualificationName]
+                else:
+                    qualifications[qualificationName] = self.listQualification(qualificationName)
+        self.qualifications = qualifications
+        self.rootMtime = mtime
+        self.indexModules()
+        self.save()
+        if self.verbose:
+            print "  -> local data index: %d qualification folders, %d folders listed in %1.1f s"%(len(self.qualifications), self.nListed, time.time() - startTime)
+
+    def indexModules(self):
+        self.moduleQualifications = {}
+        for qualificationName in self.qualifications.keys():
+            ModuleID = qualificationName.split('_', 1)[0]
+            if ModuleID not in self.moduleQualifications:
+                self.moduleQualifications[ModuleID] = []
+            self.moduleQualifications[ModuleID].append(qualificationName)
+
+    # checks the folders of the module once per process and lists changed ones again
+    def validateModule(self, ModuleID):
+        if ModuleID in self.validatedModules:
+            return
+        self.validatedModules.add(ModuleID)
+
+        changed = False
+        for qualificationName in self.moduleQualifications.get(ModuleID, []):
+            qualification = self.qualifications[qualificationName]
+            qualificationPath = os.path.join(self.dataPath, qualificationName)
+            mtime = self.getFolderMtime(qualificationPath)
+            if mtime is None or mtime != qualification['mtime']:
+                self.qualifications[qualificationName] = self.listQualification(qualificationName, qualification)
+                changed = True
+            else:
+                for testName, test in qualification['tests'].items():
+                    changed = self.validateTest(os.path.join(qualificationPath, testName), test) or changed
+        if changed:
+            self.save()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # lookups
+    # ------------------------------------------------------------------------------------------------------------------
+
+    # sorted paths of the test folders of the module, as glob('{dataPath}/{qualificationPattern}/{testPattern}')
+    def getTestFolders(self, ModuleID, qualificationPattern, testPattern):
+        self.validateModule(ModuleID)
+        folders = []
+        for qualificationName in self.moduleQualifications.get(ModuleID, []):
+            if fnmatch.fnmatchcase(qualificationName, qualificationPattern):
+                for testName in self.qualifications[qualificationName]['tests'].keys():
+                    if fnmatch.fnmatchcase(testName, testPattern):
+                        folders.append(os.path.join(self.dataPath, qualificationName, testName))
+        return sorted(folders)
+
+    # indexed file names of a test folder returned by getTestFolders()
+    def getFileNames(self, testFolder):
+        qualificationPath, testName = os.path.split(testFolder)
+        qualificationName = os.path.basename(qualificationPath)
+        try:
+            return self.qualifications[qualificationName]['tests'][testName]['files']
+        except KeyError:
+            return []
+
+    def hasFile(self, testFolder, fileName):
+        return fileName in self.getFileNames(testFolder)
+
+    # sorted paths of the files in the test folder matching the pattern
+    def getFiles(self, testFolder, filePattern):
+        return [os.path.join(testFolder, x) for x in self.getFileNames(testFolder) if fnmatch.fnmatchcase(x, filePattern)]
@@ -0,0 +1,343 @@
+import array
+
+# ----------------------------------------------------------------------------------------------------------------------
+#  compact typed containers for the calibration data of a module
+# ----------------------------------------------------------------------------------------------------------------------
+#  all containers keep the ROC IDs in the order given by the data source and one block of values per ROC:
+#    PixelArray:      e.g. trimbits, one unsigned byte per pixel, all ROCs in one bytearray (pixel = col * 80 + row)
+#    PixelBitset:     e.g. mask bits, one bit per pixel, 4160 pixels packed into 520 bytes per ROC
+#    ParameterMatrix: e.g. DACs, ROC x parameter matrix of numbers with a name -> column index
+#  filled() containers share one immutable buffer for all instances, which is only copied on the first modification
+#  the old format (list of dicts: [{'ROC': 0, 'Trims': [...]}, ...]) is converted with the to...() adapter functions
+# ----------------------------------------------------------------------------------------------------------------------
+
+# immutable buffers shared by all filled containers, (size, byte value) -> str
+sharedBuffers = {}
+
+
+def getSharedBuffer(size, value):
+    if (size, value) not in sharedBuffers:
+        sharedBuffers[(size, value)] = chr(value) * size
+    return sharedBuffers[(size, value)]
+
+
+class PixelArray(object):
+    __slots__ = ('rocs', 'rocIndex', 'nPix', 'data')
+
+    def __init__(self, rocs = None, nPix = 4160, data = None):
+        self.rocs = list(rocs) if rocs else []
+        self.rocIndex = dict([(roc, i) for i, roc in enumerate(self.rocs)])
+        self.nPix = nPix
+        self.data = data if data is not None else bytearray(len(self.rocs) * nPix)
+
+    # all pixels of all ROCs set to the same value, sharing the buffer with all other containers filled with this value
+    @classmethod
+    def filled(cls, rocs, nPix = 4160, value = 0):
+        rocs = list(rocs)
+        return cls(rocs, nPix, getSharedBuffer(len(rocs) * nPix, value))
+
+    def __len__(self):
+        return len(self.rocs)
+
+    # shared str buffers are immutable, make a private copy before the first modification
+    def makeWritable(self):
+        if not isinstance(self.data, bytearray):
+            self.data = bytearray(self.data)
+
+    def addRoc(self, roc, value = 0):
+        if roc not in self.rocIndex:
+            self.makeWritable()
+            self.rocIndex[roc] = len(self.rocs)
+            self.rocs.append(roc)
+            self.data.extend(chr(value) * self.nPix)
+        return self.rocIndex[roc]
+
+    # returns the values of all pixels of a ROC as bytearray
+    def getRoc(self, roc):
+        offset = self.rocIndex[roc] * self.nPix
+        return bytearray(self.data[offset:offset + self.nPix])
+
+    def setRoc(self, roc, values):
+        values = bytearray([int(x) for x in values]) if not isinstance(values, (bytearray, str)) else values
+        if len(values) != self.nPix:
+            raise ValueError("ROC %r: %d values given for %d pixels"%(roc, len(values), self.nPix))
+        offset = self.addRoc(roc) * self.nPix
+        self.makeWritable()
+        self.data[offset:offset + self.nPix] = values
+
+    def get(self, roc, pixel):
+        value = self.data[self.rocIndex[roc] * self.nPix + pixel]
+        return ord(value) if isinstance(value, str) else value
+
+    def set(self, roc, pixel, value):
+        offset = self.addRoc(roc) * self.nPix
+        self.makeWritable()
+        self.data[offset + pixel] = value
+
+    # new container with a subset of the ROCs, e.g. for L1 pseudo half-modules
+    def select(self, rocs):
+        selectedRocs = [roc for roc in rocs if roc in self.rocIndex]
+        return PixelArray(selectedRocs, self.nPix, bytearray().join([self.data[self.rocIndex[roc] * self.nPix:(self.rocIndex[roc] + 1) * self.nPix] for roc in selectedRocs]))
+
+    @classmethod
+    def fromDicts(cls, rocsData, key = 'Trims', nPix = 4160):
+        pixelArray = cls([], nPix)
+        for rocData in rocsData:
+            pixelArray.setRoc(rocData['ROC'], rocData[key])
+        return pixelArray
+
+    def toDicts(self, key = 'Trims'):
+        return [{'ROC': roc, key: list(self.getRoc(roc))} for roc in self.rocs]
+
+
+class PixelBitset(object):
+    __slots__ = ('rocs', 'rocIndex', 'nPix', 'nBytes', 'data')
+
+    # byte -> 8 bytes with values 0/1 (lowest bit first) and reverse
+    unpackTable = [''.join([chr((byte >> bit) & 1) for bit in range(8)]) for byte in range(256)]
+    packTable = dict([(bits, byte) for byte, bits in enumerate(unpackTable)])
+
+    def __init__(self, rocs = None, nPix = 4160, data = None):
+        self.rocs = list(rocs) if rocs else []
+        self.rocIndex = dict([(roc, i) for i, roc in enumerate(self.rocs)])
+        self.nPix = nPix
+        self.nBytes = (nPix + 7) // 8
+        self.data = data if data is not None else bytearray(len(self.rocs) * self.nBytes)
+
+    @classmethod
+    def filled(cls, rocs, nPix = 4160, value = 0):
+        rocs = list(rocs)
+        return cls(rocs, nPix, getSharedBuffer(len(rocs) * ((nPix + 7) // 8), 0xFF if value else 0))
+
+    def __len__(self):
+        return len(self.rocs)
+
+    def makeWritable(self):
+        if not isinstance(self.data, bytearray):
+            self.data = bytearray(self.data)
+
+    def addRoc(self, roc, value = 0):
+        if roc not in self.rocIndex:
+            self.makeWritable()
+            self.rocIndex[roc] = len(self.rocs)
+            self.rocs.append(roc)
+            self.data.extend(chr(0xFF if value else 0) * self.nBytes)
+        return self.rocIndex[roc]
+
+    # returns the bits of all pixels of a ROC as bytearray with values 0/1
+    def getRoc(self, roc):
+        offset = self.rocIndex[roc] * self.nBytes
+        return bytearray(''.join([self.unpackTable[byte] for byte in bytearray(self.data[offset:offset + self.nBytes])])[:self.nPix])
+
+    def setRoc(self, roc, values):
+        if len(values) != self.nPix:
+            raise ValueError("ROC %r: %d values given for %d pixels"%(roc, len(values), self.nPix))
+        bits = str(bytearray([1 if x else 0 for x in values])) + '\x00' * (self.nBytes * 8 - self.nPix)
+        offset = self.addRoc(roc) * self.nBytes
+        self.makeWritable()
+        self.data[offset:offset + self.nBytes] = bytearray([self.packTable[bits[i:i + 8]] for i in range(0, len(bits), 8)])
+
+    def get(self, roc, pixel):
+        byte = self.data[self.rocIndex[roc] * self.nBytes + (pixel >> 3)]
+        return ((ord(byte) if isinstance(byte, str) else byte) >> (pixel & 7)) & 1
+
+    def set(self, roc, pixel, value = 1):
+        position = self.addRoc(roc) * self.nBytes + (pixel >> 3)
+        self.makeWritable()
+        if value:
+            self.data[position] |= 1 << (pixel & 7)
+        else:
+            self.data[position] &= ~(1 << (pixel & 7)) & 0xFF
+
+    # number of pixels with bit set
+    def count(self, roc):
+        return self.getRoc(roc).count('\x01')
+
+    def select(self, rocs):
+        selectedRocs = [roc for roc in rocs if roc in self.rocIndex]
+        return PixelBitset(selectedRocs, self.nPix, bytearray().join([self.data[self.rocIndex[roc] * self.nBytes:(self.rocIndex[roc] + 1) * self.nBytes] for roc in selectedRocs]))
+
+    @classmethod
+    def fromDicts(cls, rocsData, key = 'Masks', nPix = 4160):
+        pixelBitset = cls([], nPix)
+        for rocData in rocsData:
+            pixelBitset.setRoc(rocData['ROC'], rocData[key])
+        return pixelBitset
+
+    def toDicts(self, key = 'Masks'):
+        return [{'ROC': roc, key: list(self.getRoc(roc))} for roc in self.rocs]
+
+
+class ParameterMatrix(object):
+    __slots__ = ('rocs', 'rocIndex', 'names', 'nameIndex', 'typecode', 'values', 'present')
+
+    # typecode: 'i' for integer parameters (DACs, TBM registers), 'd' for floating point numbers (readback calibration)
+    def __init__(self, rocs = None, names = None, typecode = 'i'):
+        self.typecode = typecode
+        self.rocs = []
+        self.rocIndex = {}
+        self.names = []
+        self.nameIndex = {}
+        self.values = array.array(typecode)
+        # 1 if the value is set, 0 if this parameter does not exist for this ROC
+        self.present = bytearray()
+
+        for name in (names if names else []):
+            self.addName(name)
+        for roc in (rocs if rocs else []):
+            self.addRoc(roc)
+
+    def __len__(self):
+        return len(self.rocs)
+
+    def addRoc(self, roc):
+        if roc not in self.rocIndex:
+            self.rocIndex[roc] = len(self.rocs)
+            self.rocs.append(roc)
+            self.values.extend([0] * len(self.names))
+            self.present.extend(bytearray(len(self.names)))
+        return self.rocIndex[roc]
+
+    def addName(self, name):
+        if name not in self.nameIndex:
+            nNames = len(self.names)
+            if len(self.rocs) > 0:
+                # insert new column into all rows
+                values = array.array(self.typecode)
+                present = bytearray()
+                for i in range(len(self.rocs)):
+                    values.extend(self.values[i * nNames:(i + 1) * nNames])
+                    values.append(0)
+                    present.extend(self.present[i * nNames:(i + 1) * nNames])
+                    present.append(0)
+                self.values = values
+                self.present = present
+            self.nameIndex[name] = nNames
+            self.names.append(name)
+        return self.nameIndex[name]
+
+    def convertValue(self, value):
+        return float(value) if self.typecode in 'fd' else int(value)
+
+    def set(self, roc, name, value):
+        nameIndex = self.addName(name)
+        position = self.addRoc(roc) * len(self.names) + nameIndex
+        self.values[position] = self.convertValue(value)
+        self.present[position] = 1
+
+    def get(self, roc, name, default = None):
+        if roc in self.rocIndex and name in self.nameIndex:
+            position = self.rocIndex[roc] * len(self.names) + self.nameIndex[name]
+            if self.present[position]:
+                return self.values[position]
+        return default
+
+    def has(self, roc, name):
+        return self.get(roc, name) is not None
+
+    # returns list of (name, value) for all parameters of a ROC, in the order in which they were added
+    def getRoc(self, roc):
+        offset = self.rocIndex[roc] * len(self.names)
+        return [(name, self.values[offset + i]) for i, name in enumerate(self.names) if self.present[offset + i]]
+
+    def select(self, rocs):
+        parameterMatrix = ParameterMatrix([], self.names, self.typecode)
+        nNames = len(self.names)
+        for roc in rocs:
+            if roc in self.rocIndex:
+                offset = self.rocIndex[roc] * nNames
+                parameterMatrix.rocIndex[roc] = len(parameterMatrix.rocs)
+                parameterMatrix.rocs.append(roc)
+                parameterMatrix.values.extend(self.values[offset:offset + nNames])
+                parameterMatrix.present.extend(self.present[offset:offset + nNames])
+        return parameterMatrix
+
+    def copy(self):
+        return self.select(self.rocs)
+
+    # returns matrix with the given ROCs and names in this order, e.g. to arrange the values in the same layout as
+    # another matrix. parameters which don't exist in this matrix are not present
+    def reindex(self, rocs, names):
+        parameterMatrix = ParameterMatrix([], names, self.typecode)
+        nNames = len(self.names)
+        columns = [self.nameIndex[name] if name in self.nameIndex else None for name in names]
+        for roc in rocs:
+            parameterMatrix.rocIndex[roc] = len(parameterMatrix.rocs)
+            parameterMatrix.rocs.append(roc)
+            if roc in self.rocIndex:
+                offset = self.rocIndex[roc] * nNames
+                parameterMatrix.values.extend([self.values[offset + column] if column is not None else 0 for column in columns])
+                parameterMatrix.present.extend([self.present[offset + column] if column is not None else 0 for column in columns])
+            else:
+                parameterMatrix.values.extend([0] * len(names))
+                parameterMatrix.present.extend(bytearray(len(names)))
+        return parameterMatrix
+
+    # rocsData: [{'ROC': 0, key: [{'Name': 'Vana', 'Value': '81'}, ...]}, ...]
+    @classmethod
+    def fromDicts(cls, rocsData, key = 'DACs', typecode = 'i'):
+        parameterMatrix = cls([], [], typecode)
+        for rocData in rocsData:
+            parameterMatrix.addRoc(rocData['ROC'])
+            for parameter in rocData[key]:
+                parameterMatrix.set(rocData['ROC'], parameter['Name'], parameter['Value'])
+        return parameterMatrix
+
+    def toDicts(self, key = 'DACs', valueFormat = None):
+        return [{'ROC': roc, key: [{'Name': name, 'Value': valueFormat%value if valueFormat else value} for name, value in self.getRoc(roc)]} for roc in self.rocs]
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#  all calibration data of a module
+# ----------------------------------------------------------------------------------------------------------------------
+#    dacs:     ParameterMatrix ROC x DAC, integer values
+#    trims:    PixelArray with trimbits
+#    masks:    PixelBitset with mask bits, 0=unmasked, 1=masked
+#    tbm:      ParameterMatrix TBM x register, integer values. one row (TBM 0) for L2/3/4 modules, two rows for L1
+#    readback: ParameterMatrix ROC x readback calibration constant, floating point values
+# ----------------------------------------------------------------------------------------------------------------------
+class ModuleCalibration(object):
+    __slots__ = ('moduleID', 'dacs', 'trims', 'masks', 'tbm', 'readback')
+
+    def __init__(self, moduleID, dacs = None, trims = None, masks = None, tbm = None, readback = None):
+        self.moduleID = moduleID
+        self.dacs = dacs
+        self.trims = trims
+        self.masks = masks
+        self.tbm = tbm
+        self.readback = readback
+
+    def __repr__(self):
+        return "<ModuleCalibration %s: %s>"%(self.moduleID, ', '.join(['%s=%d ROCs'%(x, len(getattr(self, x))) for x in self.__slots__[1:] if getattr(self, x) is not None]))
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#  adapters for the old list of dicts format, typed containers are returned unchanged
+# ----------------------------------------------------------------------------------------------------------------------
+def toDacs(data):
+    return data if isinstance(data, ParameterMatrix) else ParameterMatrix.fromDicts(data, 'DACs', 'i')
+
+
+def toTrims(data):
+    return data if isinstance(data, PixelArray) else PixelArray.fromDicts(data, 'Trims')
+
+
+def toMasks(data):
+    return data if isinstance(data, PixelBitset) else PixelBitset.fromDicts(data, 'Masks')
+
+
+def toReadback(data):
+    return data if isinstance(data, ParameterMatrix) else ParameterMatrix.fromDicts(data, 'ReadbackCalibration', 'd')
+
+
+# old TBM format: list of {'Name':.., 'Value':..} for one TBM, or list of two such lists for L1 modules
+def toTbm(data):
+    if isinstance(data, ParameterMatrix):
+        return data
+    if type(data) != list:
+        raise Exception("malformatted TBM data found")
+    if len(data) < 1:
+        return ParameterMatrix([], [], 'i')
+    if type(data[0]) == list:
+        return ParameterMatrix.fromDicts([{'ROC': tbmId, 'Registers': x} for tbmId, x in enumerate(data)], 'Registers', 'i')
+    return ParameterMatrix.fromDicts([{'ROC': 0, 'Registers': data}], 'Registers', 'i')
@@ -8,7 +8,17 @@ except:
     print "\x1b[31mcontinuing, but some features will not work without this module!\x1b[0m"
 
 import getpass
+import hashlib
 import urllib
+import urllib2
+import shutil
+import tempfile
+from DownloadCache import DownloadCache
+from ConnectionPool import ConnectionPool
+import PisaDBMirror
+from ModuleCalibration import PixelArray, PixelBitset, ParameterMatrix
+from multiprocessing.pool import ThreadPool
+import sqlite3
 import os
 import json
 try:
@@ -16,15 +26,36 @@ try:
 except:
     pass
 
+# DB passwords resolved in this process: (server, user) -> password. forked worker processes inherit them, so the
+# password is only asked for once, before the workers are started
+resolvedDbPasswords = {}
+
 class CalibrationDataProvider(AbstractCalibrationDataProvider):
 
-    def __init__(self, dataSource=None, verbose=False):
+    def __init__(self, dataSource=None, verbose=False, options={}):
         super(CalibrationDataProvider, self).__init__()
 
         self.verbose = verbose
 
-        # database url
+        # number of files downloaded in parallel
+        self.downloadThreads = int(options['DownloadThreads']) if 'DownloadThreads' in options else 8
+        self.downloadPool = None
+        self.downloadPoolPid = None
+
+        # persistent cache for downloaded files, disabled if no path given
+        if 'DownloadCache' in options and len(options['DownloadCache'].strip()) > 0:
+            self.downloadCache = DownloadCache(
+                cachePath=options['DownloadCache'].strip(),
+                maxSize=int(float(options['DownloadCacheSize']) * 1024 * 1024) if 'DownloadCacheSize' in options else 2000 * 1024 * 1024,
+                revalidate='DownloadCacheRevalidate' in options and '%s'%options['DownloadCacheRevalidate'] == '1',
+                verbose=verbose,
+            )
+        else:
+            self.downloadCache = None
+
+        # database url, or local mirror of the database: 'sqlite:{file name}'
         self.dataPath = dataSource
+        self.mirrorFileName = dataSource[len('sqlite:'):] if dataSource.startswith('sqlite:') else None
         self.dbServer = dataSource.replace('http://', '')
         self.dbUrl = dataSource
 
@@ -79,6 +110,53 @@ class CalibrationDataProvider(AbstractCalibrationDataProvider):
             LIMIT 20;
 '''
 
+        # bulk versions of the queries above, for many modules at once: {parameterList} is replaced by '%s, %s, ...'
+        self.queryStringFulltestsBulk = '''
+            SELECT * FROM inventory_fullmodule
+              JOIN test_fullmodulesummary ON test_fullmodulesummary.TEST_ID = LASTTEST_FULLMODULE
+              JOIN test_fullmodule ON test_fullmodule.SUMMARY_ID = LASTTEST_FULLMODULE
+              JOIN test_fullmoduleanalysis ON test_fullmoduleanalysis.TEST_ID = test_fullmodule.LASTANALYSIS_ID
+            WHERE inventory_fullmodule.FULLMODULE_ID IN ({parameterList}) AND tempnominal LIKE %s
+            ORDER BY inventory_fullmodule.FULLMODULE_ID;
+        '''
+
+        self.queryStringFulltests2Bulk = '''
+            SELECT * FROM inventory_fullmodule
+              JOIN test_fullmodule ON test_fullmodule.FULLMODULE_ID = inventory_fullmodule.FULLMODULE_ID
+              JOIN test_fullmoduleanalysis ON test_fullmoduleanalysis.TEST_ID = test_fullmodule.LASTANALYSIS_ID
+              WHERE inventory_fullmodule.FULLMODULE_ID IN ({parameterList}) AND tempnominal LIKE %s
+              ORDER BY inventory_fullmodule.FULLMODULE_ID, tempnominal, TIMESTAMP DESC;
+        '''
+
+        self.queryStringReceptionsBulk = '''
+            SELECT * FROM inventory_fullmodule
+              JOIN test_fullmodulesummary ON test_fullmodulesummary.TEST_ID = LASTTEST_RECEPTION
+              JOIN test_fullmodule ON test_fullmodule.SUMMARY_ID = LASTTEST_RECEPTION
+              JOIN test_fullmoduleanalysis ON test_fullmoduleanalysis.TEST_ID = test_fullmodule.LASTANALYSIS_ID
+            WHERE inventory_fullmodule.FULLMODULE_ID IN ({parameterList})
+            ORDER BY inventory_fullmodule.FULLMODULE_ID;
+        '''
+
+        self.queryStringFulltestDacsBulk = '''
+            SELECT * FROM test_dacparameters WHERE FULLMODULEANALYSISTEST_ID IN ({parameterList}) AND TRIM_VALUE = %s
+            ORDER BY FULLMODULEANALYSISTEST_ID, ROC_POS;
+        '''
+
+        self.queryStringXrayMaskedPixelsBulk = '''
+            SELECT inventory_fullmodule.FULLMODULE_ID, LASTTEST_XRAY_HR, ROC_POS, ADDR_PIXELS_HOT FROM inventory_fullmodule INNER JOIN Test_FullModule_XRay_HR_Summary ON inventory_fullmodule.LASTTEST_XRAY_HR = Test_FullModule_XRay_HR_Summary.TEST_ID
+              INNER JOIN Test_FullModule_XRay_HR_Roc_Analysis_Summary ON Test_FullModule_XRay_HR_Roc_Analysis_Summary.TEST_XRAY_HR_SUMMARY_ID = Test_FullModule_XRay_HR_Summary.TEST_ID AND Test_FullModule_XRay_HR_Roc_Analysis_Summary.PROCESSING_ID = Test_FullModule_XRay_HR_Summary.LAST_PROCESSING_ID
+            WHERE inventory_fullmodule.FULLMODULE_ID IN ({parameterList})
+            ORDER BY inventory_fullmodule.FULLMODULE_ID, ROC_POS;
+'''
+
+        # rows prefetched for many modules at once with prefetchModuleData() or already queried for the current chunk
+        # of modules. the caches are cleared when the next chunk is prefetched, all prefetches for the same chunk
+        # (e.g. -20 and +17 for temperature interpolation) share them
+        self.clearCache()
+        self.cachedModuleIDs = None
+        self.bulkQueryChunkSize = 200
+        self.bulkFetchSize = 1000
+
         self.dacTable = {
             'VDIG': 'Vdd',
             'VANA': 'Vana',
@@ -103,22 +181,104 @@ class CalibrationDataProvider(AbstractCalibrationDataProvider):
         }
 
         # connect to database
+        #   connections are opened when needed by each process, the first one here to check the credentials
         self.dbUser = "reader"
         self.dbName = "prod_pixel"
-        print "connect to {dbUser}@{dbServer} database: {dbName}".format(dbUser=self.dbUser, dbServer=self.dbServer, dbName=self.dbName)
-        Password = self.getDbPassword(self.dbUser)
-        self.db = MySQLdb.connect(host=self.dbServer, user=self.dbUser, passwd=Password, db=self.dbName)
+        self.connectionPool = ConnectionPool(self.connect, maxConnections=int(options['SqlConnections']) if 'SqlConnections' in options else None)
+        if self.mirrorFileName:
+            # queries run on the mirror, files are downloaded from the DB server the mirror was exported from
+            self.connectionErrors = (sqlite3.OperationalError, )
+            self.useMirrorQueries()
+            connection = self.connectionPool.acquire()
+            try:
+                mirrorInfo = PisaDBMirror.getMirrorInfo(connection)
+            finally:
+                self.connectionPool.release(connection)
+            self.dbUrl = mirrorInfo['source']
+            print "use DB mirror {fileName}, exported from {source} at {created}".format(fileName=self.mirrorFileName, source=mirrorInfo['source'], created=mirrorInfo['created'])
+        elif (self.dbServer, self.dbUser) in resolvedDbPasswords:
+            self.connectionErrors = (MySQLdb.OperationalError, )
+            self.dbCredentials = {'host': self.dbServer, 'user': self.dbUser, 'passwd': resolvedDbPasswords[(self.dbServer, self.dbUser)], 'db': self.dbName}
+        else:
+            print "connect to {dbUser}@{dbServer} database: {dbName}".format(dbUser=self.dbUser, dbServer=self.dbServer, dbName=self.dbName)
+            self.connectionErrors = (MySQLdb.OperationalError, )
+            Password = self.getDbPassword(self.dbUser)
+            self.dbCredentials = {'host': self.dbServer, 'user': self.dbUser, 'passwd': Password, 'db': self.dbName}
+            self.connectionPool.release(self.connectionPool.acquire())
+            resolvedDbPasswords[(self.dbServer, self.dbUser)] = Password
 
-        try:
-            self.saveDbPassword(self.dbUser, Password)
-        except:
-            print "could not save DB password to local file 'db.auth'"
+            try:
+                self.saveDbPassword(self.dbUser, Password)
+            except:
+                print "could not save DB password to local file 'db.auth'"
 
-        # temp folder for downloads from database
-        try:
-            os.mkdir('temp')
-        except:
-            pass
+    # ------------------------------------------------------------------------------------------------------------------
+    # forget all rows, paths and files memorized during this run
+    #   fulltestRowCache: (ModuleID, tempnominal) -> list of fulltest rows
+    #   receptionRowCache: ModuleID -> list of reception test rows
+    #   dacRowCache: (fulltest analysis ID, TrimValue) -> list of DAC rows
+    #   xrayRowCache: ModuleID -> list of X-ray rows
+    #   remoteResultsPathCache: (ModuleID, tempnominal) -> remote path of MoReWeb results
+    #   remoteResultsPathReceptionCache: ModuleID -> remote path of MoReWeb reception test results
+    #   tbmDataCache: (ModuleID, tempnominal) -> parsed TBM JSON data
+    #   remoteResultsPathVersions: remote path -> analysis ID, used as version for the download cache
+    # ------------------------------------------------------------------------------------------------------------------
+    def clearCache(self):
+        self.fulltestRowCache = {}
+        self.receptionRowCache = {}
+        self.dacRowCache = {}
+        self.xrayRowCache = {}
+        self.remoteResultsPathCache = {}
+        self.remoteResultsPathReceptionCache = {}
+        self.tbmDataCache = {}
+        self.remoteResultsPathVersions = {}
+
+    # opens a new connection to the database. all queries are read-only: with autocommit each one sees the current
+    # state of the DB without an extra commit
+    def connect(self):
+        if self.mirrorFileName:
+            return PisaDBMirror.connectMirror(self.mirrorFileName)
+        connection = MySQLdb.connect(**self.dbCredentials)
+        connection.autocommit(True)
+        return connection
+
+    # the same queries on the local mirror of the DB
+    def useMirrorQueries(self):
+        for name, queryString in PisaDBMirror.mirrorQueries.items():
+            setattr(self, name, queryString)
+
+    # returns cursor with the result of the query, rows are dictionaries
+    #   streamed: rows are read from the server while they are fetched, for large results
+    def executeQuery(self, connection, queryString, parameters, streamed = False):
+        if self.mirrorFileName:
+            return PisaDBMirror.MirrorCursor(connection, queryString, parameters)
+        cursor = connection.cursor(cursorclass=MySQLdb.cursors.SSDictCursor if streamed else MySQLdb.cursors.DictCursor)
+        cursor.execute(queryString, parameters)
+        return cursor
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # run query and return list of rows as dictionaries. the query is repeated once on a new connection if the
+    # connection was lost
+    # ------------------------------------------------------------------------------------------------------------------
+    def queryRows(self, queryString, parameters):
+        if self.verbose:
+            print "\x1b[32mSQL:", queryString % parameters, "\x1b[0m"
+        for attempt in range(2):
+            connection = self.connectionPool.acquire()
+            try:
+                cursor = self.executeQuery(connection, queryString, parameters)
+                rows = cursor.fetchall()
+                cursor.close()
+            except self.connectionErrors:
+                self.connectionPool.release(connection, broken=True)
+                if attempt > 0:
+                    raise
+                continue
+            except:
+                self.connectionPool.release(connection, broken=True)
+                raise
+            self.connectionPool.release(connection)
+            return rows
 
     def getDbPassword(self, username):
         dbPassFileName = 'db.auth'
@@ -148,24 +308,19 @@ class CalibrationDataProvider(AbstractCalibrationDataProvider):
 
     def getFulltestRow(self, ModuleID, tempnominal):
 
-        cursor = self.db.cursor(cursorclass=MySQLdb.cursors.DictCursor)
+        if (ModuleID, tempnominal) in self.fulltestRowCache:
+            rows = self.fulltestRowCache[(ModuleID, tempnominal)]
+        else:
+            # get list of fulltests
+            rows = self.queryRows(self.queryStringFulltests, (ModuleID, tempnominal + '%'))
+            if len(rows) < 1:
+                print "ERROR: no FullQualification found including tempnominal=", tempnominal," => search for single Fulltests "
+                rows = self.queryRows(self.queryStringFulltests2, (ModuleID, tempnominal + '%'))
+            self.fulltestRowCache[(ModuleID, tempnominal)] = rows
 
-        # get list of fulltests
-        if self.verbose:
-            print "\x1b[32mSQL:", self.queryStringFulltests%(ModuleID, tempnominal + '%'), "\x1b[0m"
-        cursor.execute(self.queryStringFulltests, (ModuleID, tempnominal + '%'))
-        self.db.commit()
-        rows = cursor.fetchall()
         if len(rows) < 1:
-            print "ERROR: no FullQualification found including tempnominal=", tempnominal," => search for single Fulltests "
-            if self.verbose:
-                print "\x1b[32mSQL:", self.queryStringFulltests2 % (ModuleID, tempnominal + '%'), "\x1b[0m"
-            cursor.execute(self.queryStringFulltests2, (ModuleID, tempnominal + '%'))
-            self.db.commit()
-            rows = cursor.fetchall()
-            if len(rows) < 1:
-                print "\x1b[31mERROR: no Fulltests found for tempnominal=", tempnominal,"\x1b[0m"
-                return None
+            print "\x1b[31mERROR: no Fulltests found for tempnominal=", tempnominal,"\x1b[0m"
+            return None
 
         if len(rows) > 1:
             print "WARNING: multiple Fulltests found for tempnominal=", tempnominal, " using the first one"
@@ -174,14 +329,109 @@ class CalibrationDataProvider(AbstractCalibrationDataProvider):
         return row
 
 
+    # ------------------------------------------------------------------------------------------------------------------
+    # run query with a server side cursor and return generator over the rows, for large results of bulk queries. like
+    # in queryRows(), the query is repeated once on a new connection if the connection was lost before the first row
+    # was returned
+    # ------------------------------------------------------------------------------------------------------------------
+    def queryRowsStreamed(self, queryString, parameters):
+        if self.verbose:
+            print "\x1b[32mSQL:", queryString % parameters, "\x1b[0m"
+        for attempt in range(2):
+            connection = self.connectionPool.acquire()
+            broken = True
+            rowsReturned = False
+            try:
+                cursor = self.executeQuery(connection, queryString, parameters, streamed=True)
+                try:
+                    while True:
+                        rows = cursor.fetchmany(self.bulkFetchSize)
+                        if not rows:
+                            break
+                        for row in rows:
+                            rowsReturned = True
+                            yield row
+                finally:
+                    cursor.close()
+                broken = False
+            except self.connectionErrors:
+                # rows which were already returned can't be taken back
+                if attempt > 0 or rowsReturned:
+                    raise
+                continue
+            finally:
+                # connections with a result which was not read completely can't be used again
+                self.connectionPool.release(connection, broken=broken)
+            return
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # run bulk query for list of values in chunks, returns dictionary: value of groupColumn -> list of rows
+    # ------------------------------------------------------------------------------------------------------------------
+    def queryRowsBulk(self, queryString, values, groupColumn, additionalParameters = ()):
+        groupedRows = {}
+        for i in range(0, len(values), self.bulkQueryChunkSize):
+            valuesChunk = tuple(values[i:i+self.bulkQueryChunkSize])
+            chunkQueryString = queryString.format(parameterList=', '.join(['%s'] * len(valuesChunk)))
+            for row in self.queryRowsStreamed(chunkQueryString, valuesChunk + tuple(additionalParameters)):
+                if row[groupColumn] not in groupedRows:
+                    groupedRows[row[groupColumn]] = []
+                groupedRows[row[groupColumn]].append(row)
+        return groupedRows
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # fetch fulltest, reception test, DAC and X-ray rows for many modules with a few bulk queries, to be used by subsequent calls
+    # to getRocDacs/getMaskBits/... for the single modules
+    # ------------------------------------------------------------------------------------------------------------------
+    def prefetchModuleData(self, ModuleIDs, options={}):
+
+        tempnominal = options['tempnominal'] if 'tempnominal' in options else 'm20_1'
+        TrimValue = options['TrimValue'] if 'TrimValue' in options else '-1'
+        ModuleIDs = sorted(set(ModuleIDs))
+        if ModuleIDs != self.cachedModuleIDs:
+            self.clearCache()
+            self.cachedModuleIDs = ModuleIDs
+        print "  -> prefetch database rows for %d modules, tempnominal=%s, trim=%s"%(len(ModuleIDs), tempnominal, TrimValue)
+
+        # fulltests, from FullQualification first, then single Fulltests for the remaining modules
+        fulltestRows = self.queryRowsBulk(self.queryStringFulltestsBulk, ModuleIDs, 'FULLMODULE_ID', (tempnominal + '%',))
+        missingModuleIDs = [x for x in ModuleIDs if x not in fulltestRows]
+        if len(missingModuleIDs) > 0:
+            print "  -> no FullQualification found for %d modules => search for single Fulltests"%len(missingModuleIDs)
+            fulltestRows.update(self.queryRowsBulk(self.queryStringFulltests2Bulk, missingModuleIDs, 'FULLMODULE_ID', (tempnominal + '%',)))
+        for ModuleID in ModuleIDs:
+            self.fulltestRowCache[(ModuleID, tempnominal)] = fulltestRows[ModuleID] if ModuleID in fulltestRows else []
+
+        # DACs for the first fulltest found for each module
+        fulltestAnalysisIds = sorted(set([rows[0]['LASTANALYSIS_ID'] for rows in fulltestRows.values()]))
+        dacRows = self.queryRowsBulk(self.queryStringFulltestDacsBulk, fulltestAnalysisIds, 'FULLMODULEANALYSISTEST_ID', (TrimValue,))
+        for fulltestAnalysisId in fulltestAnalysisIds:
+            self.dacRowCache[(fulltestAnalysisId, '%s'%TrimValue)] = dacRows[fulltestAnalysisId][:self.nROCs] if fulltestAnalysisId in dacRows else []
+
+        # reception tests, for the readback fingerprint and the ROCs without calibrated readback. they don't depend on
+        # tempnominal, so they are only queried once per chunk
+        receptionModuleIDs = [x for x in ModuleIDs if x not in self.receptionRowCache]
+        if len(receptionModuleIDs) > 0:
+            receptionRows = self.queryRowsBulk(self.queryStringReceptionsBulk, receptionModuleIDs, 'FULLMODULE_ID')
+            for ModuleID in receptionModuleIDs:
+                self.receptionRowCache[ModuleID] = receptionRows[ModuleID][:10] if ModuleID in receptionRows else []
+
+        # X-ray hot pixels
+        xrayRows = self.queryRowsBulk(self.queryStringXrayMaskedPixelsBulk, ModuleIDs, 'FULLMODULE_ID')
+        for ModuleID in ModuleIDs:
+            self.xrayRowCache[ModuleID] = xrayRows[ModuleID][:20] if ModuleID in xrayRows else []
+
+        print "  -> %d fulltests, %d DAC sets, %d X-ray tests found"%(len(fulltestRows), len(dacRows), len(xrayRows))
+
     def getReceptionRow(self, ModuleID, tempnominal):
 
-        cursor = self.db.cursor(cursorclass=MySQLdb.cursors.DictCursor)
+        # reception test does not depend on tempnominal (always at +17)
+        if ModuleID in self.receptionRowCache:
+            rows = self.receptionRowCache[ModuleID]
+        else:
+            # get list of fulltests
+            rows = self.queryRows(self.queryStringReceptions, (ModuleID,))
+            self.receptionRowCache[ModuleID] = rows
 
-        # get list of fulltests
-        cursor.execute(self.queryStringReceptions, (ModuleID,))
-        self.db.commit()
-        rows = cursor.fetchall()
         if len(rows) < 1:
             print "\x1b[31mERROR: no Rception tests found for tempnominal=", tempnominal,"\x1b[0m"
             return None
@@ -193,10 +443,33 @@ class CalibrationDataProvider(AbstractCalibrationDataProvider):
         return row
 
 
+    # ------------------------------------------------------------------------------------------------------------------
+    # identification of the input data: fulltest analysis ID (+ reception test analysis ID for readback, since it is
+    # used for ROCs without calibrated readback), and a hash of the hot pixels for masks, since X-ray tests can be
+    # processed again with the same test ID. uses the same (cached) queries as the data itself
+    # ------------------------------------------------------------------------------------------------------------------
+    def getInputFingerprint(self, ModuleID, dataKind, options = {}):
+        tempnominal = options['tempnominal'] if 'tempnominal' in options else 'm20_1'
+
+        if dataKind == 'mask':
+            rows = self.getXrayRows(ModuleID)
+            hotPixels = ['%s:%s'%(row['ROC_POS'], row['ADDR_PIXELS_HOT']) for row in rows]
+            return [rows[0]['LASTTEST_XRAY_HR'] if len(rows) > 0 else None, hashlib.sha1(';'.join(hotPixels)).hexdigest()]
+
+        if dataKind == 'trim' and 'TrimValue' in options and int(options['TrimValue']) < 0:
+            return 'default'
+
+        row = self.getFulltestRow(ModuleID, tempnominal)
+        fingerprint = ['%s'%row['LASTANALYSIS_ID'] if row else None]
+        if dataKind == 'iana':
+            receptionRow = self.getReceptionRow(ModuleID, tempnominal)
+            fingerprint.append('%s'%receptionRow['LASTANALYSIS_ID'] if receptionRow else None)
+        return fingerprint
+
     def getRocDacs(self, ModuleID, options = {}):
 
         # initialize
-        dacs = []
+        dacs = ParameterMatrix([], [], 'i')
         tempnominal = options['tempnominal'] if 'tempnominal' in options else 'm20_1'
         TrimValue = options['TrimValue'] if 'TrimValue' in options else '-1'
         row = self.getFulltestRow(ModuleID, tempnominal)
@@ -212,30 +485,30 @@ class CalibrationDataProvider(AbstractCalibrationDataProvider):
                 pass
 
             # get DACs
-            cursor = self.db.cursor(cursorclass=MySQLdb.cursors.DictCursor)
-            cursor.execute(self.queryStringFulltestDacs, (fulltestAnalysisId, TrimValue))
-            self.db.commit()
-            rows = cursor.fetchall()
+            if (fulltestAnalysisId, '%s'%TrimValue) in self.dacRowCache:
+                rows = self.dacRowCache[(fulltestAnalysisId, '%s'%TrimValue)]
+            else:
+                rows = self.queryRows(self.queryStringFulltestDacs, (fulltestAnalysisId, TrimValue))
             nDACs = 0
             for row in rows:
-                rocDACs = []
+                rocPos = row['ROC_POS']
+                dacs.addRoc(rocPos)
                 for dbDACName, POSName in self.dacTable.items():
                     if dbDACName in row:
-                        rocDACs.append({'Name': POSName, 'Value': '%d'%row[dbDACName]})
+                        dacs.set(rocPos, POSName, row[dbDACName])
                         nDACs += 1
 
-                if len([x for x in rocDACs if x['Name'] == 'TempRange']) < 1:
-                    rocDACs.append({'Name': 'TempRange', 'Value': '0'})
+                if not dacs.has(rocPos, 'TempRange'):
+                    dacs.set(rocPos, 'TempRange', 0)
 
-                if len([x for x in rocDACs if x['Name'] == 'Readback']) < 1:
-                    rocDACs.append({'Name': 'Readback', 'Value': '1'})
+                if not dacs.has(rocPos, 'Readback'):
+                    dacs.set(rocPos, 'Readback', 1)
 
-                dacs.append({'ROC': row['ROC_POS'], 'DACs': rocDACs})
                 if self.verbose:
                     try:
-                        print "    -> ROC", row['ROC_POS']
-                        for i in rocDACs:
-                            print "      -> DAC: {DAC: <13}{Value: <10}".format(DAC=i['Name'], Value=i['Value'])
+                        print "    -> ROC", rocPos
+                        for dacName, dacValue in dacs.getRoc(rocPos):
+                            print "      -> DAC: {DAC: <13}{Value: <10}".format(DAC=dacName, Value='%d'%dacValue)
                     except:
                         pass
             print "  -> {nDACs} DACs read for {ModuleID}".format(ModuleID=ModuleID, nDACs=nDACs)
@@ -252,9 +525,12 @@ class CalibrationDataProvider(AbstractCalibrationDataProvider):
 
         # initialize
         tempnominal = options['tempnominal'] if 'tempnominal' in options else 'm20_1'
+        if (ModuleID, tempnominal) in self.remoteResultsPathCache:
+            return self.remoteResultsPathCache[(ModuleID, tempnominal)]
 
         # get fulltest analysis ID and data ID
         row = self.getFulltestRow(ModuleID, tempnominal)
+        remoteModuleDataPath = None
 
         if row:
             dataId = row['test_fullmoduleanalysis.DATA_ID']
@@ -262,16 +538,14 @@ class CalibrationDataProvider(AbstractCalibrationDataProvider):
             print "  -> data ID: ", dataId
 
             # get remote data path for the data ID
-            cursor = self.db.cursor(cursorclass=MySQLdb.cursors.DictCursor)
-            cursor.execute(self.queryStringFulltestData, (dataId, ))
-            self.db.commit()
-            rows = cursor.fetchall()
+            rows = self.queryRows(self.queryStringFulltestData, (dataId, ))
             if len(rows) > 0:
                 remoteModuleDataPath = self.dbUrl + rows[0]['PFNs'].replace('file:', '')
                 print "  -> remote path: ", remoteModuleDataPath
-                return remoteModuleDataPath
-        else:
-            return None
+                self.remoteResultsPathVersions[remoteModuleDataPath] = '%s'%row['LASTANALYSIS_ID']
+
+        self.remoteResultsPathCache[(ModuleID, tempnominal)] = remoteModuleDataPath
+        return remoteModuleDataPath
 
     # ------------------------------------------------------------------------------------------------------------------
     # get path of MoReWeb analysis results on DB server for Reception test
@@ -280,9 +554,12 @@ class CalibrationDataProvider(AbstractCalibrationDataProvider):
 
         # initialize
         tempnominal = options['tempnominal'] if 'tempnominal' in options else 'm20_1'
+        if ModuleID in self.remoteResultsPathReceptionCache:
+            return self.remoteResultsPathReceptionCache[ModuleID]
 
         # get fulltest analysis ID and data ID
         row = self.getReceptionRow(ModuleID, tempnominal)
+        remoteModuleDataPath = None
 
         if row:
             dataId = row['test_fullmoduleanalysis.DATA_ID']
@@ -290,26 +567,36 @@ class CalibrationDataProvider(AbstractCalibrationDataProvider):
             print "  -> data ID: ", dataId
 
             # get remote data path for the data ID
-            cursor = self.db.cursor(cursorclass=MySQLdb.cursors.DictCursor)
-            cursor.execute(self.queryStringFulltestData, (dataId, ))
-            self.db.commit()
-            rows = cursor.fetchall()
+            rows = self.queryRows(self.queryStringFulltestData, (dataId, ))
             if len(rows) > 0:
                 remoteModuleDataPath = self.dbUrl + rows[0]['PFNs'].replace('file:', '')
                 print "  -> reception remote path: ", remoteModuleDataPath
-                return remoteModuleDataPath
-        else:
-            return None
+                self.remoteResultsPathVersions[remoteModuleDataPath] = '%s'%row['LASTANALYSIS_ID']
+
+        self.remoteResultsPathReceptionCache[ModuleID] = remoteModuleDataPath
+        return remoteModuleDataPath
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # version of the files in a remote results folder for the download cache: fulltest analysis ID
+    # ------------------------------------------------------------------------------------------------------------------
+    def getRemoteResultsVersion(self, remoteModuleDataPath):
+        return self.remoteResultsPathVersions[remoteModuleDataPath] if remoteModuleDataPath in self.remoteResultsPathVersions else ''
 
     # ------------------------------------------------------------------------------------------------------------------
     # wrapper for urllib to download files from DB
+    #   with download cache enabled, the file is taken from the cache if possible, localFileName=None only fills the cache
     # ------------------------------------------------------------------------------------------------------------------
-    def downloadFile(self, remoteUrl, localFileName):
+    def downloadFile(self, remoteUrl, localFileName, cacheVersion = ''):
         attempts = 5
         success = False
         while attempts > 0 and not success:
             try:
-                urllib.urlretrieve(remoteUrl, localFileName)
+                if self.downloadCache:
+                    cacheFileName = self.downloadCache.getFile(remoteUrl, cacheVersion)
+                    if localFileName:
+                        shutil.copyfile(cacheFileName, localFileName)
+                else:
+                    urllib.urlretrieve(remoteUrl, localFileName)
                 success = True
             except Exception as e:
                 print "ERROR: ", e, "=> RETRY"
@@ -320,52 +607,150 @@ class CalibrationDataProvider(AbstractCalibrationDataProvider):
 
         return success
 
+    # ------------------------------------------------------------------------------------------------------------------
+    # download list of files [(remoteUrl, localFileName, cacheVersion), ...] in parallel, each one with the retries of
+    # downloadFile. returns list of success flags in the same order
+    # ------------------------------------------------------------------------------------------------------------------
+    def downloadFiles(self, downloads):
+        return self.mapDownloads(self.downloadFile, downloads)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # download file from DB into memory, returns content as string or None if the download failed
+    #   with download cache enabled, the file is taken from the cache if possible
+    # ------------------------------------------------------------------------------------------------------------------
+    def downloadData(self, remoteUrl, cacheVersion = ''):
+        attempts = 5
+        data = None
+        while attempts > 0 and data is None:
+            try:
+                if self.downloadCache:
+                    with open(self.downloadCache.getFile(remoteUrl, cacheVersion), 'rb') as cacheFile:
+                        data = cacheFile.read()
+                else:
+                    response = urllib2.urlopen(remoteUrl, timeout=60)
+                    try:
+                        data = response.read()
+                    finally:
+                        response.close()
+            except urllib2.HTTPError as e:
+                # file does not exist, no need to retry
+                if e.code == 404:
+                    print "ERROR: ", e
+                    break
+                print "ERROR: ", e, "=> RETRY"
+                attempts -= 1
+            except Exception as e:
+                print "ERROR: ", e, "=> RETRY"
+                attempts -= 1
+
+        if data is None:
+            print "\x1b[31mERROR: could not download file:", remoteUrl, "\x1b[0m"
+
+        return data
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # download list of files [(remoteUrl, cacheVersion), ...] into memory in parallel
+    # returns list of file contents (None for failed downloads) in the same order
+    # ------------------------------------------------------------------------------------------------------------------
+    def downloadDataList(self, downloads):
+        return self.mapDownloads(self.downloadData, downloads)
+
+    # run download function for all argument tuples with a bounded number of parallel threads, keeping the order
+    def mapDownloads(self, downloadFunction, downloads):
+        if self.downloadThreads < 2 or len(downloads) < 2:
+            return [downloadFunction(*download) for download in downloads]
+
+        return self.getDownloadPool().map(lambda download: downloadFunction(*download), downloads)
+
+    # thread pool is created once per process, it can't be used after fork()
+    def getDownloadPool(self):
+        if self.downloadPool is None or self.downloadPoolPid != os.getpid():
+            self.downloadPool = ThreadPool(processes=self.downloadThreads)
+            self.downloadPoolPid = os.getpid()
+        return self.downloadPool
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # returns clone of the TrimBitMap histogram (not attached to any file) from ROOT file content in memory, or None
+    # ------------------------------------------------------------------------------------------------------------------
+    def getTrimBitMapHistogram(self, data, histogramName):
+        temporaryFile = None
+        try:
+            RootFile = ROOT.TMemFile(histogramName + '.root', data, len(data), 'READ')
+        except:
+            # ROOT versions without TMemFile for existing buffers: temporary file with unique name
+            temporaryFile = tempfile.NamedTemporaryFile(suffix='.root')
+            temporaryFile.write(data)
+            temporaryFile.flush()
+            RootFile = ROOT.TFile.Open(temporaryFile.name)
+
+        try:
+            RootFileCanvas = RootFile.Get("c1")
+            PrimitivesList = RootFileCanvas.GetListOfPrimitives()
+            histName = 'TrimBitMap'
+            for i in range(0, PrimitivesList.GetSize()):
+                if PrimitivesList.At(i).GetName().find(histName) > -1:
+                    ClonedROOTObject = PrimitivesList.At(i).Clone(histogramName)
+                    try:
+                        ClonedROOTObject.SetDirectory(0)
+                    except:
+                        pass
+                    return ClonedROOTObject
+            return None
+        finally:
+            RootFile.Close()
+            if temporaryFile:
+                temporaryFile.close()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # fill the download cache with all files needed for the modules, downloaded in parallel for all modules at once
+    # ------------------------------------------------------------------------------------------------------------------
+    def prefetchModuleFiles(self, ModuleIDs, options={}):
+        if not self.downloadCache:
+            print "\x1b[31mWARNING: download cache is disabled, nothing to prefetch!\x1b[0m"
+            return
+
+        downloads = []
+        for ModuleID in ModuleIDs:
+            remoteModuleDataPath = self.getRemoteResultsPath(ModuleID=ModuleID, options=options)
+            if remoteModuleDataPath:
+                cacheVersion = self.getRemoteResultsVersion(remoteModuleDataPath)
+                downloads.append((remoteModuleDataPath + self.remotePathTBM, None, cacheVersion))
+                for iRoc in range(self.nROCs):
+                    downloads.append((remoteModuleDataPath + self.remotePathReadbackJson.format(iRoc=iRoc), None, cacheVersion))
+                    if not ('TrimValue' in options and int(options['TrimValue']) < 0):
+                        downloads.append((remoteModuleDataPath + self.remotePathTrimBitMap.format(iRoc=iRoc), None, cacheVersion))
+
+        print "  -> prefetch %d files for %d modules..."%(len(downloads), len(ModuleIDs))
+        downloadsSuccessful = self.downloadFiles(downloads)
+        print "  -> %d files in download cache, %d failed"%(sum(downloadsSuccessful), len(downloads) - sum(downloadsSuccessful))
+
 
     # ------------------------------------------------------------------------------------------------------------------
-    # returns list: [{'ROC': 0, 'Trims': rocTrims}, ...]
-    #               rocTrims = [..] list of trim-bits for 4160 pixels
+    # returns PixelArray with the trim-bits of 4160 pixels for all ROCs
     # ------------------------------------------------------------------------------------------------------------------
     def getTrimBits(self, ModuleID, options={}):
-        trims = []
+        trims = PixelArray([], self.nPix)
 
         # if untrimmed configuration is requested, set all trimbits to default value
         if 'TrimValue' in options and int(options['TrimValue']) < 0:
             print "WARNING: TrimValue < 0, setting all trimbits to ", self.defaultTrim, " instead of obtaining them from database!"
-            for iRoc in range(self.nROCs):
-                rocTrims = [self.defaultTrim] * self.nPix
-                trims.append({'ROC': iRoc, 'Trims': rocTrims})
-            return trims
+            return PixelArray.filled(range(self.nROCs), self.nPix, self.defaultTrim)
 
         # otherwise get trimbits from database fulltest results
         remoteModuleDataPath = self.getRemoteResultsPath(ModuleID=ModuleID, options=options)
         if remoteModuleDataPath:
-            for iRoc in range(self.nROCs):
-                remoteFileName = self.remotePathTrimBitMap.format(iRoc=iRoc)
-                localFileName = 'temp/TrimBitMap%sROC%d.root'%(ModuleID, iRoc)
-
-                if not self.downloadFile(remoteModuleDataPath + remoteFileName, localFileName):
-                    print "\x1b[31m:ERROR: could not download file with trimbits\x1b[0m"
-                    raise Exception("could not download trimbit file")
+            cacheVersion = self.getRemoteResultsVersion(remoteModuleDataPath)
+            rocsData = self.downloadDataList([(remoteModuleDataPath + self.remotePathTrimBitMap.format(iRoc=iRoc), cacheVersion) for iRoc in range(self.nROCs)])
+            if None in rocsData:
+                print "\x1b[31m:ERROR: could not download file with trimbits\x1b[0m"
+                raise Exception("could not download trimbit file")
 
-                rocTrims = [self.defaultTrim] * self.nPix
+            for iRoc in range(self.nROCs):
+                rocTrims = bytearray(chr(self.defaultTrim) * self.nPix)
 
                 # read trim file
-                RootFile = ROOT.TFile.Open(localFileName)
-                RootFileCanvas = RootFile.Get("c1")
-                PrimitivesList = RootFileCanvas.GetListOfPrimitives()
-                histName = 'TrimBitMap'
-                ClonedROOTObject = None
-                HistogramFound = False
-                for i in range(0, PrimitivesList.GetSize()):
-                    if PrimitivesList.At(i).GetName().find(histName) > -1:
-                        ClonedROOTObject = PrimitivesList.At(i).Clone('TH2DTrimBitMap%sROC%d'%(ModuleID, iRoc))
-                        try:
-                            ClonedROOTObject.SetDirectory(0)
-                        except:
-                            pass
-                        HistogramFound = True
-                        RootFile.Close()
-                        break
+                ClonedROOTObject = self.getTrimBitMapHistogram(rocsData[iRoc], 'TH2DTrimBitMap%sROC%d'%(ModuleID, iRoc))
+                HistogramFound = ClonedROOTObject is not None
                 if HistogramFound:
                     nBinsX = ClonedROOTObject.GetXaxis().GetNbins()
                     nBinsY = ClonedROOTObject.GetYaxis().GetNbins()
@@ -373,9 +758,9 @@ class CalibrationDataProvider(AbstractCalibrationDataProvider):
 
                     for col in range(self.nCols):
                         for row in range(self.nRows):
-                            rocTrims[col * self.nRows + row] = ClonedROOTObject.GetBinContent(1 + col, 1 + row)
+                            rocTrims[col * self.nRows + row] = int(ClonedROOTObject.GetBinContent(1 + col, 1 + row))
 
-                trims.append({'ROC': iRoc, 'Trims': rocTrims})
+                trims.setRoc(iRoc, rocTrims)
             print "  -> trim parameters read for {ModuleID}".format(ModuleID=ModuleID)
         return trims
 
@@ -393,6 +778,30 @@ class CalibrationDataProvider(AbstractCalibrationDataProvider):
         except:
             raise NameError("TBM/KeyValueDictPairs.json: can't read TBM parameters from JSON file: Core{tbmId}{tbmCore}_{tbmRegister}".format(tbmId=tbmId, tbmCore=tbmCore, tbmRegister=tbmRegister))
 
+    # ------------------------------------------------------------------------------------------------------------------
+    # download and parse TBM JSON data once per module, shared by all TBM cores. returns None if no data found
+    # ------------------------------------------------------------------------------------------------------------------
+    def getTbmData(self, ModuleID, options={}):
+        tempnominal = options['tempnominal'] if 'tempnominal' in options else 'm20_1'
+        if (ModuleID, tempnominal) in self.tbmDataCache:
+            return self.tbmDataCache[(ModuleID, tempnominal)]
+
+        # this returns the path to a JSON file created by Moreweb on the DB side, containing TBM settings
+        remoteModuleDataPath = self.getRemoteResultsPath(ModuleID=ModuleID, options=options)
+
+        data = None
+        if remoteModuleDataPath:
+            remoteFileName = self.remotePathTBM
+            jsonData = self.downloadData(remoteModuleDataPath + remoteFileName, self.getRemoteResultsVersion(remoteModuleDataPath))
+            if jsonData is None:
+                print "\x1b[31m:ERROR: could not download file with TBM parameters\x1b[0m"
+                raise Exception("could not download TBM file")
+
+            data = json.loads(jsonData)
+
+        self.tbmDataCache[(ModuleID, tempnominal)] = data
+        return data
+
     # ------------------------------------------------------------------------------------------------------------------
     # read all TBM registers for 1 TBM
     # ------------------------------------------------------------------------------------------------------------------
@@ -410,19 +819,10 @@ class CalibrationDataProvider(AbstractCalibrationDataProvider):
         tbmParameters.append({'Name': 'TBMAPKAMCount', 'Value': 5})
         tbmParameters.append({'Name': 'TBMBPKAMCount', 'Value': 5})
 
-        # this returns the path to a JSON file created by Moreweb on the DB side, containing TBM settings
-        remoteModuleDataPath = self.getRemoteResultsPath(ModuleID=ModuleID, options=options)
-
-        if remoteModuleDataPath:
-            remoteFileName = self.remotePathTBM
-            localFileName = 'temp/TBM_%s.json' % (ModuleID)
-            if not self.downloadFile(remoteModuleDataPath + remoteFileName, localFileName):
-                print "\x1b[31m:ERROR: could not download file with TBM parameters\x1b[0m"
-                raise Exception("could not download TBM file")
-
-            with open(localFileName) as data_file:
-                data = json.load(data_file)
+        # JSON file created by Moreweb on the DB side, containing TBM settings for all cores
+        data = self.getTbmData(ModuleID=ModuleID, options=options)
 
+        if data is not None:
             try:
                 tbmParameters.append(
                     {'Name': 'TBMPLLDelay', 'Value': self.getFormattedTbmParameter(data, tbmId, 'a', 'basee')})
@@ -446,33 +846,36 @@ class CalibrationDataProvider(AbstractCalibrationDataProvider):
     # read all TBM registers for all TBMs
     # ------------------------------------------------------------------------------------------------------------------
     def getTbmParameters(self, ModuleID, options={}):
+        tbm = ParameterMatrix([], [], 'i')
 
-        # for L1 modules: return parameters for both TBMs in a list
-        if ModuleID.upper().startswith('M1'):
-            return [self.getSingleTbmParameters(ModuleID, options, 0), self.getSingleTbmParameters(ModuleID, options, 1)]
-        else:
-            return self.getSingleTbmParameters(ModuleID, options, 0)
+        # for L1 modules: return parameters for both TBMs
+        for tbmId in (range(2) if ModuleID.upper().startswith('M1') else range(1)):
+            for tbmParameter in self.getSingleTbmParameters(ModuleID, options, tbmId):
+                tbm.set(tbmId, tbmParameter['Name'], tbmParameter['Value'])
+        return tbm
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # X-ray hot pixel rows of a module, one per ROC. empty if the module has no X-ray test
+    # ------------------------------------------------------------------------------------------------------------------
+    def getXrayRows(self, ModuleID):
+        if ModuleID not in self.xrayRowCache:
+            self.xrayRowCache[ModuleID] = self.queryRows(self.queryStringXrayMaskedPixels, (ModuleID, ))
+        return self.xrayRowCache[ModuleID]
 
     # ------------------------------------------------------------------------------------------------------------------
-    # returns list: [{'ROC': 0, 'Masks': rocMasks}, ...]
-    #               rocMasks = [0, 0, 0, ... ] list of mask-bits for 4160 pixels. 0=unmasked, 1=masked
+    # returns PixelBitset with the mask-bits of 4160 pixels for all ROCs. 0=unmasked, 1=masked
     # ------------------------------------------------------------------------------------------------------------------
     def getMaskBits(self, ModuleID, options={}):
-        masks = []
+        masks = PixelBitset([], self.nPix)
         print "  -> reading mask bits from database: Xray test"
 
-        # get DACs
-        cursor = self.db.cursor(cursorclass=MySQLdb.cursors.DictCursor)
-        cursor.execute(self.queryStringXrayMaskedPixels, (ModuleID, ))
-        self.db.commit()
-        rows = cursor.fetchall()
+        # get hot pixels
+        rows = self.getXrayRows(ModuleID)
 
         if len(rows) < 1:
             print "WARNING: no X-ray test found for this module, using unmasked configuration!"
 
-            for iRoc in range(self.nROCs):
-                rocMasks = [self.defaultMask] * self.nPix
-                masks.append({'ROC': iRoc, 'Masks': rocMasks})
+            masks = PixelBitset.filled(range(self.nROCs), self.nPix, self.defaultMask)
         else:
             if len(rows) != self.nROCs:
                 if self.verbose:
@@ -481,7 +884,8 @@ class CalibrationDataProvider(AbstractCalibrationDataProvider):
 
             print "    -> XRAY HR test ID", rows[0]['LASTTEST_XRAY_HR']
             for row in rows:
-                rocMasks = [self.defaultMask] * self.nPix
+                rocPos = int(row['ROC_POS'])
+                masks.addRoc(rocPos, self.defaultMask)
                 maskedPixelsString = row['ADDR_PIXELS_HOT'].strip().strip('[').strip(']')
                 if len(maskedPixelsString) > 0:
                     maskedPixels = [[int(y) for y in x.strip().strip('(').strip(')').split(',')] for x in maskedPixelsString.split('),')]
@@ -491,68 +895,74 @@ class CalibrationDataProvider(AbstractCalibrationDataProvider):
                     if len(maskedPixels) > 0:
                         print "%d pixels MASKED on ROC %d:"%(len(maskedPixels), int(row['ROC_POS'])), maskedPixels
                 for maskedPixel in maskedPixels:
-                    rocMasks[maskedPixel[1]*self.nRows + maskedPixel[2]] = 1
-
-                masks.append({'ROC': int(row['ROC_POS']), 'Masks': rocMasks})
+                    masks.set(rocPos, maskedPixel[1]*self.nRows + maskedPixel[2], 1)
 
         return masks
 
     # ------------------------------------------------------------------------------------------------------------------
-    # returns list: [{'ROC': 0, 'ReadbackCalibration': readbackCalibrationRoc}, ...]
-    #               readbackCalibrationRoc = [{'Name': readbackParameter, 'Value': parameterValue}, ...]
+    # returns ParameterMatrix ROC x readback calibration constant
     # ------------------------------------------------------------------------------------------------------------------
     def getReadbackCalibration(self, ModuleID, options = {}):
-        readbackCalibration = []
+        readbackCalibration = ParameterMatrix([], [], 'd')
 
         # get readback calibration from database fulltest results
         remoteModuleDataPath = self.getRemoteResultsPath(ModuleID=ModuleID, options=options)
         if remoteModuleDataPath:
-            for iRoc in range(self.nROCs):
-                remoteFileName = self.remotePathReadbackJson.format(iRoc=iRoc)
-                localFileName = 'temp/%s_ReadbackCalibration_ROC%d.json'%(ModuleID, iRoc)
-                self.downloadFile(remoteModuleDataPath + remoteFileName, localFileName)
-
-                readbackCalibrationRoc = []
+            remoteFileNames = [self.remotePathReadbackJson.format(iRoc=iRoc) for iRoc in range(self.nROCs)]
+            remoteUrls = [remoteModuleDataPath + remoteFileName for remoteFileName in remoteFileNames]
+            cacheVersion = self.getRemoteResultsVersion(remoteModuleDataPath)
+            rocsJsonData = self.downloadDataList([(remoteUrl, cacheVersion) for remoteUrl in remoteUrls])
 
-                if not os.path.isfile(localFileName):
-                    print "\x1b[31mERROR: failed to download to JSON file %s\x1b[31m"%localFileName
+            rocsData = []
+            receptionRocs = []
+            for iRoc in range(self.nROCs):
+                if rocsJsonData[iRoc] is None:
+                    print "\x1b[31mERROR: failed to download JSON file %s\x1b[31m"%remoteUrls[iRoc]
 
                 data = None
                 try:
-                    with open(localFileName) as data_file:
-                        data = json.load(data_file)
+                    data = json.loads(rocsJsonData[iRoc])
                 except:
-                    print "\x1b[31mERROR: failed to load data from JSON file %s\x1b[31m"%localFileName
+                    print "\x1b[31mERROR: failed to load data from JSON file %s\x1b[31m"%remoteUrls[iRoc]
 
                 # check if readback has been calibrated in FullQualification
                 if data and 'ReadbackCalibrated' in data and data['ReadbackCalibrated']['Value'].lower().strip() != 'true':
-                    print "INFO: readback not calibrated flag has been set for this module - reception test results will be used."
+                    print "INFO: readback not calibrated flag has been set for ROC%d of this module - reception test results will be used."%iRoc
+                    receptionRocs.append(iRoc)
+
+                rocsData.append(data)
 
-                    # try to obtain calibration constants from Reception test (always at +17)
-                    remoteModuleDataPathReception = self.getRemoteResultsPathReception(ModuleID=ModuleID, options=options)
+            # try to obtain calibration constants from Reception test (always at +17)
+            if len(receptionRocs) > 0:
+                remoteModuleDataPathReception = self.getRemoteResultsPathReception(ModuleID=ModuleID, options=options)
 
-                    if remoteModuleDataPathReception:
-                        if not self.downloadFile(remoteModuleDataPathReception + remoteFileName, localFileName):
-                            print "\x1b[31m:ERROR: could not download file with readback calibration from reception test\x1b[0m"
-                            raise Exception("could not download reception readback file")
+                if remoteModuleDataPathReception:
+                    for iRoc in receptionRocs:
+                        remoteUrls[iRoc] = remoteModuleDataPathReception + remoteFileNames[iRoc]
+                    cacheVersion = self.getRemoteResultsVersion(remoteModuleDataPathReception)
+                    receptionJsonData = self.downloadDataList([(remoteUrls[iRoc], cacheVersion) for iRoc in receptionRocs])
+                    if None in receptionJsonData:
+                        print "\x1b[31m:ERROR: could not download file with readback calibration from reception test\x1b[0m"
+                        raise Exception("could not download reception readback file")
 
+                    for iRoc, jsonData in zip(receptionRocs, receptionJsonData):
                         try:
-                            with open(localFileName) as data_file:
-                                data = json.load(data_file)
+                            rocsData[iRoc] = json.loads(jsonData)
                             print "INFO: Reception test found!"
                         except:
-                            print "\x1b[31mERROR: failed to load data from JSON file %s (reception test)\x1b[31m" % localFileName
-                    else:
-                        print "\x1b[31mERROR: no Reception test found for this module!\x1b[0m"
+                            print "\x1b[31mERROR: failed to load data from JSON file %s (reception test)\x1b[31m" % remoteUrls[iRoc]
+                else:
+                    print "\x1b[31mERROR: no Reception test found for this module!\x1b[0m"
 
+            for iRoc in range(self.nROCs):
+                readbackCalibration.addRoc(iRoc)
+                data = rocsData[iRoc]
                 if data:
                     for readbackParameter in self.readbackParameters:
                         try:
                             parameterValue = float(data[readbackParameter]['Value'])
                         except:
-                            print "\x1b[31mERROR: failed to extract parameter '%s' for ROC%d from JSON file %s -> setting it to 0!\x1b[31m" % (readbackParameter, iRoc, localFileName)
+                            print "\x1b[31mERROR: failed to extract parameter '%s' for ROC%d from JSON file %s -> setting it to 0!\x1b[31m" % (readbackParameter, iRoc, remoteUrls[iRoc])
                             parameterValue = 0
-                        readbackCalibrationRoc.append({'Name': readbackParameter, 'Value': parameterValue})
-
-                readbackCalibration.append({'ROC': iRoc, 'ReadbackCalibration': readbackCalibrationRoc})
-        return readbackCalibration
\ No newline at end of file
+                        readbackCalibration.set(iRoc, readbackParameter, parameterValue)
+        return readbackCalibration
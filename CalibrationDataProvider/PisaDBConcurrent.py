@@ -0,0 +1,134 @@
+from PisaDB import CalibrationDataProvider as PisaDBCalibrationDataProvider
+from DataCache import DataCache
+from multiprocessing.pool import ThreadPool
+import threading
+import sys
+import os
+
+# ----------------------------------------------------------------------------------------------------------------------
+#  Pisa DB data source which fetches the data of many modules concurrently
+# ----------------------------------------------------------------------------------------------------------------------
+#  fetchModules() starts one task per module on a pool of FetchThreads threads and returns immediately. The tasks
+#  read all data kinds of their module and overlap SQL queries and HTTP downloads of hundreds of modules within one
+#  process, with bounded concurrency per resource type:
+#    SQL:  at most SqlConnections queries at once, each on its own connection from the connection pool
+#    HTTP: at most DownloadThreads downloads at once, the download thread pool is shared by all tasks
+#    ROOT: trimbit histograms are read one at a time, since ROOT is not thread safe
+#  The synchronous interface (getRocDacs, getTrimBits, ...) returns the result of the task if one was started for the
+#  module, and reads the data directly otherwise, so the converter can be used unchanged: prefetchModuleData() starts
+#  the tasks for all modules of a chunk, which are fetched in the background while the first ones are written.
+#  Note: with temperature interpolation all data kinds are fetched for +17, although only the DACs are used.
+# ----------------------------------------------------------------------------------------------------------------------
+class CalibrationDataProvider(PisaDBCalibrationDataProvider):
+
+    dataKindMethods = {
+        'dac': 'getRocDacs',
+        'trim': 'getTrimBits',
+        'tbm': 'getTbmParameters',
+        'mask': 'getMaskBits',
+        'iana': 'getReadbackCalibration',
+    }
+
+    def __init__(self, dataSource=None, verbose=False, options={}):
+        super(CalibrationDataProvider, self).__init__(dataSource=dataSource, verbose=verbose, options=options)
+
+        # number of modules fetched at the same time
+        self.fetchThreads = int(options['FetchThreads']) if 'FetchThreads' in options else 16
+        self.fetchPool = None
+        self.fetchPoolPid = None
+
+        # only fetch the data kinds which are converted
+        if 'ExtractParameters' in options:
+            self.fetchKinds = [x.strip().lower() for x in options['ExtractParameters'].split(',') if x.strip().lower() in self.dataKindMethods]
+        else:
+            self.fetchKinds = sorted(self.dataKindMethods.keys())
+
+        self.rootLock = threading.Lock()
+
+        # (ModuleID, options key) -> [AsyncResult of the fetch task, methods whose result was not taken yet]
+        self.pendingResults = {}
+        self.pendingResultsLock = threading.Lock()
+
+    # thread pool is created once per process, it can't be used after fork()
+    def getFetchPool(self):
+        if self.fetchPool is None or self.fetchPoolPid != os.getpid():
+            self.fetchPool = ThreadPool(processes=self.fetchThreads)
+            self.fetchPoolPid = os.getpid()
+        return self.fetchPool
+
+    def getTrimBitMapHistogram(self, data, histogramName):
+        with self.rootLock:
+            return super(CalibrationDataProvider, self).getTrimBitMapHistogram(data, histogramName)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # starts fetching the data of all modules in the background and returns immediately. The results are returned by
+    # the following calls of getRocDacs(), getTrimBits(), ... with the same options
+    #   dataKinds: list of 'dac', 'trim', 'tbm', 'mask', 'iana', default: all data kinds which are converted
+    # ------------------------------------------------------------------------------------------------------------------
+    def fetchModules(self, ModuleIDs, options = {}, dataKinds = None):
+        methods = [self.dataKindMethods[x] for x in (dataKinds if dataKinds is not None else self.fetchKinds)]
+        fetchPool = self.getFetchPool()
+        self.getDownloadPool()
+
+        optionsKey = DataCache.getOptionsKey(options)
+        with self.pendingResultsLock:
+            for ModuleID in ModuleIDs:
+                if (ModuleID, optionsKey) not in self.pendingResults:
+                    asyncResult = fetchPool.apply_async(self.fetchModuleTask, (ModuleID, dict(options), methods))
+                    self.pendingResults[(ModuleID, optionsKey)] = [asyncResult, set(methods)]
+
+    # reads all data kinds of one module, returns dictionary method -> (data, exception info)
+    def fetchModuleTask(self, ModuleID, options, methods):
+        results = {}
+        for method in methods:
+            try:
+                results[method] = (getattr(super(CalibrationDataProvider, self), method)(ModuleID=ModuleID, options=options), None)
+            except Exception:
+                results[method] = (None, sys.exc_info())
+        return results
+
+    # result of a fetch task, or None if the data was not fetched in the background
+    def getFetchedData(self, method, ModuleID, options):
+        key = (ModuleID, DataCache.getOptionsKey(options))
+        with self.pendingResultsLock:
+            if key not in self.pendingResults or method not in self.pendingResults[key][1]:
+                return None
+            asyncResult, methods = self.pendingResults[key]
+            methods.remove(method)
+            if len(methods) < 1:
+                del self.pendingResults[key]
+
+        data, exceptionInfo = asyncResult.get()[method]
+        if exceptionInfo:
+            raise exceptionInfo[0], exceptionInfo[1], exceptionInfo[2]
+        return data
+
+    def getData(self, method, ModuleID, options):
+        data = self.getFetchedData(method, ModuleID, options)
+        if data is None:
+            data = getattr(super(CalibrationDataProvider, self), method)(ModuleID=ModuleID, options=options)
+        return data
+
+    # bulk queries for the rows of the chunk, then the rest is fetched in the background. results of modules of
+    # previous chunks which were never used are dropped
+    def prefetchModuleData(self, ModuleIDs, options={}):
+        with self.pendingResultsLock:
+            for key in [x for x in self.pendingResults.keys() if x[0] not in ModuleIDs]:
+                del self.pendingResults[key]
+        super(CalibrationDataProvider, self).prefetchModuleData(ModuleIDs, options)
+        self.fetchModules(ModuleIDs, options)
+
+    def getRocDacs(self, ModuleID, options = {}):
+        return self.getData('getRocDacs', ModuleID, options)
+
+    def getTrimBits(self, ModuleID, options={}):
+        return self.getData('getTrimBits', ModuleID, options)
+
+    def getTbmParameters(self, ModuleID, options={}):
+        return self.getData('getTbmParameters', ModuleID, options)
+
+    def getMaskBits(self, ModuleID, options={}):
+        return self.getData('getMaskBits', ModuleID, options)
+
+    def getReadbackCalibration(self, ModuleID, options = {}):
+        return self.getData('getReadbackCalibration', ModuleID, options)
@@ -0,0 +1,239 @@
+import sqlite3
+import tempfile
+import datetime
+import decimal
+import json
+import time
+import os
+
+# ----------------------------------------------------------------------------------------------------------------------
+#  local SQLite mirror of the rows of the Pisa production DB which are needed to convert a set of modules
+# ----------------------------------------------------------------------------------------------------------------------
+#  exportMirror() pulls the rows with the bulk queries of the PisaDB data source and stores each row as JSON, exactly
+#  as returned by MySQLdb (including the 'table.COLUMN' keys of joined columns), together with the columns used to
+#  look them up. The data source 'sqlite:{file name}' then runs the queries below on the mirror instead of the DB,
+#  see PisaDB. Files (trimbits, TBM and readback JSON) are still downloaded from the DB server of the mirror, or taken
+#  from the download cache (fill it with --prefetch to convert without network).
+#    mirror_info:      name -> value, e.g. source (DB url), created (time), tempnominals
+#    fulltests:        fulltest rows of FullQualifications (kind 'FullQualification') and of single fulltests
+#                      (kind 'Fulltest', only for modules without FullQualification at this tempnominal)
+#    receptions:       reception test rows
+#    dacparameters:    DAC rows for all trim values of the fulltest and reception analyses
+#    test_data:        remote paths (PFNs) of the analysis results
+#    xray_hot_pixels:  X-ray hot pixel rows
+#    bb_thresholds:    bump bonding thresholds for the BBTEST: data source
+#  rows are kept in the order of the DB, id is increasing
+# ----------------------------------------------------------------------------------------------------------------------
+
+mirrorSchema = '''
+    CREATE TABLE mirror_info (name TEXT PRIMARY KEY, value TEXT);
+    CREATE TABLE fulltests (id INTEGER PRIMARY KEY, kind TEXT, FULLMODULE_ID TEXT, tempnominal TEXT, row_json TEXT, UNIQUE (kind, FULLMODULE_ID, row_json));
+    CREATE INDEX fulltests_module ON fulltests (FULLMODULE_ID, kind);
+    CREATE TABLE receptions (id INTEGER PRIMARY KEY, FULLMODULE_ID TEXT, row_json TEXT, UNIQUE (FULLMODULE_ID, row_json));
+    CREATE TABLE dacparameters (id INTEGER PRIMARY KEY, FULLMODULEANALYSISTEST_ID INTEGER, TRIM_VALUE INTEGER, ROC_POS INTEGER, row_json TEXT, UNIQUE (FULLMODULEANALYSISTEST_ID, row_json));
+    CREATE INDEX dacparameters_analysis ON dacparameters (FULLMODULEANALYSISTEST_ID, TRIM_VALUE);
+    CREATE TABLE test_data (DATA_ID INTEGER PRIMARY KEY, row_json TEXT);
+    CREATE TABLE xray_hot_pixels (id INTEGER PRIMARY KEY, FULLMODULE_ID TEXT, ROC_POS INTEGER, row_json TEXT, UNIQUE (FULLMODULE_ID, row_json));
+    CREATE TABLE bb_thresholds (id INTEGER PRIMARY KEY, FULLMODULE_ID TEXT, tempnominal TEXT, ROC_POS INTEGER, row_json TEXT, UNIQUE (FULLMODULE_ID, row_json));
+'''
+
+# queries of PisaDB on the mirror: same parameters and result rows as the queries on the DB
+mirrorQueries = {
+    'queryStringFulltests': '''
+        SELECT row_json FROM fulltests WHERE FULLMODULE_ID = %s AND tempnominal LIKE %s AND kind = 'FullQualification'
+        ORDER BY id LIMIT 10;
+    ''',
+    'queryStringFulltests2': '''
+        SELECT row_json FROM fulltests WHERE FULLMODULE_ID = %s AND tempnominal LIKE %s AND kind = 'Fulltest'
+        ORDER BY id LIMIT 10;
+    ''',
+    'queryStringReceptions': '''
+        SELECT row_json FROM receptions WHERE FULLMODULE_ID = %s ORDER BY id LIMIT 10;
+    ''',
+    'queryStringFulltestDacs': '''
+        SELECT row_json FROM dacparameters WHERE FULLMODULEANALYSISTEST_ID = %s AND TRIM_VALUE = %s
+        ORDER BY ROC_POS, id LIMIT 16;
+    ''',
+    'queryStringFulltestData': '''
+        SELECT row_json FROM test_data WHERE DATA_ID = %s LIMIT 1;
+    ''',
+    'queryStringXrayMaskedPixels': '''
+        SELECT row_json FROM xray_hot_pixels WHERE FULLMODULE_ID = %s ORDER BY ROC_POS, id LIMIT 20;
+    ''',
+    'queryStringFulltestsBulk': '''
+        SELECT row_json FROM fulltests WHERE FULLMODULE_ID IN ({parameterList}) AND tempnominal LIKE %s AND kind = 'FullQualification'
+        ORDER BY FULLMODULE_ID, id;
+    ''',
+    'queryStringFulltests2Bulk': '''
+        SELECT row_json FROM fulltests WHERE FULLMODULE_ID IN ({parameterList}) AND tempnominal LIKE %s AND kind = 'Fulltest'
+        ORDER BY FULLMODULE_ID, id;
+    ''',
+    'queryStringFulltestDacsBulk': '''
+        SELECT row_json FROM dacparameters WHERE FULLMODULEANALYSISTEST_ID IN ({parameterList}) AND TRIM_VALUE = %s
+        ORDER BY FULLMODULEANALYSISTEST_ID, ROC_POS, id;
+    ''',
+    'queryStringReceptionsBulk': '''
+        SELECT row_json FROM receptions WHERE FULLMODULE_ID IN ({parameterList}) ORDER BY FULLMODULE_ID, id;
+    ''',
+    'queryStringXrayMaskedPixelsBulk': '''
+        SELECT row_json FROM xray_hot_pixels WHERE FULLMODULE_ID IN ({parameterList}) ORDER BY FULLMODULE_ID, ROC_POS, id;
+    ''',
+    'sqlBBvthrcomp': '''
+        SELECT row_json FROM bb_thresholds WHERE FULLMODULE_ID = %s AND tempnominal LIKE %s ORDER BY tempnominal, ROC_POS, id;
+    ''',
+}
+
+# additional bulk queries on the DB, only needed for the export
+exportQueries = {
+    'dacsBulk': '''
+        SELECT * FROM test_dacparameters WHERE FULLMODULEANALYSISTEST_ID IN ({parameterList})
+        ORDER BY FULLMODULEANALYSISTEST_ID, TRIM_VALUE, ROC_POS;
+    ''',
+    'dataBulk': '''
+        SELECT * FROM test_data WHERE DATA_ID IN ({parameterList});
+    ''',
+    'bbThresholdsBulk': '''
+        SELECT inventory_fullmodule.FULLMODULE_ID, tempnominal, ROC_POS, BumpBonding_threshold
+            FROM inventory_fullmodule
+            INNER JOIN test_fullmodule ON inventory_fullmodule.LASTTEST_FULLMODULE=test_fullmodule.SUMMARY_ID
+            INNER JOIN test_fullmoduleanalysis ON test_fullmodule.LASTANALYSIS_ID=test_fullmoduleanalysis.TEST_ID
+            INNER JOIN test_performanceparameters ON test_performanceparameters.FULLMODULEANALYSISTEST_ID=test_fullmoduleanalysis.TEST_ID
+            WHERE inventory_fullmodule.FULLMODULE_ID IN ({parameterList}) AND TYPE='FullQualification'
+            ORDER BY inventory_fullmodule.FULLMODULE_ID, tempnominal, ROC_POS;
+    ''',
+}
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# rows are stored as JSON, values which JSON does not know are converted like MySQLdb would print them
+# ----------------------------------------------------------------------------------------------------------------------
+def encodeValue(value):
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time, datetime.timedelta)):
+        return str(value)
+    raise TypeError("can't store value %r in mirror"%value)
+
+
+def encodeRow(row):
+    return json.dumps(row, sort_keys=True, default=encodeValue)
+
+
+# strings as str, as returned by MySQLdb
+def decodeRow(rowJson):
+    return json.loads(rowJson, object_hook=lambda row: dict([(str(key), value.encode('utf-8') if isinstance(value, unicode) else value) for key, value in row.items()]))
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#  cursor on the mirror with the interface of the MySQLdb dictionary cursors used by PisaDB
+# ----------------------------------------------------------------------------------------------------------------------
+class MirrorCursor(object):
+
+    def __init__(self, connection, queryString, parameters):
+        self.cursor = connection.cursor()
+        self.cursor.execute(queryString.replace('%s', '?'), parameters)
+
+    def fetchall(self):
+        return [decodeRow(row[0]) for row in self.cursor.fetchall()]
+
+    def fetchmany(self, size):
+        return [decodeRow(row[0]) for row in self.cursor.fetchmany(size)]
+
+    def close(self):
+        self.cursor.close()
+
+
+def connectMirror(fileName):
+    if not os.path.isfile(fileName):
+        raise IOError("DB mirror not found: %s"%fileName)
+    return sqlite3.connect(fileName, check_same_thread=False)
+
+
+def getMirrorInfo(connection):
+    return dict(connection.execute('SELECT name, value FROM mirror_info').fetchall())
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# writes the rows needed to convert the modules at the given tempnominals (e.g. ['m20_1', 'p17_1']) to a new mirror
+#   dataSource: PisaDB data source connected to the DB
+# the file is replaced at the end, so a failed export does not destroy the old mirror
+# ----------------------------------------------------------------------------------------------------------------------
+def exportMirror(dataSource, ModuleIDs, tempnominals, fileName):
+    ModuleIDs = sorted(set(ModuleIDs))
+    outputFolder = os.path.dirname(fileName)
+    temporaryFile, temporaryFileName = tempfile.mkstemp(dir=outputFolder if outputFolder else '.', prefix='.' + os.path.basename(fileName) + '.', suffix='.tmp')
+    os.close(temporaryFile)
+    try:
+        connection = sqlite3.connect(temporaryFileName)
+        connection.executescript(mirrorSchema)
+        nRows = {}
+
+        # columns are taken from the row, or from values for columns which are not part of the row
+        def insertRows(table, columns, rows, values = {}):
+            connection.executemany('INSERT OR IGNORE INTO %s (%s, row_json) VALUES (%s)'%(table, ', '.join(columns), ', '.join(['?'] * (len(columns) + 1))),
+                                   [tuple([values[x] if x in values else row.get(x) for x in columns]) + (encodeRow(row),) for row in rows])
+            nRows[table] = connection.execute('SELECT COUNT(*) FROM %s'%table).fetchone()[0]
+
+        def getValues(rowsList, key):
+            return sorted(set([row[key] for rows in rowsList for row in rows if key in row and row[key] is not None]))
+
+        # fulltests, single fulltests only for modules without FullQualification, as in PisaDB.getFulltestRow
+        analysisRows = []
+        for tempnominal in tempnominals:
+            print "  -> fulltests for tempnominal=%s..."%tempnominal
+            fulltestRows = dataSource.queryRowsBulk(dataSource.queryStringFulltestsBulk, ModuleIDs, 'FULLMODULE_ID', (tempnominal + '%',))
+            for ModuleID, rows in sorted(fulltestRows.items()):
+                insertRows('fulltests', ['kind', 'FULLMODULE_ID', 'tempnominal'], rows, {'kind': 'FullQualification'})
+            missingModuleIDs = [x for x in ModuleIDs if x not in fulltestRows]
+            singleFulltestRows = dataSource.queryRowsBulk(dataSource.queryStringFulltests2Bulk, missingModuleIDs, 'FULLMODULE_ID', (tempnominal + '%',)) if len(missingModuleIDs) > 0 else {}
+            for ModuleID, rows in sorted(singleFulltestRows.items()):
+                insertRows('fulltests', ['kind', 'FULLMODULE_ID', 'tempnominal'], rows, {'kind': 'Fulltest'})
+            analysisRows += fulltestRows.values() + singleFulltestRows.values()
+
+        print "  -> reception tests..."
+        receptionRows = dataSource.queryRowsBulk(dataSource.queryStringReceptionsBulk, ModuleIDs, 'FULLMODULE_ID')
+        for ModuleID, rows in sorted(receptionRows.items()):
+            insertRows('receptions', ['FULLMODULE_ID'], rows)
+        analysisRows += receptionRows.values()
+
+        print "  -> DAC parameters..."
+        dacRows = dataSource.queryRowsBulk(exportQueries['dacsBulk'], getValues(analysisRows, 'LASTANALYSIS_ID'), 'FULLMODULEANALYSISTEST_ID')
+        for analysisId, rows in sorted(dacRows.items()):
+            insertRows('dacparameters', ['FULLMODULEANALYSISTEST_ID', 'TRIM_VALUE', 'ROC_POS'], rows)
+
+        print "  -> remote paths..."
+        dataRows = dataSource.queryRowsBulk(exportQueries['dataBulk'], getValues(analysisRows, 'test_fullmoduleanalysis.DATA_ID'), 'DATA_ID')
+        for dataId, rows in sorted(dataRows.items()):
+            insertRows('test_data', ['DATA_ID'], rows[:1])
+
+        print "  -> X-ray hot pixels..."
+        xrayRows = dataSource.queryRowsBulk(dataSource.queryStringXrayMaskedPixelsBulk, ModuleIDs, 'FULLMODULE_ID')
+        for ModuleID, rows in sorted(xrayRows.items()):
+            insertRows('xray_hot_pixels', ['FULLMODULE_ID', 'ROC_POS'], rows)
+
+        print "  -> bump bonding thresholds..."
+        bbRows = dataSource.queryRowsBulk(exportQueries['bbThresholdsBulk'], ModuleIDs, 'FULLMODULE_ID')
+        for ModuleID, rows in sorted(bbRows.items()):
+            insertRows('bb_thresholds', ['FULLMODULE_ID', 'tempnominal', 'ROC_POS'], rows)
+
+        mirrorInfo = {
+            'source': dataSource.dbUrl,
+            'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'tempnominals': ','.join(tempnominals),
+            'modules': '%d'%len(ModuleIDs),
+        }
+        connection.executemany('INSERT INTO mirror_info (name, value) VALUES (?, ?)', sorted(mirrorInfo.items()))
+        connection.commit()
+        connection.close()
+
+        if os.name == 'nt' and os.path.isfile(fileName):
+            os.remove(fileName)
+        os.rename(temporaryFileName, fileName)
+    except:
+        try:
+            os.remove(temporaryFileName)
+        except OSError:
+            pass
+        raise
+
+    return nRows
@@ -6,7 +6,7 @@ try:
 except:
     print "\x1b[31mcould not load module: MySQLdb\x1b[0m"
     print "run: 'pip install MySQL-python'"
-    exit(0)
+    print "\x1b[31mcontinuing, but some features will not work without this module!\x1b[0m"
 
 try:
     import ROOT
@@ -15,8 +15,8 @@ except:
 
 class CalibrationDataProvider(PisaDB, AbstractCalibrationDataProvider):
 
-    def __init__(self, dataSource=None, verbose=False):
-        PisaDB.__init__(self, dataSource=dataSource, verbose=verbose)
+    def __init__(self, dataSource=None, verbose=False, options={}):
+        PisaDB.__init__(self, dataSource=dataSource, verbose=verbose, options=options)
 
         self.sqlBBvthrcomp = '''
 SELECT inventory_fullmodule.FULLMODULE_ID, tempnominal, ROC_POS, BumpBonding_threshold
@@ -24,10 +24,13 @@ SELECT inventory_fullmodule.FULLMODULE_ID, tempnominal, ROC_POS, BumpBonding_thr
     INNER JOIN test_fullmodule ON inventory_fullmodule.LASTTEST_FULLMODULE=test_fullmodule.SUMMARY_ID
     INNER JOIN test_fullmoduleanalysis ON test_fullmodule.LASTANALYSIS_ID=test_fullmoduleanalysis.TEST_ID
     INNER JOIN test_performanceparameters ON test_performanceparameters.FULLMODULEANALYSISTEST_ID=test_fullmoduleanalysis.TEST_ID
-    WHERE inventory_fullmodule.FULLMODULE_ID = '{ModuleID}' AND tempnominal LIKE '{tempnominal}%' AND TYPE='FullQualification'
+    WHERE inventory_fullmodule.FULLMODULE_ID = %s AND tempnominal LIKE %s AND TYPE='FullQualification'
     ORDER BY tempnominal, ROC_POS;
 '''
 
+        if self.mirrorFileName:
+            self.useMirrorQueries()
+
         self.thresholdMargin = 5  # lower threshold a bit to go from 50% efficiency point to ~100% efficiency
         self.thresholdMax = 125  # don't go lower (=higher value) with the threshold to avoid noise
 
@@ -35,11 +38,7 @@ SELECT inventory_fullmodule.FULLMODULE_ID, tempnominal, ROC_POS, BumpBonding_thr
 
         # read BB Vthrcomp value from DB
         tempnominal = options['tempnominal'] if 'tempnominal' in options else 'm20_1'
-        sql = self.sqlBBvthrcomp.format(ModuleID=ModuleID, tempnominal=tempnominal)
-        cursor = self.db.cursor(cursorclass=MySQLdb.cursors.DictCursor)
-        cursor.execute(sql)
-        self.db.commit()
-        rows = cursor.fetchall()
+        rows = self.queryRows(self.sqlBBvthrcomp, (ModuleID, tempnominal + '%'))
 
         # take the first Vthrcomp DAC found for this temperature
         rocDacs = {}
@@ -58,16 +57,13 @@ SELECT inventory_fullmodule.FULLMODULE_ID, tempnominal, ROC_POS, BumpBonding_thr
         print bbVthcompValues
 
         # replace Vthrcomp DAC
-        for rocDACs in moduleDACs:
-            if rocDACs['ROC'] in bbVthcompValues:
-                for dac in rocDACs['DACs']:
-                    if dac['Name'] == 'VcThr':
-                        newValueInt = int(bbVthcompValues[rocDACs['ROC']])+self.thresholdMargin
-                        if newValueInt > self.thresholdMax:
-                            newValueInt = self.thresholdMax
-                        newDacValue = "%d"%(newValueInt)
-                        print "VcThr:", dac['Value'], " -> ", newDacValue
-                        dac['Value'] = newDacValue
+        for roc in moduleDACs.rocs:
+            if roc in bbVthcompValues and moduleDACs.has(roc, 'VcThr'):
+                newValueInt = int(bbVthcompValues[roc])+self.thresholdMargin
+                if newValueInt > self.thresholdMax:
+                    newValueInt = self.thresholdMax
+                print "VcThr:", moduleDACs.get(roc, 'VcThr'), " -> ", newValueInt
+                moduleDACs.set(roc, 'VcThr', newValueInt)
 
         return moduleDACs
 
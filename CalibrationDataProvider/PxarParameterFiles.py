@@ -0,0 +1,71 @@
+import re
+
+# ----------------------------------------------------------------------------------------------------------------------
+#  parsers for the parameter files written by pxar into the test folders
+# ----------------------------------------------------------------------------------------------------------------------
+#  each file is read in one call and all lines are matched at once with a compiled pattern. Lines which don't match
+#  (comments, empty lines) are ignored, except in trim files, which may only contain pixel lines.
+#    key/value files: DACs, TBM registers, readback calibration, with or without index column
+#        "  1 Vdig         8"    "  5 basee        0xe4"    "par0vd 0.0215"
+#    mask files: masked pixels, columns, rows or whole ROCs, ROC first
+#        "pix 3 12 45"    "col 3 12"    "row 3 45"    "roc 3"
+#    trim files: one line per pixel, trimbit value first
+#        " 7   Pix  0  0"
+#  trim files written by pxar list the pixels in the order of the trim array (pixel = col * 80 + row). This is checked
+#  for all lines at once and the values are converted in one step, files in any other order are copied pixel by pixel.
+# ----------------------------------------------------------------------------------------------------------------------
+
+keyValuePattern = re.compile(r'^[ \t]*(?:\d+[ \t]+)?([A-Za-z_]\w*)[ \t]+(\S+)[ \t]*\r?$', re.MULTILINE)
+maskPattern = re.compile(r'^[ \t]*(pix|col|row|roc)((?:[ \t]+\d+)+)[ \t]*\r?$', re.MULTILINE | re.IGNORECASE)
+trimPattern = re.compile(r'^[ \t]*(\d+)[ \t]+pix[ \t]+(\d+)[ \t]+(\d+)[ \t]*\r?$', re.MULTILINE | re.IGNORECASE)
+# any line with content which is not a pixel line
+invalidTrimLinePattern = re.compile(r'^(?![ \t]*\d+[ \t]+pix[ \t]+\d+[ \t]+\d+[ \t]*\r?$)[ \t]*\S', re.MULTILINE | re.IGNORECASE)
+
+# (nRows, nPix) -> column and row numbers of all pixels in the order of the trim array, as written by pxar
+pixelOrders = {}
+# trimbit value as written by pxar -> byte
+trimValues = dict([('%d'%x, x) for x in range(256)])
+
+
+def readFile(fileName):
+    with open(fileName, 'r') as inputFile:
+        return inputFile.read()
+
+
+# returns list of (name, value) in the order of the file, names in lower case, values as string
+def readParameterFile(fileName):
+    return [(name.lower(), value) for name, value in keyValuePattern.findall(readFile(fileName))]
+
+
+# integer register value, hexadecimal with '0x' prefix or decimal
+def parseInteger(value):
+    return int(value, 16) if value.lower().startswith('0x') else int(value)
+
+
+# returns bytearray with the trimbits of all pixels of a ROC, pixels missing in the file are set to defaultTrim
+def readTrimFile(fileName, nRows = 80, nPix = 4160, defaultTrim = 15):
+    fileContent = readFile(fileName)
+
+    # one line per pixel in the order of the trim array: columns 1-3 are compared at once with the expected ones
+    if (nRows, nPix) not in pixelOrders:
+        pixelOrders[(nRows, nPix)] = (['%d'%(iPix // nRows) for iPix in range(nPix)], ['%d'%(iPix % nRows) for iPix in range(nPix)])
+    cols, rows = pixelOrders[(nRows, nPix)]
+    tokens = fileContent.split()
+    if len(tokens) == 4 * nPix and tokens[2::4] == cols and tokens[3::4] == rows and set([x.lower() for x in set(tokens[1::4])]) == set(['pix']):
+        try:
+            return bytearray(map(trimValues.__getitem__, tokens[0::4]))
+        except KeyError:
+            pass
+
+    # any other order, or values like '07': every line is checked and the pixels are copied one by one
+    if invalidTrimLinePattern.search(fileContent):
+        raise NameError('invalid trim bits file format!')
+    rocTrims = bytearray(chr(defaultTrim) * nPix)
+    for trimValue, col, row in trimPattern.findall(fileContent):
+        rocTrims[int(col) * nRows + int(row)] = int(trimValue)
+    return rocTrims
+
+
+# returns list of (kind, [ROC, col/row...]) with kind one of 'pix', 'col', 'row', 'roc'
+def readMaskFile(fileName):
+    return [(kind.lower(), [int(x) for x in numbers.split()]) for kind, numbers in maskPattern.findall(readFile(fileName))]
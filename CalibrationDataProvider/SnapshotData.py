@@ -0,0 +1,38 @@
+from CalibrationDataProvider import AbstractCalibrationDataProvider
+from CalibrationSnapshot import CalibrationSnapshot
+
+# ----------------------------------------------------------------------------------------------------------------------
+#  data source reading a snapshot written with pxar2POS.py --snapshot, see CalibrationSnapshot.py
+#  dataSource: 'snapshot:{file name}'
+#  the snapshot contains the final values of one configuration, temperature and trim value of the options are ignored
+# ----------------------------------------------------------------------------------------------------------------------
+class CalibrationDataProvider(AbstractCalibrationDataProvider):
+
+    def __init__(self, dataSource="", verbose=False, options={}):
+        super(CalibrationDataProvider, self).__init__()
+
+        self.verbose = verbose
+        self.snapshot = CalibrationSnapshot(dataSource[len('snapshot:'):] if dataSource.startswith('snapshot:') else dataSource)
+
+        info = self.snapshot.info
+        print "  -> snapshot of %d modules from %s, created %s"%(len(self.snapshot.modules), info['source'] if 'source' in info else 'unknown source', self.snapshot.created)
+        if info.get('tempnominal') or info.get('TrimValue'):
+            print "  -> temperature: %s, trim: %s"%(info.get('tempnominal') or '-', info.get('TrimValue') or '-')
+
+    def getInputFingerprint(self, ModuleID, dataKind, options = {}):
+        return self.snapshot.getFingerprint(ModuleID, dataKind)
+
+    def getRocDacs(self, ModuleID, options = {}):
+        return self.snapshot.getData(ModuleID, 'dac')
+
+    def getTrimBits(self, ModuleID, options = {}):
+        return self.snapshot.getData(ModuleID, 'trim')
+
+    def getTbmParameters(self, ModuleID, options = {}):
+        return self.snapshot.getData(ModuleID, 'tbm')
+
+    def getMaskBits(self, ModuleID, options = {}):
+        return self.snapshot.getData(ModuleID, 'mask')
+
+    def getReadbackCalibration(self, ModuleID, options = {}):
+        return self.snapshot.getData(ModuleID, 'iana')
@@ -9,30 +9,114 @@ class ModulePositionProvider(AbstractModulePositionProvider):
     def __init__(self, dataPath = ""):
         self.dataPath = dataPath
 
-    def getModulePosition(self, ModuleID):
+        # table is loaded once and reloaded only if the file modification time changes
+        #   moduleIndex:   module ID -> position, e.g. 'M2222' -> ['BPix', 'BmO', 'SEC1', 'LYR2', 'LDR1H', 'MOD4']
+        #   positionIndex: position string -> module ID, e.g. 'BPix_BmO_SEC1_LYR2_LDR1H_MOD4' -> 'M2222'
+        self.moduleIndex = {}
+        self.positionIndex = {}
+        self.moduleList = []
+        self.conflicts = []
+        self.indexModificationTime = None
+
+    def getModulesListFileName(self):
         pathParts = self.dataPath.split('/')
 
         if pathParts[0][-1] == ":":
             pathParts[0] = pathParts[0] + '/'
-        modulesListFileName = os.path.join(*pathParts)
-
-        modulePosition = []
-        moduleFound = False
-        if os.path.isfile(modulesListFileName):
-            with open(modulesListFileName, 'r') as modulesListFile:
-                for line in modulesListFile:
-                    lineSplit = [x for x in line.replace(';', ' ').replace('\t', ' ').split(' ') if len(x) > 0]
-                    if lineSplit[0] == ModuleID:
-                        modulePosition = lineSplit[1:]
-                        moduleFound = True
-
-        modulePosition = [x.strip() for x in modulePosition if len(x.strip()) > 0]
-        if moduleFound:
+        return os.path.join(*pathParts)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # (re)load module position table into forward and reverse index, if file has changed since last call
+    # ------------------------------------------------------------------------------------------------------------------
+    def loadIndex(self):
+        modulesListFileName = self.getModulesListFileName()
+
+        try:
+            modificationTime = os.path.getmtime(modulesListFileName)
+        except OSError:
+            if self.indexModificationTime != -1:
+                print "\x1b[31m -> module position table ", modulesListFileName, " not found\x1b[0m"
+            self.moduleIndex = {}
+            self.positionIndex = {}
+            self.moduleList = []
+            self.conflicts = []
+            self.indexModificationTime = -1
+            return
+
+        if modificationTime == self.indexModificationTime:
+            return
+
+        moduleIndex = {}
+        positionIndex = {}
+        moduleList = []
+        conflicts = []
+        with open(modulesListFileName, 'r') as modulesListFile:
+            for lineNumber, line in enumerate(modulesListFile, start=1):
+                lineSplit = [x.strip() for x in line.replace(';', ' ').replace('\t', ' ').split(' ') if len(x.strip()) > 0]
+                if len(lineSplit) < 2:
+                    continue
+                moduleID = lineSplit[0]
+                modulePosition = lineSplit[1:]
+                modulePositionString = '_'.join(modulePosition)
+
+                if moduleID in moduleIndex:
+                    if moduleIndex[moduleID] == modulePosition:
+                        conflicts.append("line %d: duplicate entry for module %s"%(lineNumber, moduleID))
+                    else:
+                        conflicts.append("line %d: module %s at %s, but also at %s"%(lineNumber, moduleID, modulePositionString, '_'.join(moduleIndex[moduleID])))
+                    # last entry in the file wins
+                    moduleList = [x for x in moduleList if x[0] != moduleID]
+                    previousPositionString = '_'.join(moduleIndex[moduleID])
+                    if positionIndex.get(previousPositionString) == moduleID:
+                        del positionIndex[previousPositionString]
+
+                if modulePositionString in positionIndex and positionIndex[modulePositionString] != moduleID:
+                    conflicts.append("line %d: position %s used by module %s and %s"%(lineNumber, modulePositionString, positionIndex[modulePositionString], moduleID))
+
+                moduleIndex[moduleID] = modulePosition
+                positionIndex[modulePositionString] = moduleID
+                moduleList.append([moduleID, modulePosition])
+
+        for conflict in conflicts:
+            print "\x1b[31mWARNING: module position table %s, %s\x1b[0m"%(modulesListFileName, conflict)
+
+        self.moduleIndex = moduleIndex
+        self.positionIndex = positionIndex
+        self.moduleList = moduleList
+        self.conflicts = conflicts
+        self.indexModificationTime = modificationTime
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # returns list of all modules in the table: [['M2222', ['BPix', 'BmO', 'SEC1', 'LYR2', 'LDR1H', 'MOD4']], ...]
+    # ------------------------------------------------------------------------------------------------------------------
+    def getModuleList(self):
+        self.loadIndex()
+        return self.moduleList
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # returns dictionary: position string -> module ID
+    # ------------------------------------------------------------------------------------------------------------------
+    def getPositionIndex(self):
+        self.loadIndex()
+        return self.positionIndex
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # reverse lookup, returns module ID for position string 'BPix_BmO_SEC1_LYR2_LDR1H_MOD4' or None
+    # ------------------------------------------------------------------------------------------------------------------
+    def getModuleID(self, ModulePosition):
+        self.loadIndex()
+        return self.positionIndex.get(ModulePosition)
+
+    def getModulePosition(self, ModuleID):
+        self.loadIndex()
+
+        if ModuleID in self.moduleIndex:
+            modulePosition = list(self.moduleIndex[ModuleID])
             print " -> module found:", ModuleID
             print " -> position: ", '_'.join(modulePosition)
         else:
-            print "\x1b[31m -> module ", ModuleID, " not found in ", modulesListFileName, "\x1b[0m"
+            print "\x1b[31m -> module ", ModuleID, " not found in ", self.getModulesListFileName(), "\x1b[0m"
             print "\x1b[31m -> module ID will be used to create files instead of BPix position!\x1b[0m"
             modulePosition = [ModuleID]
 
-        return modulePosition
\ No newline at end of file
+        return modulePosition
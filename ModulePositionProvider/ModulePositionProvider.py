@@ -1,4 +1,10 @@
 class AbstractModulePositionProvider(object):
 
     def getModulePosition(self, ModuleID):
-        raise NotImplementedError('getModulePosition() not implemented!')
\ No newline at end of file
+        raise NotImplementedError('getModulePosition() not implemented!')
+
+    def getModuleList(self):
+        raise NotImplementedError('getModuleList() not implemented!')
+
+    def getModuleID(self, ModulePosition):
+        raise NotImplementedError('getModuleID() not implemented!')
@@ -0,0 +1,281 @@
+import multiprocessing
+import traceback
+import math
+import os
+import re
+
+# ----------------------------------------------------------------------------------------------------------------------
+#  content validation of POS configuration files, as written by the POSWriter
+# ----------------------------------------------------------------------------------------------------------------------
+#  every file is read line by line and checked for:
+#   - ROC headers: names match the position in the file name, all 16 ROCs (L2/3/4) or the ROCs of the pseudo
+#     half-module (L1, see POSWriter.PseudoHalfModuleROCs), each ROC only once
+#   - trim and mask files: 52 'colNN:' lines with 80 pixels per ROC
+#   - DAC and TBM files: known parameter names, integer values within the bit range of the register
+#   - readback files: known parameter names, finite float values
+#  files are validated in parallel by a pool of worker processes, the result is a list of dicts, which can be written
+#  as JSON report
+# ----------------------------------------------------------------------------------------------------------------------
+
+# subfolder -> (file name prefix, file name suffix), see POSWriter.getOutputFileNames()
+fileTypes = {
+    'dac': ('ROC_DAC_module_', '.dat'),
+    'iana': ('ROC_Iana_', '.dat'),
+    'mask': ('ROC_Masks_module_', '.dat'),
+    'tbm': ('TBM_module_', '.dat'),
+    'trim': ('ROC_Trims_module_', '.dat'),
+}
+
+nRocs = 16
+nRows = 80
+nCols = 52
+pseudoHalfModuleROCs = [
+    [0, 1, 2, 3, 12, 13, 14, 15],
+    [4, 5, 6, 7, 8, 9, 10, 11],
+]
+
+# number of bits of the ROC DACs and TBM registers
+dacBits = {'Vdd': 4, 'Vana': 8, 'Vsh': 8, 'Vcomp': 4, 'VwllPr': 8, 'VwllSh': 8, 'VHldDel': 8, 'Vtrim': 8, 'VcThr': 8,
+           'VIbias_bus': 8, 'PHOffset': 8, 'Vcomp_ADC': 8, 'PHScale': 8, 'VIColOr': 8, 'Vcal': 8, 'CalDel': 8,
+           'TempRange': 8, 'WBC': 8, 'ChipContReg': 8, 'Readback': 4}
+tbmBits = {'TBMABase0': 8, 'TBMBBase0': 8, 'TBMAAutoReset': 1, 'TBMBAutoReset': 1, 'TBMANoTokenPass': 1,
+           'TBMBNoTokenPass': 1, 'TBMADisablePKAMCounter': 1, 'TBMBDisablePKAMCounter': 1, 'TBMAPKAMCount': 8,
+           'TBMBPKAMCount': 8, 'TBMPLLDelay': 8, 'TBMADelay': 8, 'TBMBDelay': 8}
+readbackParameters = ['par0vd', 'par1vd', 'par0va', 'par1va', 'par0rbia', 'par1rbia', 'par0tbia', 'par1tbia',
+                      'par2tbia', 'par0ia', 'par1ia', 'par2ia']
+
+# characters allowed for the pixels in trim and mask files
+pixelCharacters = {'trim': '0123456789abcdef', 'mask': '01'}
+columnPrefixes = ['col%02d:' % iCol for iCol in range(nCols)]
+
+# valid pixel lines are matched with one regular expression per column, only invalid lines are checked in detail
+pixelLinePatterns = dict([(fileType, [re.compile(r'%s[ \t]*[%s]{%d}[ \t]*$' % (columnPrefix, characters, nRows)) for columnPrefix in columnPrefixes]) for fileType, characters in pixelCharacters.items()])
+
+# only the first errors of a file are reported
+maxErrorsPerFile = 20
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# returns the list of ROCs expected in a file of the given position
+#   L1 positions (or module IDs M1xxx, for modules not in the position table) are pseudo half-modules: F = TBM 0, H = TBM 1
+# ----------------------------------------------------------------------------------------------------------------------
+def getExpectedRocs(positionString):
+    if '_LYR' in positionString:
+        halfModule = re.search(r'_LDR\d+([FH])(_|$)', positionString) if '_LYR1_' in positionString else None
+    else:
+        halfModule = re.match(r'^M1.*([FH])$', positionString, re.IGNORECASE)
+    if halfModule:
+        return pseudoHalfModuleROCs[1 if halfModule.group(1).upper() == 'H' else 0]
+    return range(nRocs)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# checks the list of ROC names (from the headers) against the position, returns list of error messages
+# ----------------------------------------------------------------------------------------------------------------------
+def validateRocHeaders(rocNames, positionString):
+    errors = []
+    rocIDs = []
+    for rocName in rocNames:
+        if not rocName.startswith(positionString + '_ROC') or not rocName[len(positionString) + 4:].isdigit():
+            errors.append("ROC name does not match position: %s" % rocName)
+        else:
+            rocIDs.append(int(rocName[len(positionString) + 4:]))
+    expectedRocs = getExpectedRocs(positionString)
+    if len(rocNames) != len(expectedRocs):
+        errors.append("%d ROCs found, expected %d" % (len(rocNames), len(expectedRocs)))
+    duplicateRocs = sorted(set([x for x in rocIDs if rocIDs.count(x) > 1]))
+    if len(duplicateRocs) > 0:
+        errors.append("duplicate ROCs: %s" % ','.join(['%d' % x for x in duplicateRocs]))
+    missingRocs = [x for x in expectedRocs if x not in rocIDs]
+    if len(missingRocs) > 0:
+        errors.append("missing ROCs: %s" % ','.join(['%d' % x for x in missingRocs]))
+    unexpectedRocs = sorted(set(rocIDs) - set(expectedRocs))
+    if len(unexpectedRocs) > 0:
+        errors.append("unexpected ROCs: %s" % ','.join(['%d' % x for x in unexpectedRocs]))
+    return errors
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# checks 'Name: value' line, returns error message or None
+# ----------------------------------------------------------------------------------------------------------------------
+def validateParameterLine(line, parameterBits):
+    parts = line.split(':')
+    if len(parts) != 2:
+        return "invalid line: %r" % line
+    name = parts[0].strip()
+    if name not in parameterBits:
+        return "unknown parameter: %s" % name
+    try:
+        value = int(parts[1])
+    except ValueError:
+        return "invalid value for %s: %r" % (name, parts[1].strip())
+    if value < 0 or value >= (1 << parameterBits[name]):
+        return "%s out of range (%d bit): %d" % (name, parameterBits[name], value)
+    return None
+
+
+def validateReadbackLine(line):
+    parts = line.split(':')
+    if len(parts) != 2:
+        return "invalid line: %r" % line
+    name = parts[0].strip()
+    if name not in readbackParameters:
+        return "unknown parameter: %s" % name
+    try:
+        value = float(parts[1])
+    except ValueError:
+        return "invalid value for %s: %r" % (name, parts[1].strip())
+    if math.isnan(value) or math.isinf(value):
+        return "invalid value for %s: %r" % (name, parts[1].strip())
+    return None
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# ROC files (dac, iana, trim, mask): blocks of lines, each starting with a 'ROC: {position}_ROC{n}' header
+# ----------------------------------------------------------------------------------------------------------------------
+def validateRocFile(inputFile, fileType, positionString):
+    errors = []
+    rocNames = []
+    rocLines = None
+    rocParameters = []
+    firstRocParameters = None
+    allowedCharacters = pixelCharacters.get(fileType)
+    linePatterns = pixelLinePatterns.get(fileType)
+
+    def closeRoc():
+        if rocLines is None:
+            return
+        if allowedCharacters is not None:
+            if rocLines != nCols:
+                errors.append("%s: %d column lines found, expected %d" % (rocNames[-1], rocLines, nCols))
+        elif firstRocParameters is not None and rocParameters != firstRocParameters:
+            errors.append("%s: parameters differ from first ROC: %s" % (rocNames[-1], ','.join(rocParameters)))
+
+    for lineNumber, line in enumerate(inputFile, start=1):
+        # after too many errors, only the ROC headers are collected, to check the number of ROCs of the whole file
+        if len(errors) > maxErrorsPerFile:
+            if line.startswith('ROC:'):
+                rocNames.append(line[4:].strip())
+            rocLines = None
+            continue
+        if linePatterns is not None and rocLines is not None and rocLines < nCols and linePatterns[rocLines].match(line):
+            rocLines += 1
+            continue
+        line = line.rstrip('\r\n')
+        if line.startswith('ROC:'):
+            closeRoc()
+            if rocLines is not None and firstRocParameters is None:
+                firstRocParameters = rocParameters
+            rocNames.append(line[4:].strip())
+            rocLines = 0
+            rocParameters = []
+        elif len(line.strip()) < 1:
+            continue
+        elif rocLines is None:
+            errors.append("line %d: data before first ROC header" % lineNumber)
+        elif allowedCharacters is not None:
+            # pixel lines: 'colNN:   ' + 80 characters
+            if rocLines >= nCols or not line.startswith(columnPrefixes[rocLines]):
+                errors.append("line %d: expected %s" % (lineNumber, columnPrefixes[rocLines] if rocLines < nCols else 'ROC header'))
+            else:
+                pixels = line[len(columnPrefixes[rocLines]):].strip()
+                if len(pixels) != nRows:
+                    errors.append("line %d: %d pixels, expected %d" % (lineNumber, len(pixels), nRows))
+                elif len(pixels.translate(None, allowedCharacters)) > 0:
+                    errors.append("line %d: invalid pixel values" % lineNumber)
+            rocLines += 1
+        else:
+            if fileType == 'iana':
+                lineError = validateReadbackLine(line)
+            else:
+                lineError = validateParameterLine(line, dacBits)
+            if lineError:
+                errors.append("line %d: %s" % (lineNumber, lineError))
+            rocParameters.append(line.split(':')[0].strip())
+            rocLines += 1
+    closeRoc()
+
+    return validateRocHeaders(rocNames, positionString) + errors
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# TBM files: '{position}_ROC0' header ('_ROC4' for the second TBM of L1 modules) and 'Name: value' lines
+# ----------------------------------------------------------------------------------------------------------------------
+def validateTbmFile(inputFile, positionString):
+    errors = []
+    expectedHeader = positionString + ('_ROC4' if getExpectedRocs(positionString) == pseudoHalfModuleROCs[1] else '_ROC0')
+    parameterNames = []
+    for lineNumber, line in enumerate(inputFile, start=1):
+        line = line.rstrip('\r\n')
+        if lineNumber == 1:
+            if line.strip() != expectedHeader:
+                errors.append("header %r does not match position, expected %s" % (line.strip(), expectedHeader))
+        elif len(line.strip()) > 0:
+            lineError = validateParameterLine(line, tbmBits)
+            if lineError:
+                errors.append("line %d: %s" % (lineNumber, lineError))
+            parameterNames.append(line.split(':')[0].strip())
+        if len(errors) > maxErrorsPerFile:
+            break
+    if len(parameterNames) < 1:
+        errors.append("no TBM parameters found")
+    duplicateNames = sorted(set([x for x in parameterNames if parameterNames.count(x) > 1]))
+    if len(duplicateNames) > 0:
+        errors.append("duplicate parameters: %s" % ','.join(duplicateNames))
+    return errors
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# validates a single file
+#   task: (subfolder, file name), returns dict with file name, type, position and list of errors
+# ----------------------------------------------------------------------------------------------------------------------
+def validateFile(task):
+    fileType, fileName = task
+    prefix, suffix = fileTypes[fileType]
+    baseName = os.path.basename(fileName)
+    positionString = baseName[len(prefix):-len(suffix)] if baseName.startswith(prefix) and baseName.endswith(suffix) else baseName
+    try:
+        if positionString == baseName:
+            errors = ["invalid file name"]
+        else:
+            with open(fileName, 'r') as inputFile:
+                if fileType == 'tbm':
+                    errors = validateTbmFile(inputFile, positionString)
+                else:
+                    errors = validateRocFile(inputFile, fileType, positionString)
+    except Exception as e:
+        errors = ["could not read file: %r\n%s" % (e, traceback.format_exc())]
+
+    if len(errors) > maxErrorsPerFile:
+        errors = errors[:maxErrorsPerFile] + ["... (more errors not shown)"]
+    return {'file': fileName, 'type': fileType, 'position': positionString, 'errors': errors}
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# validates all files of a configuration ID, with a pool of worker processes for jobs > 1
+#   returns list of dicts from validateFile(), sorted by subfolder and file name
+# ----------------------------------------------------------------------------------------------------------------------
+def validateConfigurationFiles(configurationBase, configurationId, jobs = 1):
+    tasks = []
+    for fileType in sorted(fileTypes.keys()):
+        folderName = os.path.join(configurationBase, fileType, '%s' % configurationId)
+        try:
+            fileNames = sorted(os.listdir(folderName))
+        except OSError:
+            continue
+        tasks += [(fileType, os.path.join(folderName, x)) for x in fileNames if not x.startswith('.')]
+
+    if jobs <= 1 or len(tasks) < 2:
+        results = [validateFile(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(processes=jobs)
+        try:
+            results = pool.map(validateFile, tasks, chunksize=max(1, len(tasks) // (4 * jobs)))
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    return results
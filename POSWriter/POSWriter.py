@@ -1,8 +1,13 @@
+from CalibrationDataProvider.ModuleCalibration import toDacs, toTrims, toMasks, toTbm, toReadback
+from multiprocessing.pool import ThreadPool
+import tempfile
 import os
 
 class POSWriter(object):
 
-    def __init__(self, outputPath = "", configurationID = -1, createFoldersOnInitialization = True):
+    # writeThreads > 0: files are written in the background by a pool of threads, waitForWrites() has to be called to
+    #                   make sure all files are written and to get the write errors
+    def __init__(self, outputPath = "", configurationID = -1, createFoldersOnInitialization = True, writeThreads = 0):
 
         try:
             self.configurationID = int(configurationID)
@@ -16,6 +21,27 @@ class POSWriter(object):
         self.nRows = 80
         self.nCols = 52
 
+        # background writing of output files
+        self.writeThreads = writeThreads
+        self.writePool = None
+        self.writePoolPid = None
+        self.maxPendingWrites = 64 * max(1, writeThreads)
+        self.pendingWrites = []
+        self.queuedFiles = []
+        self.writeErrors = {}
+
+        # mkstemp() creates files only readable by the owner, use the permissions normal files would get
+        umask = os.umask(0)
+        os.umask(umask)
+        self.fileMode = 0666 & ~umask
+
+        # pixel encoding in trim and mask files, one character per pixel:
+        #   trimbit value -> hex digit, mask bit 0 -> '1' (enabled), 1 -> '0' (masked)
+        self.trimEncodingTable = ''.join(['%1x'%i for i in range(16)]) + '?' * 240
+        self.trimValues = ''.join([chr(i) for i in range(16)])
+        self.maskEncodingTable = '1' + '0' * 255
+        self.columnPrefixes = ['col%02d:   '%iCol for iCol in range(self.nCols)]
+
         # output file names
         if self.configurationID < 0:
             self.outputFileNameDAC = "ROC_DAC_module_{Position}.dat"
@@ -72,6 +98,106 @@ class POSWriter(object):
         return {'dac': self.outputFileNameDAC, 'trim': self.outputFileNameTrims, 'tbm': self.outputFileNameTBM,
                 'mask': self.outputFileNameMasks, 'iana': self.outputFileNameReadback}
 
+    # ------------------------------------------------------------------------------------------------------------------
+    # write complete file content to a temporary file in the same folder and rename it, so that readers never see a
+    # partially written file
+    # ------------------------------------------------------------------------------------------------------------------
+    def writeFileAtomic(self, outputFileName, content):
+        outputFolder, outputFileBaseName = os.path.split(outputFileName)
+        temporaryFile, temporaryFileName = tempfile.mkstemp(dir=outputFolder if outputFolder else '.', prefix='.' + outputFileBaseName + '.', suffix='.tmp')
+        try:
+            with os.fdopen(temporaryFile, 'w') as outputFile:
+                outputFile.write(content)
+            os.chmod(temporaryFileName, self.fileMode)
+            if os.name == 'nt' and os.path.isfile(outputFileName):
+                # rename does not replace existing files on Windows
+                os.remove(outputFileName)
+            os.rename(temporaryFileName, outputFileName)
+        except:
+            try:
+                os.remove(temporaryFileName)
+            except OSError:
+                pass
+            raise
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # write file directly or queue it for the background threads
+    # ------------------------------------------------------------------------------------------------------------------
+    def writeFile(self, outputFileName, content):
+        self.queuedFiles.append(outputFileName)
+        if self.writeThreads < 1:
+            self.writeFileAtomic(outputFileName, content)
+            return
+
+        # thread pool is created once per process, it can't be used after fork()
+        if self.writePool is None or self.writePoolPid != os.getpid():
+            self.writePool = ThreadPool(processes=self.writeThreads)
+            self.writePoolPid = os.getpid()
+            self.pendingWrites = []
+
+        # limit memory used by file contents waiting to be written
+        while len(self.pendingWrites) >= self.maxPendingWrites:
+            self.pendingWrites[0][1].wait()
+            self.collectWrites()
+
+        self.pendingWrites.append([outputFileName, self.writePool.apply_async(self.writeFileAtomic, (outputFileName, content))])
+
+    # removes finished background writes from the queue and keeps their errors
+    def collectWrites(self, wait = False):
+        pendingWrites = []
+        for outputFileName, writeResult in self.pendingWrites:
+            if wait or writeResult.ready():
+                try:
+                    writeResult.get()
+                except Exception as e:
+                    print "\x1b[31mERROR: could not write file '%s': %r\x1b[0m"%(outputFileName, e)
+                    self.writeErrors[outputFileName] = "%r"%e
+            else:
+                pendingWrites.append([outputFileName, writeResult])
+        self.pendingWrites = pendingWrites
+
+    # waits until all queued files are written, returns {file name: error message} for failed writes since last call
+    def waitForWrites(self):
+        self.collectWrites(wait=True)
+        writeErrors = self.writeErrors
+        self.writeErrors = {}
+        return writeErrors
+
+    # returns list of all files queued for writing since the last call
+    def takeQueuedFiles(self):
+        queuedFiles = self.queuedFiles
+        self.queuedFiles = []
+        return queuedFiles
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # make sure files (and the renames in their folders) are on disk, once at the end instead of after every file
+    # ------------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def syncFiles(fileNames):
+        folders = set()
+        for fileName in fileNames:
+            try:
+                fileDescriptor = os.open(fileName, os.O_RDONLY)
+                try:
+                    os.fsync(fileDescriptor)
+                finally:
+                    os.close(fileDescriptor)
+                folders.add(os.path.dirname(fileName) if os.path.dirname(fileName) else '.')
+            except OSError as e:
+                print "\x1b[31mERROR: could not sync file '%s': %r\x1b[0m"%(fileName, e)
+
+        # folders can't be opened on Windows
+        if os.name != 'nt':
+            for folder in folders:
+                try:
+                    fileDescriptor = os.open(folder, os.O_RDONLY)
+                    try:
+                        os.fsync(fileDescriptor)
+                    finally:
+                        os.close(fileDescriptor)
+                except OSError:
+                    pass
+
     # ------------------------------------------------------------------------------------------------------------------
     # check if L1 or L2/3/4 module
     # ------------------------------------------------------------------------------------------------------------------
@@ -88,25 +214,24 @@ class POSWriter(object):
         if len(rocsData) < 1:
             raise Exception("no ROC DAC parameters found!")
 
-        with open(outputFileName, 'w') as outputFile:
-            nLines = 0
-            for rocData in rocsData:
-                rocID = rocData['ROC']
-                rocHeaderLine = 'ROC:'.ljust(self.columnWidth) + modulePositionString + self.rocSuffix%rocID + '\n'
-
-                # write header
-                outputFile.write(rocHeaderLine)
+        outputLines = []
+        nLines = 0
+        for rocID in rocsData.rocs:
+            rocHeaderLine = 'ROC:'.ljust(self.columnWidth) + modulePositionString + self.rocSuffix%rocID + '\n'
 
-                # sort DACs
-                rocDACs = rocData['DACs']
-
-                rocDACs.sort(key=lambda dac: self.rocDACOrder.index(dac['Name']) if dac['Name'] in self.rocDACOrder else 999)
-
-                # write DACs
-                for rocDAC in rocData['DACs']:
-                    dacLine = ("%s:"%rocDAC['Name']).ljust(self.columnWidth) + rocDAC['Value'] + '\n'
-                    outputFile.write(dacLine)
-                nLines = len(rocData['DACs'])
+            # write header
+            outputLines.append(rocHeaderLine)
+
+            # sort DACs
+            rocDACs = rocsData.getRoc(rocID)
+            rocDACs.sort(key=lambda dac: self.rocDACOrder.index(dac[0]) if dac[0] in self.rocDACOrder else 999)
+
+            # write DACs
+            for dacName, dacValue in rocDACs:
+                dacLine = ("%s:"%dacName).ljust(self.columnWidth) + '%d'%dacValue + '\n'
+                outputLines.append(dacLine)
+            nLines = len(rocDACs)
+        self.writeFile(outputFileName, ''.join(outputLines))
         print "  -> {nLines} parameters for {nRocs} ROCS written to '\x1b[34m{outputFileName}\x1b[0m'".format(nLines=nLines, nRocs=len(rocsData), outputFileName=outputFileName)
         if nLines < 1:
             raise Exception("no ROC DAC parameters written!")
@@ -115,14 +240,32 @@ class POSWriter(object):
     # write DAC file(s)
     # ------------------------------------------------------------------------------------------------------------------
     def writeDACs(self, ModuleID, ModulePosition, rocsData):
+        rocsData = toDacs(rocsData)
 
         if self.isL1Module(ModuleID):
             # write separate files for pseudo half-modules
             for i in range(2):
-                self.writeSingleDACFiles([x for x in rocsData if x['ROC'] in self.PseudoHalfModuleROCs[i]], self.getFormattedHalfModuleName(ModulePosition, i))
+                self.writeSingleDACFiles(rocsData.select([x for x in rocsData.rocs if x in self.PseudoHalfModuleROCs[i]]), self.getFormattedHalfModuleName(ModulePosition, i))
         else:
             self.writeSingleDACFiles(rocsData, self.getFormattedModuleName(ModulePosition))
 
+    # ------------------------------------------------------------------------------------------------------------------
+    # encode the pixel values of one ROC (pixel = col * 80 + row) into the block of 52 'colNN:' lines with a translation
+    # table, instead of formatting every pixel separately. pixels of a column are contiguous, so each line is one slice
+    # ------------------------------------------------------------------------------------------------------------------
+    def encodePixelBlock(self, rocValues, encodingTable):
+        encodedValues = str(rocValues).translate(encodingTable)
+        return ''.join([self.columnPrefixes[iCol] + encodedValues[iCol * self.nRows:(iCol + 1) * self.nRows] + '\n' for iCol in range(self.nCols)])
+
+    def encodeTrimBlock(self, rocTrims):
+        # values > 15 don't fit into one hex digit, format them pixel by pixel as before
+        if len(str(rocTrims).translate(None, self.trimValues)) > 0:
+            return ''.join([self.columnPrefixes[iCol] + ''.join(['%1x' % rocTrims[iCol * self.nRows + iRow] for iRow in range(self.nRows)]) + '\n' for iCol in range(self.nCols)])
+        return self.encodePixelBlock(rocTrims, self.trimEncodingTable)
+
+    def encodeMaskBlock(self, rocMasks):
+        return self.encodePixelBlock(rocMasks, self.maskEncodingTable)
+
     # ------------------------------------------------------------------------------------------------------------------
     # write single trim bit file
     # ------------------------------------------------------------------------------------------------------------------
@@ -132,22 +275,17 @@ class POSWriter(object):
         if len(trimData) < 1:
             raise Exception("no ROCs with trimbit parameters found!")
 
-        with open(outputFileName, 'w') as outputFile:
-            for rocData in trimData:
-                rocID = rocData['ROC']
-                rocHeaderLine = 'ROC:\t ' + modulePositionString + self.rocSuffix % rocID + '\n'
-
-                # write header
-                outputFile.write(rocHeaderLine)
-
-                # write trim bits
-                for iCol in range(self.nCols):
-                    colTrims = ''
-                    for iRow in range(self.nRows):
-                        iPix = iCol * self.nRows + iRow
-                        colTrims += '%1x' % rocData['Trims'][iPix]
-                    colLine = "col%02d:   %s\n" % (iCol, colTrims)
-                    outputFile.write(colLine)
+        outputBlocks = []
+        for rocID in trimData.rocs:
+            rocHeaderLine = 'ROC:\t ' + modulePositionString + self.rocSuffix % rocID + '\n'
+            rocTrims = trimData.getRoc(rocID)
+
+            # write header
+            outputBlocks.append(rocHeaderLine)
+
+            # write trim bits
+            outputBlocks.append(self.encodeTrimBlock(rocTrims))
+        self.writeFile(outputFileName, ''.join(outputBlocks))
         print "  -> trimbits for {nRocs} ROCS written to '\x1b[34m{outputFileName}\x1b[0m'".format(nRocs=len(trimData),
                                                                                                    outputFileName=outputFileName)
 
@@ -155,11 +293,12 @@ class POSWriter(object):
     # write trim bit file(s)
     # ------------------------------------------------------------------------------------------------------------------
     def writeTrim(self, ModuleID, ModulePosition, trimData):
+        trimData = toTrims(trimData)
 
         if self.isL1Module(ModuleID):
             # write separate files for pseudo half-modules
             for i in range(2):
-                self.writeSingleTrimFile([x for x in trimData if x['ROC'] in self.PseudoHalfModuleROCs[i]], self.getFormattedHalfModuleName(ModulePosition, i))
+                self.writeSingleTrimFile(trimData.select([x for x in trimData.rocs if x in self.PseudoHalfModuleROCs[i]]), self.getFormattedHalfModuleName(ModulePosition, i))
         else:
             self.writeSingleTrimFile(trimData, self.getFormattedModuleName(ModulePosition))
 
@@ -172,60 +311,55 @@ class POSWriter(object):
         if len(maskData) < 1:
             raise Exception("no ROCs with trimbit parameters found!")
 
-        with open(outputFileName, 'w') as outputFile:
-            for rocData in maskData:
-                rocID = rocData['ROC']
-                rocHeaderLine = 'ROC:\t ' + modulePositionString + self.rocSuffix % rocID + '\n'
-
-                # write header
-                outputFile.write(rocHeaderLine)
-
-                # write trim bits
-                for iCol in range(self.nCols):
-                    colMasks = ''
-                    for iRow in range(self.nRows):
-                        iPix = iCol * self.nRows + iRow
-                        if rocData['Masks'][iPix] == 0:  # mask bit not set
-                            colMasks += '1'  # enabled
-                        else:
-                            colMasks += '0'  # masked
-
-                    colLine = "col%02d:   %s\n"%(iCol, colMasks)
-                    outputFile.write(colLine)
+        outputBlocks = []
+        for rocID in maskData.rocs:
+            rocHeaderLine = 'ROC:\t ' + modulePositionString + self.rocSuffix % rocID + '\n'
+            rocMasks = maskData.getRoc(rocID)
+
+            # write header
+            outputBlocks.append(rocHeaderLine)
+
+            # write mask bits
+            outputBlocks.append(self.encodeMaskBlock(rocMasks))
+        self.writeFile(outputFileName, ''.join(outputBlocks))
         print "  -> maskbits for {nRocs} ROCS written to '\x1b[34m{outputFileName}\x1b[0m'".format(nRocs=len(maskData), outputFileName=outputFileName)
 
     # ------------------------------------------------------------------------------------------------------------------
     # write mask bit file(s)
     # ------------------------------------------------------------------------------------------------------------------
     def writeMask(self, ModuleID, ModulePosition, maskData):
+        maskData = toMasks(maskData)
 
         if self.isL1Module(ModuleID):
             # write separate files for pseudo half-modules
             for i in range(2):
-                self.writeSingleMaskFile([x for x in maskData if x['ROC'] in self.PseudoHalfModuleROCs[i]], self.getFormattedHalfModuleName(ModulePosition, i))
+                self.writeSingleMaskFile(maskData.select([x for x in maskData.rocs if x in self.PseudoHalfModuleROCs[i]]), self.getFormattedHalfModuleName(ModulePosition, i))
         else:
             self.writeSingleMaskFile(maskData, self.getFormattedModuleName(ModulePosition))
 
     # ------------------------------------------------------------------------------------------------------------------
     # write single TBM configuration file
     # ------------------------------------------------------------------------------------------------------------------
-    def writeSingleTBMFile(self, tbmData, modulePositionString):
+    #   tbmId: 1 for the second TBM of L1 modules (ROCs 4-11), which is written with a 'ROC4' header
+    # ------------------------------------------------------------------------------------------------------------------
+    def writeSingleTBMFile(self, tbmData, modulePositionString, tbmId = 0):
         outputFileName = self.outputPath + self.outputFileNameTBM.format(Position=modulePositionString)
-        with open(outputFileName, 'w') as outputFile:
+        outputLines = []
 
-            if 'H_MOD' in modulePositionString.upper():
-                headerLine = modulePositionString + '_ROC4\n'  # for some reason there has to be a 'ROC0' even for TBM configuration
-            else:
-                headerLine = modulePositionString + '_ROC0\n'  # for some reason there has to be a 'ROC4' even for TBM configuration
+        if tbmId == 1:
+            headerLine = modulePositionString + '_ROC4\n'  # for some reason there has to be a 'ROC4' even for TBM configuration
+        else:
+            headerLine = modulePositionString + '_ROC0\n'  # for some reason there has to be a 'ROC0' even for TBM configuration
 
 
-            # write header
-            outputFile.write(headerLine)
+        # write header
+        outputLines.append(headerLine)
 
-            # write values
-            for tbmParameter in tbmData:
-                line = self.dacFormat.format(Name=tbmParameter['Name'], Value=tbmParameter['Value'])
-                outputFile.write(line)
+        # write values
+        for tbmParameterName, tbmParameterValue in tbmData:
+            line = self.dacFormat.format(Name=tbmParameterName, Value=tbmParameterValue)
+            outputLines.append(line)
+        self.writeFile(outputFileName, ''.join(outputLines))
         print "  -> TBM parameters written to '\x1b[34m{outputFileName}\x1b[0m'".format(outputFileName=outputFileName)
 
     # ------------------------------------------------------------------------------------------------------------------
@@ -248,30 +382,38 @@ class POSWriter(object):
     def getFormattedModuleName(self, ModulePosition):
         return "_".join(ModulePosition)
 
+    # ------------------------------------------------------------------------------------------------------------------
+    # returns list of position strings used in the file names of a module, two (F/H) for L1 modules
+    # ------------------------------------------------------------------------------------------------------------------
+    def getModulePositionStrings(self, ModuleID, ModulePosition):
+        if self.isL1Module(ModuleID):
+            return [self.getFormattedHalfModuleName(ModulePosition, i) for i in range(2)]
+        else:
+            return [self.getFormattedModuleName(ModulePosition)]
+
     # ------------------------------------------------------------------------------------------------------------------
     # write TBM(s) configuration files
     # ------------------------------------------------------------------------------------------------------------------
+    #   tbmData: one row of TBM registers for L2/3/4 modules, two rows (TBM 0 and 1) for L1 modules
+    # ------------------------------------------------------------------------------------------------------------------
     def writeTBM(self, ModuleID, ModulePosition, tbmData):
-
+        tbmData = toTbm(tbmData)
 
         if len(tbmData) < 1:
             raise Exception("no ROCs with TBM parameters found!")
 
-        if type(tbmData) != list:
-            raise Exception("malformatted TBM data found")
-
-        if type(tbmData[0]) == list:
+        if len(tbmData) > 1:
             if not self.isL1Module(ModuleID):
                 raise Exception("L1 module dual TBM data found, but module is not a L1 module!")
 
             print "  -> L1 module dual TBM data found, writing 2 files"
             for tbmId in range(2):
-                self.writeSingleTBMFile(tbmData[tbmId], self.getFormattedHalfModuleName(ModulePosition, tbmId))
+                self.writeSingleTBMFile(tbmData.getRoc(tbmData.rocs[tbmId]), self.getFormattedHalfModuleName(ModulePosition, tbmId), tbmId)
 
         else:
             if self.isL1Module(ModuleID):
                 raise Exception("L2/3/4 module single TBM data found, but module is a L1 module!")
-            self.writeSingleTBMFile(tbmData, self.getFormattedModuleName(ModulePosition))
+            self.writeSingleTBMFile(tbmData.getRoc(tbmData.rocs[0]), self.getFormattedModuleName(ModulePosition))
 
     # ------------------------------------------------------------------------------------------------------------------
     # write single Readback calibration file
@@ -282,25 +424,25 @@ class POSWriter(object):
         if len(readbackData) < 1:
             raise Exception("no ROCs with calibrated readback found!")
 
-        with open(outputFileName, 'w') as outputFile:
-            nLines = 0
-            for rocData in readbackData:
-                rocID = rocData['ROC']
-                rocHeaderLine = 'ROC:'.ljust(self.columnWidth) + modulePositionString + self.rocSuffix % rocID + '\n'
+        outputLines = []
+        nLines = 0
+        for rocID in readbackData.rocs:
+            rocHeaderLine = 'ROC:'.ljust(self.columnWidth) + modulePositionString + self.rocSuffix % rocID + '\n'
 
-                # write header
-                outputFile.write(rocHeaderLine)
+            # write header
+            outputLines.append(rocHeaderLine)
 
-                # sort readback calibration constants
-                readbackParameters = rocData['ReadbackCalibration']
-                readbackParameters.sort(key=lambda par: self.readbackParametersOrder.index(par['Name']) if par['Name'] in self.readbackParametersOrder else 999)
+            # sort readback calibration constants
+            readbackParameters = readbackData.getRoc(rocID)
+            readbackParameters.sort(key=lambda par: self.readbackParametersOrder.index(par[0]) if par[0] in self.readbackParametersOrder else 999)
 
-                # write readback calibration constants
-                for readbackParameter in readbackParameters:
-                    parLine = self.readbackFormat.format(Name=readbackParameter['Name'], Value=readbackParameter['Value'])
-                    outputFile.write(parLine)
+            # write readback calibration constants
+            for readbackParameterName, readbackParameterValue in readbackParameters:
+                parLine = self.readbackFormat.format(Name=readbackParameterName, Value=readbackParameterValue)
+                outputLines.append(parLine)
 
-                nLines = len(readbackParameters)
+            nLines = len(readbackParameters)
+        self.writeFile(outputFileName, ''.join(outputLines))
         message = "  -> {nLines} readback parameters for {nRocs} ROCS written to '\x1b[34m{outputFileName}\x1b[0m'"
         print message.format(nLines=nLines, nRocs=len(readbackData), outputFileName=outputFileName)
 
@@ -311,11 +453,12 @@ class POSWriter(object):
     # write Readback calibration file(s)
     # ------------------------------------------------------------------------------------------------------------------
     def writeReadback(self, ModuleID, ModulePosition, readbackData):
+        readbackData = toReadback(readbackData)
 
         if self.isL1Module(ModuleID):
             # write separate files for pseudo half-modules
             for i in range(2):
-                self.writeSingleReadbackFile([x for x in readbackData if x['ROC'] in self.PseudoHalfModuleROCs[i]],
+                self.writeSingleReadbackFile(readbackData.select([x for x in readbackData.rocs if x in self.PseudoHalfModuleROCs[i]]),
                                          self.getFormattedHalfModuleName(ModulePosition, i))
         else:
             self.writeSingleReadbackFile(readbackData, self.getFormattedModuleName(ModulePosition))
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------------------------------------------------------
+#  benchmark: reading trimbits and DACs from a synthetic pxar data tree, per-line parsing vs. bulk parsers
+#  run from the main directory: python benchmarks/benchmarkLocalDataParser.py [-m 1856] [-p /tmp/pxarTree]
+#  the default number of modules is the size of the detector, the tree takes ~130 MB per 100 modules
+# ----------------------------------------------------------------------------------------------------------------------
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from CalibrationDataProvider.LocalData import CalibrationDataProvider as LocalCalibrationDataProvider
+from CalibrationDataProvider.PxarParameterFiles import readTrimFile, readParameterFile
+
+nRocs = 16
+nRows = 80
+nCols = 52
+nPix = nRows * nCols
+dacNames = ['Vdig', 'Vana', 'Vsh', 'Vcomp', 'VwllPr', 'VwllSh', 'VhldDel', 'Vtrim', 'VthrComp', 'VIBias_Bus',
+            'PHOffset', 'Vcomp_ADC', 'PHScale', 'VIColOr', 'Vcal', 'CalDel', 'CtrlReg', 'WBC', 'Readback']
+
+
+# per line parsing, as it was done before in LocalData.getTrimBits/getRocDacs
+def readTrimFilePerLine(trimFileName):
+    rocTrims = bytearray(chr(15) * nPix)
+    with open(trimFileName, 'r') as trimFile:
+        for line in trimFile:
+            trimLine = [x.lower() for x in line.strip().split(' ') if len(x) > 0]
+            if trimLine[1].lower() == 'pix':
+                iPix = int(trimLine[2]) * nRows + int(trimLine[3])
+                rocTrims[iPix] = int(trimLine[0])
+            else:
+                raise NameError('invalid trim bits file format!')
+    return rocTrims
+
+
+def readDacFilePerLine(dacFileName):
+    dacs = []
+    with open(dacFileName, 'r') as dacFile:
+        for line in dacFile:
+            dacLine = [x.lower() for x in line.strip().split(' ') if len(x) > 0]
+            dacs.append((dacLine[1], dacLine[2]))
+    return dacs
+
+
+# pxar test folder with trim and DAC files of all ROCs, formatted as written by pxar
+def createModuleFolder(folderName, shuffled = False):
+    os.makedirs(folderName)
+    for iRoc in range(nRocs):
+        pixels = range(nPix)
+        if shuffled:
+            random.shuffle(pixels)
+        with open(os.path.join(folderName, 'trimParameters35_C%d.dat'%iRoc), 'w') as trimFile:
+            trimFile.write(''.join(['%2d   Pix %2d %2d\n'%(random.randint(0, 15), iPix // nRows, iPix % nRows) for iPix in pixels]))
+        with open(os.path.join(folderName, 'dacParameters35_C%d.dat'%iRoc), 'w') as dacFile:
+            dacFile.write(''.join(['%3d %-10s %3d\n'%(i + 1, dacName, random.randint(0, 255)) for i, dacName in enumerate(dacNames)]))
+
+
+parser = argparse.ArgumentParser(description='LocalData trim/DAC file parsing benchmark')
+parser.add_argument('-m', '--modules', dest='nModules', type=int, default=1856, help='number of modules in the synthetic tree')
+parser.add_argument('-p', '--path', dest='path', default='', help='folder for the synthetic tree, kept for the next runs. default: temporary folder')
+args = parser.parse_args()
+
+dataPath = args.path if args.path else tempfile.mkdtemp(prefix='pxarTree')
+moduleIDs = ['M%04d'%(1000 + i) for i in range(args.nModules)]
+options = {'tempnominal': 'm20_1', 'Test': '*ulltest*_m20_1', 'TrimValue': '35'}
+try:
+    random.seed(1)
+    startTime = time.time()
+    nCreated = 0
+    for moduleID in moduleIDs:
+        folderName = os.path.join(dataPath, '%s_FullQualification_2016-01-01_10h00m_1451638800'%moduleID, '000_Fulltest_m20_1')
+        if not os.path.isdir(folderName):
+            createModuleFolder(folderName, shuffled=(moduleID == moduleIDs[0]))
+            nCreated += 1
+    print "synthetic tree: %d modules in %s, %d created in %1.1f s"%(len(moduleIDs), dataPath, nCreated, time.time() - startTime)
+
+    # output has to be identical, also for files which are not in pxar pixel order (first module)
+    for moduleID in moduleIDs[:2]:
+        folderName = os.path.join(dataPath, '%s_FullQualification_2016-01-01_10h00m_1451638800'%moduleID, '000_Fulltest_m20_1')
+        for iRoc in range(nRocs):
+            trimFileName = os.path.join(folderName, 'trimParameters35_C%d.dat'%iRoc)
+            dacFileName = os.path.join(folderName, 'dacParameters35_C%d.dat'%iRoc)
+            assert readTrimFile(trimFileName) == readTrimFilePerLine(trimFileName)
+            assert readParameterFile(dacFileName) == readDacFilePerLine(dacFileName)
+    print "output identical"
+
+    fileNames = []
+    for moduleID in moduleIDs:
+        folderName = os.path.join(dataPath, '%s_FullQualification_2016-01-01_10h00m_1451638800'%moduleID, '000_Fulltest_m20_1')
+        fileNames += [(os.path.join(folderName, 'trimParameters35_C%d.dat'%iRoc), os.path.join(folderName, 'dacParameters35_C%d.dat'%iRoc)) for iRoc in range(nRocs)]
+
+    def readPerLine():
+        for trimFileName, dacFileName in fileNames:
+            readTrimFilePerLine(trimFileName)
+            readDacFilePerLine(dacFileName)
+
+    def readBulk():
+        for trimFileName, dacFileName in fileNames:
+            readTrimFile(trimFileName)
+            readParameterFile(dacFileName)
+
+    # complete data source: folder index, trim array and DAC matrix of each module
+    def readDataSource():
+        dataSource = LocalCalibrationDataProvider(dataSource=dataPath, options={})
+        for moduleID in moduleIDs:
+            dataSource.getTrimBits(moduleID, options)
+            dataSource.getRocDacs(moduleID, options)
+
+    benchmarks = [
+        ['files, per line', readPerLine],
+        ['files, bulk', readBulk],
+        ['LocalData data source', readDataSource],
+    ]
+
+    # files are read once before, so all benchmarks read from the page cache
+    readBulk()
+    devnull = open(os.devnull, 'w')
+    for benchmarkName, benchmarkFunction in benchmarks:
+        stdout, sys.stdout = sys.stdout, devnull
+        startTime = time.time()
+        try:
+            benchmarkFunction()
+        finally:
+            sys.stdout = stdout
+        duration = time.time() - startTime
+        print "{name: <30} {modulesPerSecond:10.1f} modules/s {duration:8.2f} s for {nModules} modules".format(name=benchmarkName, modulesPerSecond=len(moduleIDs) / duration, duration=duration, nModules=len(moduleIDs))
+finally:
+    if not args.path:
+        shutil.rmtree(dataPath)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------------------------------------------------------
+#  microbenchmark: encoding of trim and mask files in POSWriter, per-pixel formatting vs. translation tables
+#  run from the main directory: python benchmarks/benchmarkPOSWriterEncoding.py [-n 1000]
+# ----------------------------------------------------------------------------------------------------------------------
+import os
+import sys
+import random
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from POSWriter.POSWriter import POSWriter
+from CalibrationDataProvider.ModuleCalibration import PixelArray, PixelBitset
+
+
+# per pixel encoding, as it was done before in writeSingleTrimFile/writeSingleMaskFile
+def encodeTrimBlockPerPixel(posWriter, rocTrims):
+    block = ''
+    for iCol in range(posWriter.nCols):
+        colTrims = ''
+        for iRow in range(posWriter.nRows):
+            iPix = iCol * posWriter.nRows + iRow
+            colTrims += '%1x' % rocTrims[iPix]
+        block += "col%02d:   %s\n" % (iCol, colTrims)
+    return block
+
+
+def encodeMaskBlockPerPixel(posWriter, rocMasks):
+    block = ''
+    for iCol in range(posWriter.nCols):
+        colMasks = ''
+        for iRow in range(posWriter.nRows):
+            iPix = iCol * posWriter.nRows + iRow
+            if rocMasks[iPix] == 0:
+                colMasks += '1'
+            else:
+                colMasks += '0'
+        block += "col%02d:   %s\n" % (iCol, colMasks)
+    return block
+
+
+parser = argparse.ArgumentParser(description='POSWriter trim/mask encoding benchmark')
+parser.add_argument('-n', '--nrocs', dest='nRocs', type=int, default=1000, help='number of ROCs to encode')
+args = parser.parse_args()
+
+posWriter = POSWriter(outputPath='.', configurationID=-1)
+nPix = posWriter.nRows * posWriter.nCols
+random.seed(1)
+
+trims = PixelArray([], nPix)
+masks = PixelBitset([], nPix)
+for iRoc in range(16):
+    trims.setRoc(iRoc, [random.randint(0, 15) for i in range(nPix)])
+    masks.setRoc(iRoc, [1 if random.random() < 0.01 else 0 for i in range(nPix)])
+rocsTrims = [trims.getRoc(iRoc) for iRoc in range(16)]
+rocsMasks = [masks.getRoc(iRoc) for iRoc in range(16)]
+
+# output has to be identical, also for the slow path with trimbit values > 15
+rocTrimsLarge = bytearray(rocsTrims[0])
+rocTrimsLarge[123] = 16
+for rocTrims in rocsTrims + [rocTrimsLarge]:
+    assert posWriter.encodeTrimBlock(rocTrims) == encodeTrimBlockPerPixel(posWriter, rocTrims)
+for rocMasks in rocsMasks:
+    assert posWriter.encodeMaskBlock(rocMasks) == encodeMaskBlockPerPixel(posWriter, rocMasks)
+print "output identical"
+
+benchmarks = [
+    ['trim, per pixel', lambda: encodeTrimBlockPerPixel(posWriter, rocsTrims[iRoc % 16])],
+    ['trim, translation table', lambda: posWriter.encodeTrimBlock(rocsTrims[iRoc % 16])],
+    ['mask, per pixel', lambda: encodeMaskBlockPerPixel(posWriter, rocsMasks[iRoc % 16])],
+    ['mask, translation table', lambda: posWriter.encodeMaskBlock(rocsMasks[iRoc % 16])],
+    ['mask, unpack bitset + translation table', lambda: posWriter.encodeMaskBlock(masks.getRoc(iRoc % 16))],
+]
+
+iRoc = 0
+for benchmarkName, benchmarkFunction in benchmarks:
+    duration = timeit.timeit(benchmarkFunction, number=args.nRocs)
+    print "{name: <40} {rocsPerSecond:10.0f} ROCs/s {timePerRoc:10.1f} us/ROC".format(name=benchmarkName, rocsPerSecond=args.nRocs / duration, timePerRoc=1e6 * duration / args.nRocs)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+import argparse
+import ConfigParser
+import os
+import time
+import pxar2POSBatch
+from ModulePositionProvider.LocalData import ModulePositionProvider
+from CalibrationDataProvider.PisaDB import CalibrationDataProvider as PisaDBCalibrationDataProvider
+from CalibrationDataProvider.PisaDBMirror import exportMirror
+
+# load default configuration first and then overwrite with user configuration
+config = ConfigParser.SafeConfigParser()
+try:
+    config.read('DefaultConfiguration.ini')
+except:
+    print "\x1b[31mERROR: can't load DefaultConfiguration.ini file!\x1b[0m"
+try:
+    config.read('UserConfiguration.ini')
+except:
+    print "\x1b[31mERROR: can't load UserConfiguration.ini file!\x1b[0m"
+
+# ----------------------------------------------------------------------------------------------------------------
+#  configuration
+# ----------------------------------------------------------------------------------------------------------------
+
+parser = argparse.ArgumentParser(description='export the DB rows needed to convert the modules to a local SQLite mirror, which can be used as data source: -s sqlite:{file name}')
+parser.add_argument('-s', '--source', dest='source',
+                    help='database url (http://...)',
+                    default=config.get('Global', 'Database'))
+parser.add_argument('-p', '--positions', dest='positions',
+                    help='module position table',
+                    default=config.get('Paths', 'ModuleList'))
+parser.add_argument('-m', '--module', dest='module',
+                    help='module IDs or position selectors, e.g. M2222,LYR3. default: all modules of the module position table',
+                    default='all')
+parser.add_argument('-t', '--tempnominal', dest='tempnominal',
+                    help='fulltest temperatures to export, comma separated. -20 and +17 are needed for interpolated temperatures',
+                    default='m20_1,p17_1')
+parser.add_argument('-o', '--output', dest='output',
+                    help='SQLite file name',
+                    default='pisadb_mirror.sqlite')
+parser.add_argument('-v', '--verbose', dest='verbose', action='store_true',
+                    help='verbose output',
+                    default=False)
+args = parser.parse_args()
+
+if args.source.startswith('sqlite:') or 'http://' not in args.source:
+    print "\x1b[31mERROR: data source has to be a database url (http://...)\x1b[0m"
+    exit(1)
+
+modulePositionTable = ModulePositionProvider(dataPath=args.positions)
+moduleIDList = pxar2POSBatch.resolveModuleSelection(modulePositionTable.getModuleList(), args.module)
+tempnominals = [x.strip() for x in args.tempnominal.split(',') if len(x.strip()) > 0]
+if len(moduleIDList) < 1:
+    print "\x1b[31mERROR: no modules selected\x1b[0m"
+    exit(1)
+
+print "export DB mirror..."
+print "  -> modules: %d"%len(moduleIDList)
+print "  -> tempnominals:", ', '.join(tempnominals)
+print "  -> save mirror in:", args.output
+
+dataSource = PisaDBCalibrationDataProvider(dataSource=args.source, verbose=args.verbose, options={'SqlConnections': config.get('Global', 'SqlConnections')})
+startTime = time.time()
+nRows = exportMirror(dataSource, moduleIDList, tempnominals, args.output)
+
+print "-"*80
+for table, n in sorted(nRows.items()):
+    print "  %-20s %8d rows"%(table, n)
+print "  -> %1.1f MB in %1.1f s"%(os.path.getsize(args.output) / 1024.0 / 1024.0, time.time() - startTime)
+print "-"*80
@@ -4,13 +4,16 @@ import ConfigParser
 import os
 import shutil
 import glob
-import fnmatch
 from POSWriter.POSWriter import POSWriter
+from ModulePositionProvider.LocalData import ModulePositionProvider
+from CalibrationDataProvider.PxarParameterFiles import parseInteger
+import pxar2POSCommands
 
 PXAR2POSVERSION = '0.1'
 
 try:
     from pxar2POSConverter import pxar2POSConverter as pxar2POSConverter
+    import pxar2POSBatch
 except Exception as e:
     print "\x1b[31mcould not load module: 'pxar2POSConverter', make sure the file exists.\n" + "%r"%e +"\x1b[0m"
 
@@ -71,14 +74,24 @@ except:
 parser = argparse.ArgumentParser(description='converter for pxar data from database to pixel online software (POS) format, see README.md for some general examples how to use it')
 
 parser.add_argument('-m','--module',dest='module',
-                     help='module ID, e.g. M1234 or list of modules separated by comma, e.g. M1234,M2345,M3456',
+                     help='module ID, e.g. M1234 or list of modules separated by comma, e.g. M1234,M2345,M3456, or position selectors, e.g. LYR3 or BmO:SEC1-4',
                      default='')
+parser.add_argument('-a', '--all', dest='all', action='store_true',
+                    help='convert all modules of the module position table',
+                    default=False)
+parser.add_argument('-j', '--jobs', dest='jobs',
+                    help='number of parallel worker processes',
+                    type=int,
+                    default=config.get('Global', 'Jobs'))
 parser.add_argument('-T', '--trim', dest='trim',
                     help='trim value, e.g. 35, -1 for untrimmed',
                     default=config.get('Global', 'DefaultTrim'))
 parser.add_argument('-t', '--temp', dest='temp',
                     help='temperature',
                     default=config.get('Global', 'DefaultTemperature'))
+parser.add_argument('--matrix', dest='matrix',
+                    help='write several configurations from one data fetch, comma separated list of {temperature}:{trim value}={configuration ID}, e.g. m20:35=2,p8:35=3,m20:-1=4',
+                    default='')
 parser.add_argument('-o', '--output', dest='output',
                     help='output folder',
                     default=config.get('Paths', 'Output'))
@@ -97,18 +110,32 @@ parser.add_argument('-i', '--configuration-id', dest='configuration_id',
 parser.add_argument('-d', '--do', dest='do',
                     help='command to run',
                     default='')
+parser.add_argument('-y', '--yes', dest='yes', action='store_true',
+                    help='run --do commands without asking for confirmation',
+                    default=False)
+parser.add_argument('--copy', dest='copy', action='store_true',
+                    help='--do: copy all files of the configuration instead of linking unchanged files to the old configuration',
+                    default=False)
+parser.add_argument('-f', '--force', dest='force', action='store_true',
+                    help='convert all selected modules, also if their input data did not change since the last conversion',
+                    default=False)
+parser.add_argument('--prefetch', dest='prefetch', action='store_true',
+                    help='only download files for the selected modules (all if none selected) into the download cache',
+                    default=False)
+parser.add_argument('--snapshot', dest='snapshot',
+                    help='also write the converted data of all selected modules to this binary snapshot file, which can be used as data source later with -s snapshot:{file}',
+                    default='')
 parser.add_argument('-w', '--what', dest='what',
                     help='what parameters to extract, (comma separated): dac,iana,mask,tbm,trim',
                     default='dac,iana,mask,tbm,trim')
 args = parser.parse_args()
 
-# check given options, --do can not be used with -m at the same time
+# check given options
+if args.all or (args.prefetch and len(args.module.strip()) < 1):
+    args.module = 'all'
 if len(args.module.strip()) < 1 and len(args.do) < 1:
     print "no module specified. show help with -h"
     exit(0)
-elif len(args.do) > 0 and len(args.module) > 0:
-    print "running commands for certain modules only is not implemented yet, omit -m option to run it for all!"
-    exit(0)
 
 # **********************************************************************************************************************
 #  work with already existing files
@@ -142,6 +169,27 @@ if len(args.do) > 0:
     # commands are separated by ;
     runCommands = [x.strip().split(':') for x in args.do.split(';')]
 
+    # compile commands before anything is copied
+    try:
+        compiledCommands = pxar2POSCommands.compileCommands(args.do, inputFileNames)
+    except ValueError as e:
+        print "\x1b[31mERROR: %s\x1b[0m"%e
+        exit(1)
+
+    # with -m, only run commands on the files of the selected modules
+    positionStrings = None
+    if len(args.module.strip()) > 0 and args.module.strip().lower() != 'all':
+        modulePositionTable = ModulePositionProvider(dataPath=args.positions)
+        moduleIndex = dict([(moduleID, modulePosition) for moduleID, modulePosition in modulePositionTable.getModuleList()])
+        moduleIDList = pxar2POSBatch.resolveModuleSelection(modulePositionTable.getModuleList(), args.module)
+        positionStrings = []
+        for moduleID in moduleIDList:
+            # modules not in the table are written with the module ID instead of the position
+            positionStrings += posWriter.getModulePositionStrings(moduleID, moduleIndex[moduleID] if moduleID in moduleIndex else [moduleID])
+        if len(positionStrings) < 1:
+            print "\x1b[31mERROR: no modules selected!\x1b[0m"
+            exit(1)
+
     # ask user confirmation
     print '+%s+'%('-'*78)
     print '|%s|'%((' copy configuration ID %d -> %d ?'%(configurationID, newConfigurationID)).ljust(78))
@@ -149,9 +197,12 @@ if len(args.do) > 0:
     print '|%s|'%((' and run the following commands on config ID %d:'%newConfigurationID).ljust(78))
     for runCommand in runCommands:
         print '| %s|'%(('%r'%runCommand).ljust(77))
+    if positionStrings is not None:
+        print '|%s|'%(' '*78)
+        print '|%s|'%((' only for %d selected modules: %s'%(len(moduleIDList), args.module))[:78].ljust(78))
     print '|%s|'%(' '*78)
     print '+%s+'%('-'*78)
-    answer = raw_input('ENTER/y to continue, q to quit: ')
+    answer = 'y' if args.yes else raw_input('ENTER/y to continue, q to quit: ')
 
     if answer.lower() == 'y' or len(answer.strip()) < 1:
 
@@ -159,12 +210,16 @@ if len(args.do) > 0:
         posWriterOutput = POSWriter(outputPath=args.output, configurationID=newConfigurationID, createFoldersOnInitialization=False)
         outputFileNames = posWriterOutput.getOutputFileNames()
         print "copy configuration..."
+        filesPerMode = {}
         for dataType, dataSubfolder in inputFileNames.items():
             copyFrom = args.output + '/' + '/'.join(dataSubfolder.split('/')[:-1])
             copyTo = args.output + '/' + '/'.join(outputFileNames[dataType].split('/')[:-1])
             if args.verbose:
                 print "copy:", copyFrom, " --> ", copyTo
-            shutil.copytree(copyFrom, copyTo)
+            # files are shared with the old configuration until they are changed by a command
+            for mode, nFiles in pxar2POSCommands.linkConfigurationFolder(copyFrom, copyTo, forceCopy=args.copy).items():
+                filesPerMode[mode] = filesPerMode.get(mode, 0) + nFiles
+        print "  -> %s"%(', '.join(['%d files %s'%(nFiles, {'link': 'hardlinked', 'reflink': 'reflinked', 'copy': 'copied', 'symlink': 'symlinked'}[mode]) for mode, nFiles in sorted(filesPerMode.items())]))
         print "  -> done."
 
         # run commands
@@ -174,134 +229,7 @@ if len(args.do) > 0:
         #    dac:incr8bit:Vana:20
         #    dac:incr4bit:Vdd:1
         #    tbm:and:TBMADelay:128
-
-        # loop over list of commands separated by ';'
-        for runCommand in runCommands:
-            conditional = ''
-
-            # check if directory (first argument) exists
-            if runCommand[0] in outputFileNames:
-
-                # extract condition and instruction
-                if args.verbose:
-                    print "found! ", outputFileNames[runCommand[0]]
-                if '?' in runCommand[1]:
-                    conditional = runCommand[1].split('?')[0]
-                    instruction = runCommand[1].split('?')[1].lower()
-                else:
-                    instruction = runCommand[1].lower()
-
-                # loop over ALL files
-                datFileNamesMask = args.output + '/' + outputFileNames[runCommand[0]].format(Position='*')
-                datFileNames = glob.glob(datFileNamesMask)
-                for datFileName in datFileNames:
-                    conditionalMet = False
-                    if len(conditional) < 1:
-                        conditionalMet = True
-                    if args.verbose:
-                        print datFileName
-                    with open(datFileName, 'r') as datFile:
-                        datFileLines = datFile.readlines()
-
-                    # loop over all lines of the dat file
-                    changesMade = False
-                    for i in range(len(datFileLines)):
-                        if conditionalMet:
-                            try:
-                                valueString = datFileLines[i].split(':')[1]
-                                paddingSpaces = len(valueString) - len(valueString.lstrip())
-                                if paddingSpaces < 1:
-                                    paddingSpaces = 1
-                            except:
-                                paddingSpaces = 1
-
-                            lineParts = [x.strip() for x in datFileLines[i].split(':')]
-
-                            if instruction == 'set':
-                                if lineParts[0] == runCommand[2]:
-                                    lineParts[1] = runCommand[3].strip()
-                                    datFileLines[i] = '%s:%s%s\n'%(lineParts[0],' '*paddingSpaces, lineParts[1])
-
-                                    # reset condition and mark the file as changed
-                                    if len(conditional) > 0:
-                                        conditionalMet = False
-                                    changesMade = True
-                            # syntax: limit:dacname:[min,max]
-                            elif instruction == 'limit':
-                                if lineParts[0] == runCommand[2]:
-                                    value = int(lineParts[1])
-                                    limits = [int(x) for x in runCommand[3].replace('[','').replace(']','').replace('(','').replace(')','').split(',')]
-                                    # if only 1 argument given, take it as maximum
-                                    if len(limits) == 1:
-                                        limits = [0, limits[0]]
-                                    if value > limits[1]:
-                                        value = limits[1]
-                                    elif value < limits[0]:
-                                        value = limits[0]
-                                    lineParts[1] = '%d'%value
-                                    datFileLines[i] = '%s:%s%s\n'%(lineParts[0],' '*paddingSpaces, lineParts[1])
-                                    # reset condition and mark the file as changed
-                                    if len(conditional) > 0:
-                                        conditionalMet = False
-                                    changesMade = True
-                            elif instruction == 'and':
-                                if lineParts[0] == runCommand[2]:
-                                    lineParts[1] = '%d'%(int(lineParts[1]) & int(runCommand[3]))
-                                    datFileLines[i] = '%s:%s%s\n'%(lineParts[0],' '*paddingSpaces, lineParts[1])
-
-                                    # reset condition and mark the file as changed
-                                    if len(conditional) > 0:
-                                        conditionalMet = False
-                                    changesMade = True
-                            elif instruction == 'or':
-                                if lineParts[0] == runCommand[2]:
-                                    lineParts[1] = '%d'%(int(lineParts[1]) | int(runCommand[3]))
-                                    datFileLines[i] = '%s:%s%s\n'%(lineParts[0],' '*paddingSpaces, lineParts[1])
-
-                                    # reset condition and mark the file as changed
-                                    if len(conditional) > 0:
-                                        conditionalMet = False
-                                    changesMade = True
-                            elif instruction.startswith('incr') and (instruction.endswith('bit') or instruction.endswith('bits')):
-                                nBits = int(instruction.replace('bits','').replace('bit','').replace('incr',''))
-                                if nBits < 1:
-                                    print "\x1b[31mERROR: incr#bit operator needs # >= 1! defaulting to 8 bit!\x1b[0m"
-                                    nBits = 8
-
-                                if lineParts[0] == runCommand[2]:
-                                    value = int(lineParts[1]) + int(runCommand[3])
-                                    if value > (2**nBits)-1:
-                                        value = (2**nBits)-1
-                                    elif value < 0:
-                                        value = 0
-                                    lineParts[1] = '%d'%(value)
-                                    datFileLines[i] = '%s:%s%s\n'%(lineParts[0],' '*paddingSpaces, lineParts[1])
-
-                                    # reset condition and mark the file as changed
-                                    if len(conditional) > 0:
-                                        conditionalMet = False
-                                    changesMade = True
-
-                        else:
-                            # check if condition is fulfilled
-                            if fnmatch.fnmatch(datFileLines[i].strip(), conditional):
-                                if args.verbose:
-                                    print "    -> condition met:", datFileLines[i], conditional
-                                conditionalMet = True
-
-                    # write file back, if changes were made
-                    if changesMade:
-                        if args.verbose:
-                            print "update file: '\x1b[34m{datFileName}\x1b[0m'".format(datFileName=datFileName)
-                        with open(datFileName, 'w') as datFile:
-                            datFile.writelines(datFileLines)
-
-            elif runCommand[0] == 'exit':
-                break
-            else:
-                print "\x1b[31mERROR: command type not found:",runCommand[0],"\x1b[0m"
-
-        print "  -> done."
+        pxar2POSCommands.runCommands(args.output, outputFileNames, compiledCommands, jobs=args.jobs, verbose=args.verbose, positionStrings=positionStrings)
 
         print " -> done."
 
@@ -312,51 +240,134 @@ if len(args.do) > 0:
 #  obtain data from DB
 # **********************************************************************************************************************
 else:
+    # matrix of configurations, replaces -i, -t and -T
+    matrixTargets = []
+    if len(args.matrix.strip()) > 0:
+        try:
+            matrixTargets = pxar2POSBatch.parseConfigurationMatrix(args.matrix)
+        except ValueError as e:
+            print "\x1b[31mERROR: %s\x1b[0m"%e
+            exit(1)
+    if len(args.snapshot.strip()) > 0 and len(matrixTargets) > 0:
+        print "\x1b[31mERROR: --snapshot can't be used with --matrix, a snapshot holds one configuration\x1b[0m"
+        exit(1)
+
+    # values from a snapshot are final, the temperature and trim value of the snapshot are used
+    fromSnapshot = args.source.startswith('snapshot:')
+
     # show summary of parameters
-    if args.configuration_id < 0:
+    if len(matrixTargets) > 0:
+        for configurationID, temperature, trimValue in matrixTargets:
+            print "  -> configuration ID %d: temperature %s, trim %s"%(configurationID, temperature, trimValue)
+    elif args.configuration_id < 0:
         print "  -> NO configuration id specified (with -i), saving all files directly into the output folder"
     else:
         print "  -> configuration ID: ", args.configuration_id
     print "  -> module:", args.module
-    print "  -> trim:", args.trim
-    print "  -> temperature:", args.temp
+    if len(matrixTargets) < 1 and not fromSnapshot:
+        print "  -> trim:", args.trim
+        print "  -> temperature:", args.temp
     print "  -> module positions from:", args.positions
     print "  -> module data from:", args.source
     print "  -> save data in:", args.output
+    print "  -> parallel jobs:", args.jobs
+    if len(args.snapshot.strip()) > 0:
+        print "  -> write snapshot to:", args.snapshot
     if args.verbose:
         print "    -> verbose output is turned ON"
 
     # initialize converter
+    #   this also resolves the DB credentials before any worker processes are started
     print "initialize converter..."
-    converter = pxar2POSConverter(
-        options={
-            'ModulePositionTable': args.positions,
-            'DataSource': args.source,
-            'OutputPath': args.output,
-            'Verbose': args.verbose,
-            'ConfigurationID': args.configuration_id,
-            'ExtractParameters': args.what,
-        }
-    )
+    converterOptions = {
+        'ModulePositionTable': args.positions,
+        'DataSource': args.source,
+        'OutputPath': args.output,
+        'Verbose': args.verbose,
+        'ConfigurationID': args.configuration_id,
+        'ExtractParameters': args.what,
+        # the snapshot needs the data of all modules, also of the ones which did not change
+        'Force': args.force or len(args.snapshot.strip()) > 0,
+        'Snapshot': len(args.snapshot.strip()) > 0,
+        'DownloadThreads': config.get('Global', 'DownloadThreads'),
+        'FetchThreads': config.get('Global', 'FetchThreads'),
+        'SqlConnections': config.get('Global', 'SqlConnections'),
+        'WriteThreads': config.get('Global', 'WriteThreads'),
+        'DownloadCache': config.get('Paths', 'DownloadCache'),
+        'LocalDataIndex': config.get('Paths', 'LocalDataIndex'),
+        'DownloadCacheSize': config.get('Global', 'DownloadCacheSize'),
+        'DownloadCacheRevalidate': config.get('Global', 'DownloadCacheRevalidate'),
+    }
+    if len(matrixTargets) > 0:
+        converterOptions['ConfigurationID'] = matrixTargets[0][0]
+    converter = pxar2POSConverter(options=converterOptions)
 
     # select which Fulltest of FullQualification to use
-    testOptions = {'Test': '*ulltest*_' + args.temp, 'tempnominal': args.temp, 'TrimValue': args.trim, 'Transformations': {}}
-
-    # additional transformations of values
-    if config.has_section('DACs'):
-        testOptions['Transformations']['DACs'] = {}
-        for dac, value in config.items('DACs'):
-            testOptions['Transformations']['DACs'][dac] = value
+    def getTestOptions(temperature, trimValue):
+        # no interpolation or transformations of the values stored in a snapshot
+        if fromSnapshot:
+            return {'Transformations': {}}
+        testOptions = {'Test': '*ulltest*_' + temperature, 'tempnominal': temperature, 'TrimValue': trimValue, 'Transformations': {}}
+
+        # additional transformations of values
+        if config.has_section('DACs'):
+            testOptions['Transformations']['DACs'] = {}
+            for dac, value in config.items('DACs'):
+                try:
+                    testOptions['Transformations']['DACs'][dac] = parseInteger(value.strip())
+                except ValueError:
+                    print "\x1b[31mERROR: invalid value %r for %s in [DACs] section of configuration, expected an integer!\x1b[0m"%(value, dac)
+                    exit(1)
+        return testOptions
+
+    testOptions = getTestOptions(args.temp, args.trim)
+    matrixTargets = [(configurationID, getTestOptions(temperature, trimValue)) for configurationID, temperature, trimValue in matrixTargets]
 
 
     # convert files
-    moduleIDList = args.module.replace(';',',').split(',')
-    moduleIDListLength = len(moduleIDList)
-    moduleIDListPosition = 1
-    for moduleID in moduleIDList:
-        print '*'*40
-        print '  %s (%d/%d):'%(moduleID, moduleIDListPosition, moduleIDListLength)
-        print '*'*40
-        converter.convertModuleData(moduleID=moduleID, testOptions=testOptions)
-        moduleIDListPosition += 1
+    moduleIDList = pxar2POSBatch.resolveModuleSelection(converter.modulePositionTable.getModuleList(), args.module)
+    print "  -> %d modules selected"%len(moduleIDList)
+
+    # only fill download cache
+    if args.prefetch:
+        print "prefetch files..."
+        for prefetchTestOptions in [x[1] for x in matrixTargets] if len(matrixTargets) > 0 else [testOptions]:
+            converter.prefetchModuleData(moduleIDList, prefetchTestOptions)
+            converter.prefetchModuleFiles(moduleIDList, prefetchTestOptions)
+        print " -> done."
+        exit(0)
 
+    # write all configurations of the matrix from one data fetch
+    if len(matrixTargets) > 0:
+        results = pxar2POSBatch.convertModuleMatrix(
+            converterOptions=converterOptions,
+            moduleIDs=moduleIDList,
+            targets=matrixTargets,
+            jobs=args.jobs,
+            converter=converter,
+        )
+        for configurationID, statuses in results:
+            print "configuration ID %d:"%configurationID
+            pxar2POSBatch.printSummary(statuses)
+        exit(0 if all([x.isGood() for configurationID, statuses in results for x in statuses]) else 1)
+
+    statuses = pxar2POSBatch.convertModules(
+        converterOptions=converterOptions,
+        moduleIDs=moduleIDList,
+        testOptions=testOptions,
+        jobs=args.jobs,
+        converter=converter,
+    )
+    snapshotWritten = True
+    if len(args.snapshot.strip()) > 0:
+        snapshotWritten = pxar2POSBatch.writeSnapshot(args.snapshot, statuses, info={
+            'source': args.source,
+            'configurationID': args.configuration_id,
+            'tempnominal': testOptions['tempnominal'] if 'tempnominal' in testOptions else None,
+            'TrimValue': testOptions['TrimValue'] if 'TrimValue' in testOptions else None,
+        })
+    allGood = all([x.isGood() for x in statuses])
+    if len(statuses) > 1 or not allGood:
+        pxar2POSBatch.printSummary(statuses)
+    if not snapshotWritten or not allGood:
+        exit(1)
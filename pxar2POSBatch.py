@@ -0,0 +1,299 @@
+from pxar2POSConverter import pxar2POSConverter, ModuleConversionStatus, ConversionManifest
+from CalibrationDataProvider.DataCache import DataCache
+from CalibrationDataProvider import CalibrationSnapshot
+from POSWriter.POSWriter import POSWriter
+import multiprocessing
+import traceback
+import fnmatch
+import os
+import re
+
+# ----------------------------------------------------------------------------------------------------------------------
+#  batch conversion of many modules within one process tree
+# ----------------------------------------------------------------------------------------------------------------------
+#  module selection syntax (comma separated list of entries):
+#    M1234            single module ID
+#    all              all modules in the module position table
+#    LYR3             all modules whose position contains LYR3
+#    BmO:SEC1-4       all modules in BmO, sectors 1 to 4 (all terms separated by ':' have to match)
+#    LDR1             ladder 1, regardless of F/H suffix
+#    LDR1*H           wildcards are allowed for terms without number ranges
+#    *_LYR4_LDR1?_*   entries with '_' are matched against the whole position string, e.g. BPix_BmO_SEC1_LYR2_LDR1H_MOD4
+# ----------------------------------------------------------------------------------------------------------------------
+
+moduleIDPattern = re.compile(r'^M\d{4}$')
+selectorRangePattern = re.compile(r'^([A-Za-z]+)(\d+)(?:-(\d+))?$')
+positionPartPattern = re.compile(r'^([A-Za-z]+)(\d+)([A-Za-z]*)$')
+
+# converter of the worker process, initialized once per worker
+workerConverter = None
+
+# matrix runs: one converter per configuration of the worker process, all reading from the same data cache
+workerMatrixConverters = []
+workerMatrixTargets = []
+workerDataCache = None
+
+
+def matchSelectorTerm(term, modulePosition):
+    rangeMatch = selectorRangePattern.match(term)
+    for positionPart in modulePosition:
+        if rangeMatch:
+            rangeLow = int(rangeMatch.group(2))
+            rangeHigh = int(rangeMatch.group(3)) if rangeMatch.group(3) else rangeLow
+            partMatch = positionPartPattern.match(positionPart)
+            if partMatch and partMatch.group(1).upper() == rangeMatch.group(1).upper() and rangeLow <= int(partMatch.group(2)) <= rangeHigh:
+                return True
+        elif fnmatch.fnmatch(positionPart.upper(), term.upper()):
+            return True
+    return False
+
+
+def matchSelector(selector, modulePosition):
+    terms = [x.strip() for x in selector.split(':') if len(x.strip()) > 0]
+    return len(terms) > 0 and all(matchSelectorTerm(term, modulePosition) for term in terms)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# returns list of module IDs for a selection string, e.g. 'M1234,M2345' or 'LYR3' or 'BmO:SEC1-4' or 'all'
+#   moduleList: list of [moduleID, modulePosition] from the module position provider
+# ----------------------------------------------------------------------------------------------------------------------
+def resolveModuleSelection(moduleList, selection):
+    moduleIDs = []
+    for entry in [x.strip() for x in selection.replace(';', ',').split(',') if len(x.strip()) > 0]:
+        if moduleIDPattern.match(entry):
+            selectedModuleIDs = [entry]
+        elif entry.lower() == 'all':
+            selectedModuleIDs = [moduleID for moduleID, modulePosition in moduleList]
+        elif '_' in entry:
+            selectedModuleIDs = [moduleID for moduleID, modulePosition in moduleList if fnmatch.fnmatch('_'.join(modulePosition).upper(), entry.upper())]
+            if len(selectedModuleIDs) < 1:
+                print "\x1b[31mWARNING: no modules found for selection '%s'\x1b[0m"%entry
+        else:
+            selectedModuleIDs = [moduleID for moduleID, modulePosition in moduleList if matchSelector(entry, modulePosition)]
+            if len(selectedModuleIDs) < 1:
+                print "\x1b[31mWARNING: no modules found for selection '%s'\x1b[0m"%entry
+
+        for moduleID in selectedModuleIDs:
+            if moduleID not in moduleIDs:
+                moduleIDs.append(moduleID)
+
+    return moduleIDs
+
+
+def initializeWorker(converterOptions):
+    global workerConverter
+    workerConverter = pxar2POSConverter(options=converterOptions)
+
+
+def convertModule(converter, moduleID, testOptions):
+    try:
+        return converter.convertModuleData(moduleID=moduleID, testOptions=testOptions)
+    except Exception as e:
+        status = ModuleConversionStatus(moduleID=moduleID)
+        status.errors.append("conversion failed: %r"%e)
+        status.outputFiles = converter.posWriter.takeQueuedFiles()
+        converter.printError("conversion of module %s failed"%moduleID, traceback.format_exc())
+        return status
+
+
+def convertModuleWorker(task):
+    moduleID, testOptions, taskNumber, nTasks = task
+    print '*'*40
+    print '  %s (%d/%d):'%(moduleID, taskNumber, nTasks)
+    print '*'*40
+    return convertModule(workerConverter, moduleID, testOptions)
+
+
+# prefetch data for all modules of the chunk at once, then convert them one by one
+# files are written in the background while the next module is converted, write errors are added at the end of the chunk
+def convertModuleChunkWorker(tasks):
+    workerConverter.prefetchModuleData([task[0] for task in tasks], tasks[0][1])
+    statuses = [convertModuleWorker(task) for task in tasks]
+    workerConverter.finishOutput(statuses, sync=False)
+    return statuses
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# converts all modules and returns list of ModuleConversionStatus objects, in the same order as moduleIDs
+#   jobs > 1: modules are distributed over a pool of worker processes, each with its own converter/data source
+#   converter: already initialized converter to use for jobs <= 1 (otherwise a new one is created)
+#   chunkSize: number of modules for which the data is prefetched at once
+# ----------------------------------------------------------------------------------------------------------------------
+def convertModules(converterOptions, moduleIDs, testOptions, jobs = 1, converter = None, chunkSize = 50):
+    global workerConverter
+    tasks = [(moduleID, testOptions, i, len(moduleIDs)) for i, moduleID in enumerate(moduleIDs, start=1)]
+
+    if jobs <= 1 or len(moduleIDs) < 2:
+        workerConverter = converter if converter else pxar2POSConverter(options=converterOptions)
+        chunks = [tasks[i:i+chunkSize] for i in range(0, len(tasks), chunkSize)]
+        statuses = [status for chunk in chunks for status in convertModuleChunkWorker(chunk)]
+        syncOutputFiles(statuses)
+        updateManifest(converterOptions, statuses)
+        return statuses
+
+    # smaller chunks for parallel jobs, to keep all workers busy until the end
+    chunkSize = max(1, min(chunkSize, len(tasks) // (4 * jobs)))
+    chunks = [tasks[i:i+chunkSize] for i in range(0, len(tasks), chunkSize)]
+
+    print "convert %d modules with %d parallel jobs..."%(len(moduleIDs), jobs)
+    pool = multiprocessing.Pool(processes=jobs, initializer=initializeWorker, initargs=(converterOptions,))
+    try:
+        statuses = [status for chunkStatuses in pool.imap(convertModuleChunkWorker, chunks) for status in chunkStatuses]
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    syncOutputFiles(statuses)
+    updateManifest(converterOptions, statuses)
+    return statuses
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# matrix of configurations, e.g. 'm20:35=2,p17_1:35=3,p8:35=4,m20:-1=5'
+#   comma separated list of {temperature}:{trim value}={configuration ID}
+# returns list of (configuration ID, temperature, trim value)
+# ----------------------------------------------------------------------------------------------------------------------
+def parseConfigurationMatrix(matrix):
+    targets = []
+    for entry in [x.strip() for x in matrix.replace(';', ',').split(',') if len(x.strip()) > 0]:
+        try:
+            temperatureTrim, configurationID = entry.split('=')
+            temperature, trimValue = temperatureTrim.split(':')
+            targets.append((int(configurationID), temperature.strip(), '%d'%int(trimValue)))
+        except ValueError:
+            raise ValueError("invalid matrix entry '%s', format: {temperature}:{trim value}={configuration ID}"%entry)
+    configurationIDs = [x[0] for x in targets]
+    for configurationID in configurationIDs:
+        if configurationIDs.count(configurationID) > 1:
+            raise ValueError("configuration ID %d is used more than once"%configurationID)
+        if configurationID < 0:
+            raise ValueError("invalid configuration ID %d"%configurationID)
+    if len(targets) < 1:
+        raise ValueError("no configurations given")
+    return targets
+
+
+def getMatrixConverterOptions(converterOptions, configurationID):
+    matrixConverterOptions = dict(converterOptions)
+    matrixConverterOptions['ConfigurationID'] = configurationID
+    return matrixConverterOptions
+
+
+#   converter: already initialized converter, its data source is shared by all configurations
+def initializeMatrixWorker(converterOptions, targets, converter = None):
+    global workerMatrixConverters, workerMatrixTargets, workerDataCache
+    if converter is None:
+        converter = pxar2POSConverter(options=getMatrixConverterOptions(converterOptions, targets[0][0]))
+    workerDataCache = DataCache(converter.dataSource)
+    workerMatrixConverters = [pxar2POSConverter(options=getMatrixConverterOptions(converterOptions, configurationID), dataSource=workerDataCache) for configurationID, testOptions in targets]
+    workerMatrixTargets = targets
+
+
+# prefetch data for all modules of the chunk and all configurations, then convert each module for all configurations
+# before the data of the next one is read. returns list of statuses for each configuration
+def convertMatrixChunkWorker(tasks):
+    moduleIDs = [task[0] for task in tasks]
+    for converter, (configurationID, testOptions) in zip(workerMatrixConverters, workerMatrixTargets):
+        converter.prefetchModuleData(moduleIDs, testOptions)
+
+    statuses = [[] for target in workerMatrixTargets]
+    for moduleID, taskNumber, nTasks in tasks:
+        print '*'*40
+        print '  %s (%d/%d):'%(moduleID, taskNumber, nTasks)
+        print '*'*40
+        for i, (converter, (configurationID, testOptions)) in enumerate(zip(workerMatrixConverters, workerMatrixTargets)):
+            print "configuration ID %d (%s, trim %s):"%(configurationID, testOptions['tempnominal'], testOptions['TrimValue'])
+            statuses[i].append(convertModule(converter, moduleID, testOptions))
+        workerDataCache.clear([moduleID])
+    workerDataCache.clear()
+
+    for converter, targetStatuses in zip(workerMatrixConverters, statuses):
+        converter.finishOutput(targetStatuses, sync=False)
+    print "  -> %d inputs read, %d shared between configurations"%(workerDataCache.nFetched, workerDataCache.nShared)
+    return statuses
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# converts all modules for several configurations at once, e.g. for a matrix of temperatures and trim values. Each
+# input (DB rows, trimbit/TBM/readback files, local files) is read once for all configurations, also the -20/+17 data
+# needed for temperature interpolation. Modules are converted one after the other for all configurations, so only the
+# data of the current chunk of modules is kept in memory.
+#   targets: list of (configuration ID, testOptions)
+# returns list of (configuration ID, list of ModuleConversionStatus objects)
+# ----------------------------------------------------------------------------------------------------------------------
+def convertModuleMatrix(converterOptions, moduleIDs, targets, jobs = 1, converter = None, chunkSize = 50):
+    tasks = [(moduleID, i, len(moduleIDs)) for i, moduleID in enumerate(moduleIDs, start=1)]
+
+    if jobs <= 1 or len(moduleIDs) < 2:
+        initializeMatrixWorker(converterOptions, targets, converter)
+        chunks = [tasks[i:i+chunkSize] for i in range(0, len(tasks), chunkSize)]
+        chunkStatusesList = [convertMatrixChunkWorker(chunk) for chunk in chunks]
+    else:
+        chunkSize = max(1, min(chunkSize, len(tasks) // (4 * jobs)))
+        chunks = [tasks[i:i+chunkSize] for i in range(0, len(tasks), chunkSize)]
+
+        print "convert %d modules for %d configurations with %d parallel jobs..."%(len(moduleIDs), len(targets), jobs)
+        pool = multiprocessing.Pool(processes=jobs, initializer=initializeMatrixWorker, initargs=(converterOptions, targets))
+        try:
+            chunkStatusesList = list(pool.imap(convertMatrixChunkWorker, chunks))
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    results = []
+    for i, (configurationID, testOptions) in enumerate(targets):
+        statuses = [status for chunkStatuses in chunkStatusesList for status in chunkStatuses[i]]
+        syncOutputFiles(statuses)
+        updateManifest(getMatrixConverterOptions(converterOptions, configurationID), statuses)
+        results.append((configurationID, statuses))
+    return results
+
+
+# store the input fingerprints of the converted modules in the manifest of the configuration, after the files are on disk
+def updateManifest(converterOptions, statuses):
+    manifest = ConversionManifest(converterOptions['OutputPath'], converterOptions['ConfigurationID'] if 'ConfigurationID' in converterOptions else -1)
+    try:
+        manifest.update(statuses)
+    except Exception as e:
+        print "\x1b[31mERROR: could not write manifest %s: %r\x1b[0m"%(manifest.fileName, e)
+
+
+# one fsync barrier for all files of the configuration, after all modules are written
+def syncOutputFiles(statuses):
+    POSWriter.syncFiles([outputFileName for status in statuses for outputFileName in status.outputFiles])
+
+
+# writes the data of the converted modules to a snapshot file, the converter needs option Snapshot
+#   info: stored in the header of the snapshot, e.g. data source, temperature and trim value
+# modules with errors (also write errors of the POS files) are left out and listed in the header as 'excludedModules'
+# returns False if the snapshot could not be written
+def writeSnapshot(fileName, statuses, info = {}):
+    modules = [(status.moduleID, status.modulePosition, status.snapshotData) for status in statuses if status.isGood() and status.snapshotData]
+    excludedModuleIDs = [status.moduleID for status in statuses if not status.isGood() or not status.snapshotData]
+    info = dict(info)
+    info['excludedModules'] = excludedModuleIDs
+    try:
+        nModules = CalibrationSnapshot.writeSnapshot(fileName, modules, info)
+    except Exception as e:
+        print "\x1b[31mERROR: could not write snapshot %s: %r\x1b[0m"%(fileName, e)
+        return False
+    print "  -> snapshot of %d modules written to %s (%1.1f MB)"%(nModules, fileName, os.path.getsize(fileName) / 1048576.0)
+    if len(excludedModuleIDs) > 0:
+        print "\x1b[31mWARNING: %d modules with errors are not in the snapshot: %s\x1b[0m"%(len(excludedModuleIDs), ', '.join(excludedModuleIDs))
+    return True
+
+
+def printSummary(statuses):
+    failedStatuses = [x for x in statuses if not x.isGood()]
+    skippedStatuses = [x for x in statuses if x.isSkipped()]
+    print '+%s+'%('-'*78)
+    print '|%s|'%((' %d modules converted, %d with errors, %d up to date'%(len(statuses) - len(skippedStatuses), len(failedStatuses), len(skippedStatuses))).ljust(78))
+    for status in failedStatuses:
+        print '| %s|'%(('%s %s: %s'%(status.moduleID, status.getPositionString(), ', '.join(status.errors)))[:77].ljust(77))
+    print '+%s+'%('-'*78)
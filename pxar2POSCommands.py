@@ -0,0 +1,311 @@
+import multiprocessing
+import traceback
+import tempfile
+import fnmatch
+import shutil
+import errno
+import glob
+import os
+import re
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ----------------------------------------------------------------------------------------------------------------------
+#  engine for the --do commands, which change values in already existing POS configuration files
+# ----------------------------------------------------------------------------------------------------------------------
+#  command format: {subfolder}:[{condition}?]{operator}:{key}:{value};...
+#  the list of commands is compiled once (condition patterns, operator functions), then every file of a subfolder is
+#  read once, all commands for this subfolder are applied in the given order and the file is written only if changed.
+#  the result is the same as running the commands one after the other over all files.
+#
+#  new configuration IDs are created copy-on-write: every file is hardlinked (or reflinked) from the parent
+#  configuration, and a file which is changed by a command is written to a temporary file and renamed, which replaces
+#  the link by a private copy. files which are not changed stay shared with the parent configuration.
+# ----------------------------------------------------------------------------------------------------------------------
+
+# ioctl to clone a file on Linux filesystems with reflink support (btrfs, xfs), from linux/fs.h
+FICLONE = 0x40049409
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#  operators: (old value string, operand) -> new value string
+# ----------------------------------------------------------------------------------------------------------------------
+def operationSet(value, operand):
+    return operand
+
+
+def operationLimit(value, operand):
+    return '%d'%min(max(int(value), operand[0]), operand[1])
+
+
+def operationAnd(value, operand):
+    return '%d'%(int(value) & operand)
+
+
+def operationOr(value, operand):
+    return '%d'%(int(value) | operand)
+
+
+def operationIncrement(value, operand):
+    nBits, increment = operand
+    return '%d'%min(max(int(value) + increment, 0), (2**nBits)-1)
+
+
+class CompiledCommand(object):
+    __slots__ = ('subfolder', 'condition', 'conditionPattern', 'operator', 'operation', 'key', 'operand')
+
+    def __init__(self, subfolder, condition, operator, operation, key, operand):
+        self.subfolder = subfolder
+        self.condition = condition
+        self.conditionPattern = re.compile(fnmatch.translate(os.path.normcase(condition))) if len(condition) > 0 else None
+        self.operator = operator
+        self.operation = operation
+        self.key = key
+        self.operand = operand
+
+    def __repr__(self):
+        return "<CompiledCommand %s:%s%s:%s:%r>"%(self.subfolder, self.condition + '?' if self.condition else '', self.operator, self.key, self.operand)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# compiles the command string and returns the list of CompiledCommand objects, in the order of the commands
+#   raises ValueError for commands which can't be run. commands after 'exit' are ignored
+# ----------------------------------------------------------------------------------------------------------------------
+def compileCommands(commandString, outputFileNames):
+    compiledCommands = []
+    for runCommand in [x.strip().split(':') for x in commandString.split(';')]:
+        if runCommand[0] == 'exit':
+            break
+        if runCommand[0] not in outputFileNames:
+            raise ValueError("command type not found: %s"%runCommand[0])
+        if len(runCommand) < 4:
+            raise ValueError("command needs {subfolder}:[{condition}?]{operator}:{key}:{value}: %s"%':'.join(runCommand))
+
+        if '?' in runCommand[1]:
+            condition = runCommand[1].split('?')[0]
+            operator = runCommand[1].split('?')[1].lower()
+        else:
+            condition = ''
+            operator = runCommand[1].lower()
+
+        try:
+            if operator == 'set':
+                operation = operationSet
+                operand = runCommand[3].strip()
+            # syntax: limit:dacname:[min,max]
+            elif operator == 'limit':
+                operation = operationLimit
+                operand = [int(x) for x in runCommand[3].replace('[','').replace(']','').replace('(','').replace(')','').split(',')]
+                # if only 1 argument given, take it as maximum
+                if len(operand) == 1:
+                    operand = [0, operand[0]]
+            elif operator == 'and':
+                operation = operationAnd
+                operand = int(runCommand[3])
+            elif operator == 'or':
+                operation = operationOr
+                operand = int(runCommand[3])
+            elif operator.startswith('incr') and (operator.endswith('bit') or operator.endswith('bits')):
+                nBits = int(operator.replace('bits','').replace('bit','').replace('incr',''))
+                if nBits < 1:
+                    print "\x1b[31mERROR: incr#bit operator needs # >= 1! defaulting to 8 bit!\x1b[0m"
+                    nBits = 8
+                operation = operationIncrement
+                operand = [nBits, int(runCommand[3])]
+            else:
+                raise ValueError("operator not found: %s"%operator)
+        except ValueError as e:
+            raise ValueError("invalid command %s: %s"%(':'.join(runCommand), e))
+
+        compiledCommands.append(CompiledCommand(runCommand[0], condition, operator, operation, runCommand[2], operand))
+    return compiledCommands
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# applies the commands to the lines of a file (in place), returns True if lines were changed
+# ----------------------------------------------------------------------------------------------------------------------
+#  without condition, every line with the key is changed. with condition, only the first line with the key after each
+#  line matching the condition is changed
+# ----------------------------------------------------------------------------------------------------------------------
+def applyCommands(lines, compiledCommands, verbose = False):
+    # keys of all lines, computed only once for all commands
+    lineKeys = [line.split(':')[0].strip() for line in lines]
+
+    changesMade = False
+    for command in compiledCommands:
+        conditionMet = command.conditionPattern is None
+        for i in range(len(lines)):
+            if conditionMet:
+                if lineKeys[i] == command.key:
+                    try:
+                        valueString = lines[i].split(':')[1]
+                        paddingSpaces = max(len(valueString) - len(valueString.lstrip()), 1)
+                    except:
+                        paddingSpaces = 1
+                    newValue = command.operation(lines[i].split(':')[1].strip(), command.operand)
+                    lines[i] = '%s:%s%s\n'%(command.key, ' '*paddingSpaces, newValue)
+
+                    # reset condition and mark the file as changed
+                    if command.conditionPattern is not None:
+                        conditionMet = False
+                    changesMade = True
+            elif command.conditionPattern.match(os.path.normcase(lines[i].strip())):
+                # check if condition is fulfilled
+                if verbose:
+                    print "    -> condition met:", lines[i], command.condition
+                conditionMet = True
+
+    return changesMade
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# creates a shallow copy of a single file, tries the given modes in order: 'link', 'reflink', 'copy'
+#   returns the mode which worked
+# ----------------------------------------------------------------------------------------------------------------------
+def linkFile(sourceFileName, targetFileName, modes):
+    for mode in modes:
+        try:
+            if mode == 'link':
+                os.link(sourceFileName, targetFileName)
+            elif mode == 'reflink':
+                if fcntl is None:
+                    continue
+                with open(sourceFileName, 'rb') as sourceFile:
+                    with open(targetFileName, 'wb') as targetFile:
+                        fcntl.ioctl(targetFile.fileno(), FICLONE, sourceFile.fileno())
+                shutil.copystat(sourceFileName, targetFileName)
+            else:
+                shutil.copy2(sourceFileName, targetFileName)
+            return mode
+        except (OSError, IOError, AttributeError) as e:
+            # target exists: don't overwrite anything
+            if getattr(e, 'errno', None) == errno.EEXIST:
+                raise
+            if mode == 'reflink' and os.path.isfile(targetFileName):
+                os.remove(targetFileName)
+            if mode == 'copy':
+                raise
+    raise OSError("no copy mode left for file %s"%sourceFileName)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# creates a copy-on-write copy of a configuration folder, replacement for shutil.copytree
+#   the target folder must not exist. each file is hardlinked, or reflinked if the filesystem does not support hard
+#   links (or the folders are on different devices), or copied as last resort. once a mode fails, it is not tried again
+#   for the other files of the folder. with forceCopy=True all files are copied.
+#   returns dict {mode: number of files}
+# ----------------------------------------------------------------------------------------------------------------------
+def linkConfigurationFolder(copyFrom, copyTo, forceCopy = False):
+    modes = ['copy'] if forceCopy else ['link', 'reflink', 'copy']
+    filesPerMode = {}
+    os.makedirs(copyTo)
+    shutil.copystat(copyFrom, copyTo)
+    for fileName in sorted(os.listdir(copyFrom)):
+        sourceFileName = os.path.join(copyFrom, fileName)
+        targetFileName = os.path.join(copyTo, fileName)
+        if os.path.isdir(sourceFileName) and not os.path.islink(sourceFileName):
+            for mode, nFiles in linkConfigurationFolder(sourceFileName, targetFileName, forceCopy).items():
+                filesPerMode[mode] = filesPerMode.get(mode, 0) + nFiles
+        elif os.path.islink(sourceFileName):
+            os.symlink(os.readlink(sourceFileName), targetFileName)
+            filesPerMode['symlink'] = filesPerMode.get('symlink', 0) + 1
+        else:
+            mode = linkFile(sourceFileName, targetFileName, modes)
+            modes = modes[modes.index(mode):]
+            filesPerMode[mode] = filesPerMode.get(mode, 0) + 1
+    return filesPerMode
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# writes the lines to a temporary file in the same folder and renames it to the file name
+#   this never writes through a hard link: a file shared with the parent configuration becomes a private copy
+# ----------------------------------------------------------------------------------------------------------------------
+def writeFilePrivate(fileName, lines):
+    folder, baseName = os.path.split(fileName)
+    temporaryFile, temporaryFileName = tempfile.mkstemp(dir=folder if folder else '.', prefix='.' + baseName + '.', suffix='.tmp')
+    try:
+        with os.fdopen(temporaryFile, 'w') as outputFile:
+            outputFile.writelines(lines)
+        shutil.copymode(fileName, temporaryFileName)
+        if os.name == 'nt':
+            # rename does not replace existing files on Windows
+            os.remove(fileName)
+        os.rename(temporaryFileName, fileName)
+    except:
+        try:
+            os.remove(temporaryFileName)
+        except OSError:
+            pass
+        raise
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# reads the file once, applies all commands and writes it back if something changed
+#   task: (file name, list of CompiledCommand, verbose), returns (file name, changed, error message or None)
+# ----------------------------------------------------------------------------------------------------------------------
+def runCommandsOnFile(task):
+    datFileName, compiledCommands, verbose = task
+    try:
+        if verbose:
+            print datFileName
+        with open(datFileName, 'r') as datFile:
+            datFileLines = datFile.readlines()
+
+        changesMade = applyCommands(datFileLines, compiledCommands, verbose)
+
+        # write file back, if changes were made
+        if changesMade:
+            if verbose:
+                print "update file: '\x1b[34m{datFileName}\x1b[0m'".format(datFileName=datFileName)
+            writeFilePrivate(datFileName, datFileLines)
+        return datFileName, changesMade, None
+    except Exception as e:
+        return datFileName, False, "%r\n%s"%(e, traceback.format_exc())
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# runs the compiled commands on all files of the configuration, with a pool of worker processes for jobs > 1
+#   outputFileNames: file name patterns per subfolder, from POSWriter.getOutputFileNames() of the configuration
+#   positionStrings: only run on the files for these positions (e.g. from POSWriter.getModulePositionStrings()),
+#                    without listing the folders. None: all files
+#   returns list of (file name, changed, error message or None)
+# ----------------------------------------------------------------------------------------------------------------------
+def runCommands(outputPath, outputFileNames, compiledCommands, jobs = 1, verbose = False, positionStrings = None):
+    tasks = []
+    subfolders = []
+    for command in compiledCommands:
+        if command.subfolder not in subfolders:
+            subfolders.append(command.subfolder)
+    for subfolder in subfolders:
+        subfolderCommands = [command for command in compiledCommands if command.subfolder == subfolder]
+        if positionStrings is None:
+            datFileNames = sorted(glob.glob(outputPath + '/' + outputFileNames[subfolder].format(Position='*')))
+        else:
+            datFileNames = [outputPath + '/' + outputFileNames[subfolder].format(Position=x) for x in positionStrings]
+            for datFileName in [x for x in datFileNames if not os.path.isfile(x)]:
+                print "\x1b[31mWARNING: file not found: %s\x1b[0m"%datFileName
+            datFileNames = [x for x in datFileNames if os.path.isfile(x)]
+        print "  -> %s: %d commands on %d files"%(subfolder, len(subfolderCommands), len(datFileNames))
+        tasks += [(datFileName, subfolderCommands, verbose) for datFileName in datFileNames]
+
+    if jobs <= 1 or len(tasks) < 2:
+        results = [runCommandsOnFile(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(processes=jobs)
+        try:
+            results = pool.map(runCommandsOnFile, tasks, chunksize=max(1, len(tasks) // (4 * jobs)))
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    for datFileName, changesMade, errorMessage in results:
+        if errorMessage:
+            print "\x1b[31mERROR: could not run commands on file %s: %s\x1b[0m"%(datFileName, errorMessage)
+    print "  -> %d files changed, %d errors"%(len([x for x in results if x[1]]), len([x for x in results if x[2]]))
+    return results
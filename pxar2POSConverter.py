@@ -1,11 +1,121 @@
 from CalibrationDataProvider import CalibrationDataProviderFactory
+from CalibrationDataProvider.ModuleCalibration import ModuleCalibration, ParameterMatrix, toDacs, toTrims, toMasks, toTbm, toReadback
+from CalibrationDataProvider.CalibrationSnapshot import encodeModule
 from ModulePositionProvider.LocalData import ModulePositionProvider
 from POSWriter.POSWriter import POSWriter
+from itertools import izip
 import traceback
+import tempfile
+import hashlib
+import array
+import json
+import os
+
+# ----------------------------------------------------------------------------------------------------------------------
+#  result of the conversion of a single module
+# ----------------------------------------------------------------------------------------------------------------------
+class ModuleConversionStatus(object):
+
+    def __init__(self, moduleID, modulePosition = None):
+        self.moduleID = moduleID
+        self.modulePosition = modulePosition if modulePosition else []
+        self.errors = []
+        self.outputFiles = []
+
+        # data kind -> (input fingerprint, list of output files) of the converted data, (None, []) if conversion failed
+        self.fingerprints = {}
+        # data kinds which were not converted, since the input did not change
+        self.skippedKinds = []
+        # converted data as stored in a snapshot file, see CalibrationSnapshot.encodeModule(), only with option Snapshot
+        self.snapshotData = None
+
+    def isGood(self):
+        return len(self.errors) < 1
+
+    def getPositionString(self):
+        return '_'.join(self.modulePosition)
+
+    def isSkipped(self):
+        return len(self.skippedKinds) > 0 and len(self.fingerprints) < 1
+
+    def __repr__(self):
+        return "<ModuleConversionStatus %s (%s): %s>"%(self.moduleID, self.getPositionString(), ('OK' if not self.isSkipped() else 'up to date') if self.isGood() else ', '.join(self.errors))
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#  manifest of a configuration: input fingerprint and output files for each module and data kind
+# ----------------------------------------------------------------------------------------------------------------------
+#  stored as JSON next to the configuration folders, file names are relative to the output path
+#    {"modules": {"M1234": {"dac": {"fingerprint": "...", "files": ["dac/1/ROC_DAC_module_....dat"]}, ...}, ...}}
+# ----------------------------------------------------------------------------------------------------------------------
+class ConversionManifest(object):
+
+    def __init__(self, outputPath, configurationID = -1):
+        # same output path as used by the POSWriter
+        self.outputPath = os.path.join(*outputPath.replace('\\','/').split('/'))
+        try:
+            configurationID = int(configurationID)
+        except:
+            configurationID = -1
+        self.fileName = os.path.join(outputPath, 'pxar2POS_manifest_%d.json'%configurationID if configurationID >= 0 else 'pxar2POS_manifest.json')
+        self.modules = self.load()
+
+    def load(self):
+        try:
+            with open(self.fileName, 'r') as manifestFile:
+                return json.load(manifestFile)['modules']
+        except (IOError, ValueError, KeyError):
+            return {}
+
+    # fingerprint is the same as for the last conversion and all output files still exist
+    def isUpToDate(self, moduleID, dataKind, fingerprint):
+        if fingerprint is None or moduleID not in self.modules or dataKind not in self.modules[moduleID]:
+            return False
+        entry = self.modules[moduleID][dataKind]
+        return entry['fingerprint'] == fingerprint and all([os.path.isfile(os.path.join(self.outputPath, x)) for x in entry['files']])
+
+    # stores the fingerprints of the converted modules. the manifest is read again before, since other processes may
+    # have converted other modules of the configuration in the meantime
+    def update(self, statuses):
+        self.modules = self.load()
+        for status in statuses:
+            for dataKind, (fingerprint, outputFiles) in status.fingerprints.items():
+                if fingerprint is None:
+                    if status.moduleID in self.modules:
+                        self.modules[status.moduleID].pop(dataKind, None)
+                else:
+                    if status.moduleID not in self.modules:
+                        self.modules[status.moduleID] = {}
+                    self.modules[status.moduleID][dataKind] = {
+                        'fingerprint': fingerprint,
+                        'files': [os.path.relpath(x, self.outputPath) for x in outputFiles],
+                    }
+        self.save()
+
+    def save(self):
+        outputFolder = os.path.dirname(self.fileName)
+        if len(outputFolder) > 0 and not os.path.isdir(outputFolder):
+            os.makedirs(outputFolder)
+        temporaryFile, temporaryFileName = tempfile.mkstemp(dir=outputFolder if outputFolder else '.', prefix='.pxar2POS_manifest.', suffix='.tmp')
+        try:
+            with os.fdopen(temporaryFile, 'w') as manifestFile:
+                json.dump({'modules': self.modules}, manifestFile, indent=1, sort_keys=True)
+            if os.name == 'nt' and os.path.isfile(self.fileName):
+                os.remove(self.fileName)
+            os.rename(temporaryFileName, self.fileName)
+        except:
+            try:
+                os.remove(temporaryFileName)
+            except OSError:
+                pass
+            raise
+
 
 class pxar2POSConverter(object):
 
-    def __init__(self, options = {}):
+    # dataSource: already initialized data source to use instead of creating one from options['DataSource'], e.g. a
+    # DataCache shared by the converters of several configurations
+    def __init__(self, options = {}, dataSource = None):
         self.verbose = 'Verbose' in options and options['Verbose']
         self.configurationID = options['ConfigurationID'] if 'ConfigurationID' in options else -1
 
@@ -13,9 +123,11 @@ class pxar2POSConverter(object):
         self.modulePositionTable = ModulePositionProvider(dataPath=options['ModulePositionTable'])
 
         # initialize data source
-        dataSource = options['DataSource']
-        cdpf = CalibrationDataProviderFactory.CalibrationDataProviderFactory()
-        self.dataSource = cdpf.init(dataSource, self.verbose)
+        if dataSource is None:
+            cdpf = CalibrationDataProviderFactory.CalibrationDataProviderFactory()
+            dataSource = cdpf.init(options['DataSource'], self.verbose, options=options)
+        self.dataSource = dataSource
+        self.dataSourceName = options['DataSource']
 
         # define parameters to be extracted
         if 'ExtractParameters' in options:
@@ -24,7 +136,15 @@ class pxar2POSConverter(object):
             self.extractParameters = ['dac', 'iana', 'mask', 'tbm', 'trim']
 
         # initialize pixel online format writer
-        self.posWriter = POSWriter(outputPath=options['OutputPath'], configurationID=self.configurationID)
+        writeThreads = int(options['WriteThreads']) if 'WriteThreads' in options else 0
+        self.posWriter = POSWriter(outputPath=options['OutputPath'], configurationID=self.configurationID, writeThreads=writeThreads)
+
+        # modules are only converted again if their input fingerprint changed, or always with Force
+        self.force = 'Force' in options and options['Force']
+        self.manifest = ConversionManifest(options['OutputPath'], self.configurationID)
+
+        # keep the converted data of each module in its status, to write a snapshot of the configuration
+        self.snapshot = 'Snapshot' in options and options['Snapshot']
 
 
     def printError(self, errorMessage, tracebackMsg = None):
@@ -58,6 +178,46 @@ class pxar2POSConverter(object):
             print "interpolate DAC:", dacName,
         return self.interpolateLinear(dacValueLow, dacValueHigh, temperature, temperatureLow, temperatureHigh)
 
+    # DAC interpolation of all DACs of a module at once: the DACs at high temperature are arranged in the same ROC x DAC
+    # layout as the ones at low temperature, then all values are interpolated and clamped in one pass over the flat
+    # arrays. raises an exception which lists all ROCs and DACs missing at high temperature
+    def interpolateDACs(self, rocDACsLow, rocDACsHigh, temperature, temperatureLow=-20, temperatureHigh=17):
+        rocDACsHighAligned = rocDACsHigh.reindex(rocDACsLow.rocs, rocDACsLow.names)
+        nNames = len(rocDACsLow.names)
+
+        # compare the sets of ROCs and DACs
+        missingRocs = [roc for roc in rocDACsLow.rocs if roc not in rocDACsHigh.rocIndex]
+        missingDacs = []
+        for iRoc, roc in enumerate(rocDACsLow.rocs):
+            if roc not in missingRocs:
+                offset = iRoc * nNames
+                dacNames = [dacName for i, dacName in enumerate(rocDACsLow.names) if rocDACsLow.present[offset + i] and not rocDACsHighAligned.present[offset + i]]
+                if len(dacNames) > 0:
+                    missingDacs.append('ROC%s: %s'%(roc, ', '.join(dacNames)))
+        unusedRocs = [roc for roc in rocDACsHigh.rocs if roc not in rocDACsLow.rocIndex]
+        unusedDacs = [dacName for dacName in rocDACsHigh.names if dacName not in rocDACsLow.nameIndex]
+        if len(unusedRocs) > 0 or len(unusedDacs) > 0:
+            print "\x1b[31mWARNING: ROCs/DACs only found for high T are ignored: ROCs %r, DACs %r\x1b[0m"%(unusedRocs, unusedDacs)
+        if len(missingRocs) > 0 or len(missingDacs) > 0:
+            raise Exception('DACs not found for high T: ROCs %r, DACs %s'%(missingRocs, '; '.join(missingDacs) if len(missingDacs) > 0 else '[]'))
+
+        # same arithmetic as interpolateLinear, for all values
+        deltaX = temperatureHigh - temperatureLow
+        deltaT = temperature - temperatureLow
+        interpolatedValues = [(float(dacValueHigh) - float(dacValueLow)) / deltaX * deltaT + float(dacValueLow) for dacValueLow, dacValueHigh in izip(rocDACsLow.values, rocDACsHighAligned.values)]
+
+        interpolatedDACs = rocDACsLow.copy()
+        interpolatedDACs.typecode = 'i'
+        interpolatedDACs.values = array.array('i', [int(min(max(x, 0), 255)) for x in interpolatedValues])
+
+        if self.verbose:
+            for iRoc, roc in enumerate(rocDACsLow.rocs):
+                print "    -> ROC ", roc
+                for i, dacName in enumerate(rocDACsLow.names):
+                    if rocDACsLow.present[iRoc * nNames + i]:
+                        print "interpolate DAC:", dacName, "  low:", rocDACsLow.values[iRoc * nNames + i], " high:", rocDACsHighAligned.values[iRoc * nNames + i], " -> ", interpolatedValues[iRoc * nNames + i]
+        return interpolatedDACs
+
     # ******************************************************************************************************************
     #  checks if module ID has correct format
     # ******************************************************************************************************************
@@ -78,12 +238,115 @@ class pxar2POSConverter(object):
 
         return good
 
+    # ******************************************************************************************************************
+    #  prefetchModuleData
+    # ******************************************************************************************************************
+    # fetch data for a list of modules at once, if the data source supports it (e.g. bulk queries for the DB)
+    # failures are not fatal, since convertModuleData will fetch the data for each module again
+    # ******************************************************************************************************************
+    def prefetchModuleData(self, moduleIDs, testOptions):
+        for prefetchOptions in self.getPrefetchOptions(testOptions):
+            try:
+                self.dataSource.prefetchModuleData(ModuleIDs=moduleIDs, options=prefetchOptions)
+            except Exception as e:
+                self.printError("could not prefetch module data", traceback.format_exc())
+
+    # download all files needed for the modules into the download cache of the data source
+    def prefetchModuleFiles(self, moduleIDs, testOptions):
+        for prefetchOptions in self.getPrefetchOptions(testOptions):
+            try:
+                self.dataSource.prefetchModuleFiles(ModuleIDs=moduleIDs, options=prefetchOptions)
+            except Exception as e:
+                self.printError("could not prefetch module files", traceback.format_exc())
+
+    # options for all tempnominals which are needed, +17 and -20 for temperature interpolation
+    def getPrefetchOptions(self, testOptions):
+        if 'tempnominal' in testOptions and testOptions['tempnominal'][0:3] not in ['m20', 'p17']:
+            tempnominals = ['p17_1', 'm20_1']
+        else:
+            tempnominals = [testOptions['tempnominal'] if 'tempnominal' in testOptions else 'm20_1']
+
+        return [self.getTemperatureOptions(testOptions, tempnominal) for tempnominal in tempnominals]
+
+    # options to read the data of another test temperature, the same as for a conversion at this temperature
+    def getTemperatureOptions(self, testOptions, tempnominal):
+        temperatureOptions = dict(testOptions)
+        temperatureOptions['tempnominal'] = tempnominal
+        if 'Test' in testOptions:
+            temperatureOptions['Test'] = '*ulltest*_' + tempnominal
+        return temperatureOptions
+
+    # ******************************************************************************************************************
+    #  finishOutput
+    # ******************************************************************************************************************
+    # wait until all output files of the modules are written and add write errors to their ModuleConversionStatus
+    # sync=True: make sure the files are on disk
+    # ******************************************************************************************************************
+    def finishOutput(self, statuses, sync = True):
+        writeErrors = self.posWriter.waitForWrites()
+        for status in statuses:
+            for outputFileName in status.outputFiles:
+                if outputFileName in writeErrors:
+                    status.errors.append("could not write %s"%outputFileName)
+            # data of modules with write errors has to be converted again
+            if not status.isGood():
+                for dataKind, (fingerprint, outputFiles) in status.fingerprints.items():
+                    if any([x in writeErrors for x in outputFiles]):
+                        status.fingerprints[dataKind] = (None, outputFiles)
+        if sync:
+            self.posWriter.syncFiles([outputFileName for status in statuses for outputFileName in status.outputFiles])
+
+    # ******************************************************************************************************************
+    #  input fingerprints
+    # ******************************************************************************************************************
+    # hash of everything the output of a data kind depends on: data source, module position, test options, the
+    # identification of the input data from the data source (test IDs, file modification times) and for DACs the
+    # transformations. None if the data source can't identify the input data, then the data is always converted
+    # ******************************************************************************************************************
+    def getInputFingerprint(self, moduleID, modulePosition, dataKind, testOptions):
+        # interpolated DACs depend on the data at both temperatures
+        inputOptionsList = self.getPrefetchOptions(testOptions) if dataKind == 'dac' else [testOptions]
+        try:
+            inputFingerprints = [self.dataSource.getInputFingerprint(ModuleID=moduleID, dataKind=dataKind, options=inputOptions) for inputOptions in inputOptionsList]
+        except Exception as e:
+            self.printError("could not get input fingerprint for %s"%dataKind, traceback.format_exc())
+            return None
+        if None in inputFingerprints:
+            return None
+
+        fingerprint = {
+            'kind': dataKind,
+            'source': self.dataSourceName,
+            'position': modulePosition,
+            'options': dict([(x, testOptions[x]) for x in ['Test', 'tempnominal', 'TrimValue'] if x in testOptions]),
+            'input': inputFingerprints,
+        }
+        if dataKind == 'dac' and 'Transformations' in testOptions and 'DACs' in testOptions['Transformations']:
+            fingerprint['transformations'] = testOptions['Transformations']['DACs']
+        return hashlib.sha1(json.dumps(fingerprint, sort_keys=True)).hexdigest()
+
+    # True if the data kind does not have to be converted again, the data kind is added to the skipped ones then
+    def isUpToDate(self, status, dataKind, fingerprint):
+        if self.force or not self.manifest.isUpToDate(status.moduleID, dataKind, fingerprint):
+            return False
+        print "  -> %s: input unchanged, skipped"%dataKind
+        status.skippedKinds.append(dataKind)
+        return True
+
+    # remember fingerprint and output files of a converted data kind for the manifest, if no new errors occurred
+    def setConverted(self, status, dataKind, fingerprint, nErrors):
+        outputFiles = self.posWriter.takeQueuedFiles()
+        status.outputFiles += outputFiles
+        status.fingerprints[dataKind] = (fingerprint if len(status.errors) == nErrors else None, outputFiles)
+
     # ******************************************************************************************************************
     #  convertModuleData
     # ******************************************************************************************************************
-    # 1) read values from data source into intermediate format
-    # 2) apply transformations
-    # 3) write them with POSWriter module
+    # 1) check if the input data changed since the last conversion (see getInputFingerprint), skip it otherwise
+    # 2) read values from data source into ModuleCalibration
+    # 3) apply transformations
+    # 4) write them with POSWriter module, files may still be written in the background (see finishOutput)
+    # 5) return ModuleConversionStatus with the list of errors which occurred
     # ******************************************************************************************************************
     def convertModuleData(self, moduleID, testOptions):
 
@@ -98,7 +361,11 @@ class pxar2POSConverter(object):
         modulePosition = self.modulePositionTable.getModulePosition(moduleID)
 
         print "read/write data for module {moduleID}...".format(moduleID=moduleID)
-        errorsOccurred = 0
+        status = ModuleConversionStatus(moduleID=moduleID, modulePosition=modulePosition)
+        calibration = ModuleCalibration(moduleID)
+
+        # options are modified during temperature interpolation, don't change the caller's copy
+        testOptions = dict(testOptions)
 
         # check for temperature interpolation
         temperatureInterpolation = False
@@ -113,143 +380,152 @@ class pxar2POSConverter(object):
         # DAC parameters
         # ------------------------------------------------------------------------------------------------------------------
         if 'dac' in self.extractParameters:
-            # read DAC parameters
-            try:
+            fingerprint = self.getInputFingerprint(moduleID, modulePosition, 'dac', testOptions)
+            if self.isUpToDate(status, 'dac', fingerprint):
+                # the other data kinds are read with the options of the low temperature, as after the interpolation
                 if temperatureInterpolation:
-                    testOptions['tempnominal'] = 'p17_1'
-                    rocDACsHigh = self.dataSource.getRocDacs(ModuleID=moduleID, options=testOptions)
-                    testOptions['tempnominal'] = 'm20_1'
-                    rocDACsLow = self.dataSource.getRocDacs(ModuleID=moduleID, options=testOptions)
-                else:
-                    rocDACs = self.dataSource.getRocDacs(ModuleID=moduleID, options=testOptions)
-            except Exception as e:
-                self.printError("could not read DAC parameters", traceback.format_exc())
-                errorsOccurred += 1
-
-            # do temperature interpolation
-            nDacsInterpolated = 0
-            try:
-                if temperatureInterpolation:
-                    rocDACs = []
-
-                    for rocDACsRocLow in rocDACsLow:
-                        rocDACsRoc = []
-                        rocPos = rocDACsRocLow['ROC']
-                        if self.verbose:
-                            print "    -> ROC ", rocPos
-                        for dacTuple in rocDACsRocLow['DACs']:
-
-                            # low T DAC value
-                            dacName = dacTuple['Name']
-                            dacValueLow = float(dacTuple['Value'].strip())
-
-                            # find high T DAC value
-                            rocDACsRocHigh = [x for x in rocDACsHigh if x['ROC'] == rocPos]
-                            if len(rocDACsRocHigh) != 1:
-                                raise Exception('ROC not found for high T: %r / %r'%(rocPos, dacName))
-                            dacValueHighList = [x for x in rocDACsRocHigh[0]['DACs'] if x['Name'] == dacName]
-                            if len(rocDACsRocHigh) != 1:
-                                raise Exception('DAC not found for high T: %r' % dacName)
-                            dacValueHigh = float(dacValueHighList[0]['Value'].strip())
-
-                            # interpolation
-                            interpolatedValue = '%d'%int(self.interpolateDAC(dacName=dacName, dacValueLow=dacValueLow,
-                                dacValueHigh=dacValueHigh, temperature=interpolationTemperature,
-                                temperatureLow=interpolationTemperatureLow, temperatureHigh=interpolationTemperatureHigh))
-                            nDacsInterpolated += 1
-
-                            rocDACsRoc.append({'Name': dacName, 'Value': interpolatedValue})
-
-                        rocDACs.append({'ROC': rocPos, 'DACs': rocDACsRoc})
-                    print " -> interpolated %d DACs to %1.2f C"%(nDacsInterpolated, interpolationTemperature)
-            except Exception as e:
-                self.printError("could not interpolate DACs", traceback.format_exc())
-                errorsOccurred += 1
-
-            # apply transformations
-            if 'Transformations' in testOptions and 'DACs' in testOptions['Transformations']:
-                nDACsChanged = 0
-                if self.verbose:
-                    print "  --> DAC transformation rule:", testOptions['Transformations']['DACs']
-                for rocDACsRoc in rocDACs:
-                    for dac in rocDACsRoc['DACs']:
-                        if self.verbose:
-                            print "    --> check DAC ", dac['Name']
-                        if dac['Name'] in testOptions['Transformations']['DACs']:
-                            dac['Value'] = testOptions['Transformations']['DACs'][dac['Name']]
-                            nDACsChanged += 1
-                if nDACsChanged > 0:
-                    print "  -> %d DACs changed!"%nDACsChanged
-                elif len(testOptions['Transformations']['DACs']) > 0:
-                    print "  \x1b[31m--> DACs specified in config file not found in DAC parameters file -> nothing done!\x1b[0m"
-
-            # write DAC parameters
-            try:
-                self.posWriter.writeDACs(moduleID, modulePosition, rocDACs)
-            except Exception as e:
-                self.printError("could not write DAC parameters", traceback.format_exc())
-                errorsOccurred += 1
+                    testOptions = self.getTemperatureOptions(testOptions, 'm20_1')
+            else:
+                nErrors = len(status.errors)
+                # read DAC parameters
+                try:
+                    if temperatureInterpolation:
+                        testOptions = self.getTemperatureOptions(testOptions, 'p17_1')
+                        rocDACsHigh = toDacs(self.dataSource.getRocDacs(ModuleID=moduleID, options=testOptions))
+                        testOptions = self.getTemperatureOptions(testOptions, 'm20_1')
+                        rocDACsLow = toDacs(self.dataSource.getRocDacs(ModuleID=moduleID, options=testOptions))
+                    else:
+                        calibration.dacs = toDacs(self.dataSource.getRocDacs(ModuleID=moduleID, options=testOptions))
+                except Exception as e:
+                    self.printError("could not read DAC parameters", traceback.format_exc())
+                    status.errors.append("could not read DAC parameters")
+
+                # do temperature interpolation
+                try:
+                    if temperatureInterpolation:
+                        calibration.dacs = self.interpolateDACs(rocDACsLow, rocDACsHigh, temperature=interpolationTemperature,
+                            temperatureLow=interpolationTemperatureLow, temperatureHigh=interpolationTemperatureHigh)
+                        print " -> interpolated %d DACs to %1.2f C"%(calibration.dacs.present.count('\x01'), interpolationTemperature)
+                except Exception as e:
+                    self.printError("could not interpolate DACs", traceback.format_exc())
+                    status.errors.append("could not interpolate DACs")
+
+                # apply transformations, not if the DACs could not be read
+                if calibration.dacs is not None and 'Transformations' in testOptions and 'DACs' in testOptions['Transformations']:
+                    nDACsChanged = 0
+                    if self.verbose:
+                        print "  --> DAC transformation rule:", testOptions['Transformations']['DACs']
+                    for rocPos in calibration.dacs.rocs:
+                        for dacName, dacValue in calibration.dacs.getRoc(rocPos):
+                            if self.verbose:
+                                print "    --> check DAC ", dacName
+                            if dacName in testOptions['Transformations']['DACs']:
+                                calibration.dacs.set(rocPos, dacName, testOptions['Transformations']['DACs'][dacName])
+                                nDACsChanged += 1
+                    if nDACsChanged > 0:
+                        print "  -> %d DACs changed!"%nDACsChanged
+                    elif len(testOptions['Transformations']['DACs']) > 0:
+                        print "  \x1b[31m--> DACs specified in config file not found in DAC parameters file -> nothing done!\x1b[0m"
+
+                # write DAC parameters
+                if calibration.dacs is not None:
+                    try:
+                        self.posWriter.writeDACs(moduleID, modulePosition, calibration.dacs)
+                    except Exception as e:
+                        self.printError("could not write DAC parameters", traceback.format_exc())
+                        status.errors.append("could not write DAC parameters")
+                self.setConverted(status, 'dac', fingerprint, nErrors)
 
         # ------------------------------------------------------------------------------------------------------------------
         # trimbits
         # ------------------------------------------------------------------------------------------------------------------
         if 'trim' in self.extractParameters:
-            try:
-                # read trimbits
-                moduleTrimbits = self.dataSource.getTrimBits(ModuleID=moduleID, options=testOptions)
-
-                # write trimbits
-                self.posWriter.writeTrim(moduleID, modulePosition, moduleTrimbits)
-            except Exception as e:
-                self.printError("could not read/write trimbits", traceback.format_exc())
-                errorsOccurred += 1
+            fingerprint = self.getInputFingerprint(moduleID, modulePosition, 'trim', testOptions)
+            if not self.isUpToDate(status, 'trim', fingerprint):
+                nErrors = len(status.errors)
+                try:
+                    # read trimbits
+                    calibration.trims = toTrims(self.dataSource.getTrimBits(ModuleID=moduleID, options=testOptions))
+
+                    # write trimbits
+                    self.posWriter.writeTrim(moduleID, modulePosition, calibration.trims)
+                except Exception as e:
+                    self.printError("could not read/write trimbits", traceback.format_exc())
+                    status.errors.append("could not read/write trimbits")
+                self.setConverted(status, 'trim', fingerprint, nErrors)
 
         # ------------------------------------------------------------------------------------------------------------------
         # TBM parameters
         # ------------------------------------------------------------------------------------------------------------------
         if 'tbm' in self.extractParameters:
-            try:
-                # read TBM parameters
-                tbmParameters = self.dataSource.getTbmParameters(ModuleID=moduleID, options=testOptions)
-
-                # write TBM parameters to pixel online format
-                self.posWriter.writeTBM(moduleID, modulePosition, tbmParameters)
-            except Exception as e:
-                self.printError("could not read/write TBM parameters", traceback.format_exc())
-                errorsOccurred += 1
+            fingerprint = self.getInputFingerprint(moduleID, modulePosition, 'tbm', testOptions)
+            if not self.isUpToDate(status, 'tbm', fingerprint):
+                nErrors = len(status.errors)
+                try:
+                    # read TBM parameters
+                    calibration.tbm = toTbm(self.dataSource.getTbmParameters(ModuleID=moduleID, options=testOptions))
+
+                    # write TBM parameters to pixel online format
+                    self.posWriter.writeTBM(moduleID, modulePosition, calibration.tbm)
+                except Exception as e:
+                    self.printError("could not read/write TBM parameters", traceback.format_exc())
+                    status.errors.append("could not read/write TBM parameters")
+                self.setConverted(status, 'tbm', fingerprint, nErrors)
 
         # ------------------------------------------------------------------------------------------------------------------
         # mask bits
         # ------------------------------------------------------------------------------------------------------------------
         if 'mask' in self.extractParameters:
-            try:
-                # read maskbits
-                moduleMaskbits = self.dataSource.getMaskBits(ModuleID=moduleID, options=testOptions)
-
-                # write maskbits
-                self.posWriter.writeMask(moduleID, modulePosition, moduleMaskbits)
-            except Exception as e:
-                self.printError("could not read/write maskbits", traceback.format_exc())
-                errorsOccurred += 1
+            fingerprint = self.getInputFingerprint(moduleID, modulePosition, 'mask', testOptions)
+            if not self.isUpToDate(status, 'mask', fingerprint):
+                nErrors = len(status.errors)
+                try:
+                    # read maskbits
+                    calibration.masks = toMasks(self.dataSource.getMaskBits(ModuleID=moduleID, options=testOptions))
+
+                    # write maskbits
+                    self.posWriter.writeMask(moduleID, modulePosition, calibration.masks)
+                except Exception as e:
+                    self.printError("could not read/write maskbits", traceback.format_exc())
+                    status.errors.append("could not read/write maskbits")
+                self.setConverted(status, 'mask', fingerprint, nErrors)
 
         # ------------------------------------------------------------------------------------------------------------------
         # readback
         # ------------------------------------------------------------------------------------------------------------------
         if 'iana' in self.extractParameters:
+            fingerprint = self.getInputFingerprint(moduleID, modulePosition, 'iana', testOptions)
+            if not self.isUpToDate(status, 'iana', fingerprint):
+                nErrors = len(status.errors)
+                try:
+                    # read readback
+                    calibration.readback = toReadback(self.dataSource.getReadbackCalibration(ModuleID=moduleID, options=testOptions))
+
+                    # write readback
+                    self.posWriter.writeReadback(moduleID, modulePosition, calibration.readback)
+                except Exception as e:
+                    self.printError("could not read/write readback calibration constants", traceback.format_exc())
+                    status.errors.append("could not read/write readback calibration constants")
+                self.setConverted(status, 'iana', fingerprint, nErrors)
+
+        status.outputFiles += self.posWriter.takeQueuedFiles()
+
+        # modules with errors are not stored, the snapshot would hold incomplete data
+        if self.snapshot and status.isGood():
             try:
-                # read readback
-                moduleReadback = self.dataSource.getReadbackCalibration(ModuleID=moduleID, options=testOptions)
-
-                # write readback
-                self.posWriter.writeReadback(moduleID, modulePosition, moduleReadback)
+                status.snapshotData = encodeModule(calibration)
             except Exception as e:
-                self.printError("could not read/write readback calibration constants", traceback.format_exc())
-                errorsOccurred += 1
+                self.printError("could not store data for snapshot", traceback.format_exc())
+                status.errors.append("could not store data for snapshot")
 
         # ------------------------------------------------------------------------------------------------------------------
         # print error statistics
         # ------------------------------------------------------------------------------------------------------------------
-        if errorsOccurred < 1:
+        if status.isSkipped():
+            print " --> up to date."
+        elif status.isGood():
             print " --> done."
         else:
-            print "\x1b[31m --> done, but %d errors occurred!!!\x1b[0m"%errorsOccurred
\ No newline at end of file
+            print "\x1b[31m --> done, but %d errors occurred!!!\x1b[0m"%len(status.errors)
+
+        return status
\ No newline at end of file
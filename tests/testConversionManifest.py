@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------------------------------------------------------
+#  tests for the incremental conversion (ConversionManifest in pxar2POSConverter.py): modules are only converted
+#  again if their input, the trim value or the [DACs] transformations changed, or with the Force option
+#  run from the main directory: python -m unittest discover -s tests -p 'test*.py'
+# ----------------------------------------------------------------------------------------------------------------------
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import pxar2POSBatch
+from pxar2POSConverter import ConversionManifest
+
+dataKinds = ['dac', 'iana', 'mask', 'tbm', 'trim']
+
+
+# minimal pxar folder tree of a L2 module with one fulltest at -20, without readback calibration if withReadback=False
+def createPxarData(dataPath, ModuleID, withReadback = True):
+    testPath = os.path.join(dataPath, '%s_FullQualification_2016-01-01_10h00m_1451638800'%ModuleID, '000_Fulltest_m20_1')
+    os.makedirs(testPath)
+    for trimValue in ['', '35']:
+        for roc in range(16):
+            with open(os.path.join(testPath, 'dacParameters%s_C%d.dat'%(trimValue, roc)), 'w') as outputFile:
+                outputFile.write('  1 vana         81\n  2 vthrcomp     85\n  3 wbc         100\n')
+            with open(os.path.join(testPath, 'trimParameters%s_C%d.dat'%(trimValue, roc)), 'w') as outputFile:
+                outputFile.write(''.join(['%2d Pix %d %d\n'%((iCol + iRow) % 16, iCol, iRow) for iCol in range(52) for iRow in range(80)]))
+    for tbmCore in 'ab':
+        with open(os.path.join(testPath, 'tbmParameters_C0%s.dat'%tbmCore), 'w') as outputFile:
+            outputFile.write(' 0 basea        0x1b\n 1 basee        0xe4\n')
+    if withReadback:
+        for roc in range(16):
+            with open(os.path.join(testPath, 'readbackCal_C%d.dat'%roc), 'w') as outputFile:
+                outputFile.write(''.join(['%s 0.5\n'%x for x in ['par0vd', 'par1vd', 'par0va', 'par1va', 'par0rbia', 'par1rbia', 'par0tbia', 'par1tbia', 'par2tbia', 'par0ia', 'par1ia', 'par2ia']]))
+    return testPath
+
+
+class TestConversionManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.workingDirectory = os.getcwd()
+        self.temporaryPath = tempfile.mkdtemp(prefix='pxar2POS_test_')
+        # the POSWriter expects output paths relative to the working directory
+        os.chdir(self.temporaryPath)
+        with open('modules.txt', 'w') as outputFile:
+            outputFile.write('M2222 BPix BmO SEC1 LYR2 LDR1F MOD4\nM2223 BPix BmO SEC1 LYR2 LDR1F MOD3\n')
+        self.testPath = createPxarData('pxar', 'M2222')
+        createPxarData('pxar', 'M2223', withReadback=False)
+
+    def tearDown(self):
+        os.chdir(self.workingDirectory)
+        shutil.rmtree(self.temporaryPath)
+
+    def convert(self, moduleIDs = ['M2222'], trimValue = '35', transformations = {}, force = False):
+        converterOptions = {
+            'ModulePositionTable': 'modules.txt',
+            'DataSource': 'pxar',
+            'OutputPath': 'out',
+            'ConfigurationID': 1,
+            'Force': force,
+        }
+        testOptions = {'Test': '*ulltest*_m20_1', 'tempnominal': 'm20_1', 'TrimValue': trimValue, 'Transformations': {'DACs': dict(transformations)}}
+        return pxar2POSBatch.convertModules(converterOptions, moduleIDs, testOptions)
+
+    def assertConverted(self, statuses, convertedKinds):
+        self.assertEqual(len(statuses), 1)
+        self.assertTrue(statuses[0].isGood(), statuses[0].errors)
+        self.assertEqual(sorted(statuses[0].fingerprints.keys()), sorted(convertedKinds))
+        self.assertEqual(sorted(statuses[0].skippedKinds), sorted(set(dataKinds) - set(convertedKinds)))
+
+    def testUnchangedInputIsSkipped(self):
+        self.assertConverted(self.convert(), dataKinds)
+        statuses = self.convert()
+        self.assertConverted(statuses, [])
+        self.assertTrue(statuses[0].isSkipped())
+
+    def testChangedTransformation(self):
+        self.convert(transformations={'WBC': 100})
+        self.assertConverted(self.convert(transformations={'WBC': 100}), [])
+        self.assertConverted(self.convert(transformations={'WBC': 120}), ['dac'])
+        with open(os.path.join('out', 'dac', '1', 'ROC_DAC_module_BPix_BmO_SEC1_LYR2_LDR1F_MOD4.dat'), 'r') as inputFile:
+            self.assertTrue('WBC:           120\n' in inputFile.read())
+
+    def testChangedTrimValue(self):
+        self.convert(trimValue='35')
+        # DACs and trimbits are read from other files, TBM files are the same, but the trim value is part of all
+        # fingerprints
+        self.assertConverted(self.convert(trimValue=''), dataKinds)
+        self.assertConverted(self.convert(trimValue=''), [])
+
+    def testChangedInputFile(self):
+        self.convert()
+        fileName = os.path.join(self.testPath, 'trimParameters35_C3.dat')
+        fileStat = os.stat(fileName)
+        os.utime(fileName, (fileStat.st_atime, fileStat.st_mtime + 10))
+        self.assertConverted(self.convert(), ['trim'])
+
+    def testForce(self):
+        self.convert()
+        self.assertConverted(self.convert(force=True), dataKinds)
+
+    def testModuleWithErrors(self):
+        statuses = self.convert(moduleIDs=['M2223'])
+        self.assertFalse(statuses[0].isGood())
+        self.assertTrue('iana' not in ConversionManifest('out', 1).modules.get('M2223', {}))
+
+        # the data kinds without errors are skipped, the failed one is converted again
+        statuses = self.convert(moduleIDs=['M2223'])
+        self.assertFalse(statuses[0].isGood())
+        self.assertFalse(statuses[0].isSkipped())
+        self.assertTrue('iana' in statuses[0].fingerprints)
+        self.assertTrue('iana' not in statuses[0].skippedKinds)
+
+
+if __name__ == '__main__':
+    unittest.main()
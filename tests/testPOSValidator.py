@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------------------------------------------------------
+#  tests for POSWriter/POSValidator.py: files written by the POSWriter and the example files have to pass the content
+#  validation without errors
+#  run from the main directory: python -m unittest discover -s tests -p 'test*.py'
+# ----------------------------------------------------------------------------------------------------------------------
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from POSWriter.POSWriter import POSWriter
+from POSWriter import POSValidator
+from CalibrationDataProvider.DefaultValues import CalibrationDataProvider as DefaultCalibrationDataProvider
+
+exampleDataPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ExampleData')
+
+
+class TestPOSValidator(unittest.TestCase):
+
+    def setUp(self):
+        self.workingDirectory = os.getcwd()
+        self.temporaryPath = tempfile.mkdtemp(prefix='pxar2POS_test_')
+        # the POSWriter expects output paths relative to the working directory
+        os.chdir(self.temporaryPath)
+
+    def tearDown(self):
+        os.chdir(self.workingDirectory)
+        shutil.rmtree(self.temporaryPath)
+
+    def assertNoErrors(self, results):
+        self.assertTrue(len(results) > 0)
+        for result in results:
+            self.assertEqual(result['errors'], [], "%s: %s" % (result['file'], result['errors']))
+
+    def testExampleData(self):
+        self.assertNoErrors([POSValidator.validateFile((fileType, os.path.join(exampleDataPath, fileName))) for fileType, fileName in [
+            ('dac', 'ROC_DAC_module_BPix_BmO_SEC1_LYR2_LDR1H_MOD4.dat'),
+            ('trim', 'ROC_Trims_module_BPix_BmO_SEC1_LYR2_LDR1H_MOD4.dat'),
+            ('tbm', 'TBM_module_BPix_BmO_SEC1_LYR2_LDR1H_MOD4.dat'),
+        ]])
+
+    def testWrittenConfiguration(self):
+        configurationId = 3
+        dataProvider = DefaultCalibrationDataProvider()
+        posWriter = POSWriter(outputPath='config', configurationID=configurationId)
+        modules = [
+            ('M1234', ['BPix', 'BmI', 'SEC2', 'LYR1', 'LDR1F', 'MOD1']),
+            ('M2222', ['BPix', 'BmO', 'SEC1', 'LYR2', 'LDR1H', 'MOD4']),
+            ('M4919', ['BPix', 'BmO', 'SEC1', 'LYR4', 'LDR1F', 'MOD1']),
+        ]
+        for ModuleID, ModulePosition in modules:
+            posWriter.writeDACs(ModuleID, ModulePosition, dataProvider.getRocDacs(ModuleID))
+            posWriter.writeTrim(ModuleID, ModulePosition, dataProvider.getTrimBits(ModuleID))
+            posWriter.writeMask(ModuleID, ModulePosition, dataProvider.getMaskBits(ModuleID))
+            posWriter.writeTBM(ModuleID, ModulePosition, dataProvider.getTbmParameters(ModuleID))
+            posWriter.writeReadback(ModuleID, ModulePosition, dataProvider.getReadbackCalibration(ModuleID))
+
+        results = POSValidator.validateConfigurationFiles('config', configurationId)
+        # L1 module: F and H file for each of the 5 kinds, L2-4 modules: one file each
+        self.assertEqual(len(results), 5 * 4)
+        self.assertNoErrors(results)
+
+    def testRocCountAfterTooManyErrors(self):
+        fileName = 'ROC_DAC_module_BPix_BmO_SEC1_LYR2_LDR1F_MOD4.dat'
+        with open(fileName, 'w') as outputFile:
+            for roc in range(16):
+                outputFile.write('ROC:           BPix_BmO_SEC1_LYR2_LDR1F_MOD4_ROC%d\n' % roc)
+                for dac in range(POSValidator.maxErrorsPerFile + 2 if roc == 0 else 1):
+                    outputFile.write('Vdd:           %d\n' % (999 if roc == 0 else 6))
+        errors = POSValidator.validateFile(('dac', fileName))['errors']
+        self.assertEqual(len(errors), POSValidator.maxErrorsPerFile + 1)
+        self.assertFalse([x for x in errors if 'ROCs found' in x or 'missing ROCs' in x], errors)
+
+
+if __name__ == '__main__':
+    unittest.main()
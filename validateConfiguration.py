@@ -2,8 +2,11 @@
 import argparse
 import ConfigParser
 import os
-import shutil
-import glob
+import json
+import time
+import re
+from ModulePositionProvider.LocalData import ModulePositionProvider
+from POSWriter.POSValidator import validateConfigurationFiles
 
 # load default configuration first and then overwrite with user configuration
 config = ConfigParser.SafeConfigParser()
@@ -20,9 +23,31 @@ except:
 #  configuration
 # ----------------------------------------------------------------------------------------------------------------
 
-configurationId = config.get('Global', 'ConfigurationId')
-configurationBase = config.get('Paths', 'Output')
-moduleList = config.get('Paths', 'ModuleList')
+parser = argparse.ArgumentParser(description='check if files for all detector positions exist in POS configurations')
+parser.add_argument('-i', '--configuration-id', dest='configuration_id', nargs='+',
+                    help='configuration ID(s), comma or space separated',
+                    default=[config.get('Global', 'ConfigurationId')])
+parser.add_argument('-o', '--output', dest='output',
+                    help='POS configuration base path',
+                    default=config.get('Paths', 'Output'))
+parser.add_argument('-p', '--positions', dest='positions',
+                    help='module position table',
+                    default=config.get('Paths', 'ModuleList'))
+parser.add_argument('-c', '--content', dest='content', action='store_true',
+                    help='also check the content of all files: ROC headers, pixel lines and parameter ranges',
+                    default=False)
+parser.add_argument('-j', '--jobs', dest='jobs',
+                    help='number of parallel worker processes for --content',
+                    type=int,
+                    default=config.get('Global', 'Jobs'))
+parser.add_argument('-r', '--report', dest='report',
+                    help='write report as JSON to this file',
+                    default='')
+args = parser.parse_args()
+
+configurationIds = [x.strip() for x in ','.join(args.configuration_id).split(',') if len(x.strip()) > 0]
+configurationBase = args.output
+moduleList = args.positions
 
 detectorSections = ['BpO','BmO','BpI','BmI']
 detectorLayerLadders = [6, 14, 22, 32]
@@ -31,13 +56,39 @@ detectorModules = 4
 detectorModuleNameFormat = 'BPix_{Section}{insideOutside}_SEC*_LYR{Layer}_LDR{Ladder}{ModuleType}_MOD{Module}'
 
 checks = [
-    ['DACs', '/dac/{configurationId}/ROC_DAC_module_{detectorModuleName}.dat'],
-    ['Readback', '/iana/{configurationId}/ROC_Iana_{detectorModuleName}.dat'],
-    ['Mask', '/mask/{configurationId}/ROC_Masks_module_{detectorModuleName}.dat'],
-    ['TBM', '/tbm/{configurationId}/TBM_module_{detectorModuleName}.dat'],
-    ['trim', '/trim/{configurationId}/ROC_Trims_module_{detectorModuleName}.dat'],
+    ['DACs', '/dac/{configurationId}/', 'ROC_DAC_module_{detectorModuleName}.dat'],
+    ['Readback', '/iana/{configurationId}/', 'ROC_Iana_{detectorModuleName}.dat'],
+    ['Mask', '/mask/{configurationId}/', 'ROC_Masks_module_{detectorModuleName}.dat'],
+    ['TBM', '/tbm/{configurationId}/', 'TBM_module_{detectorModuleName}.dat'],
+    ['trim', '/trim/{configurationId}/', 'ROC_Trims_module_{detectorModuleName}.dat'],
 ]
 
+# module IDs by position, without sector (not part of the checked names) and for L1 without F/H suffix of the ladder,
+# since L1 modules are written as two pseudo half-module files
+def getPositionKey(positionString):
+    positionKey = re.sub(r'_SEC[^_]*', '', positionString)
+    if '_LYR1_' in positionKey:
+        positionKey = re.sub(r'(_LDR\d+)[FH]', r'\1', positionKey)
+    return positionKey
+
+# lists the folder once and returns the number of files per file name without sector, which is the number of files
+# the SEC* wildcard of the expected name would match
+def getFolderIndex(folderName):
+    folderIndex = {}
+    try:
+        fileNames = os.listdir(folderName)
+    except OSError:
+        print "\x1b[31mWARNING: folder %s does not exist!\x1b[0m"%folderName
+        fileNames = []
+    for fileName in fileNames:
+        if not fileName.startswith('.'):
+            fileKey = re.sub(r'_SEC[^_]*', '', fileName)
+            folderIndex[fileKey] = folderIndex.get(fileKey, 0) + 1
+    return folderIndex
+
+modulePositionTable = ModulePositionProvider(dataPath=moduleList)
+moduleIDsByPosition = dict([(getPositionKey(positionString), moduleID) for positionString, moduleID in modulePositionTable.getPositionIndex().items()])
+
 print ""
 print "legend:"
 print " . good"
@@ -47,55 +98,93 @@ print ""
 #  run the checks
 # ----------------------------------------------------------------------------------------------------------------
 
-problems = {}
+report = {'configurations': []}
+
+for configurationId in configurationIds:
+    print "\x1b[32m== configuration %s ==\x1b[0m"%configurationId
 
-for layer, detectorLayerLadder in enumerate(detectorLayerLadders, start=1):
-    print "\x1b[32m -> layer %d\x1b[0m"%layer
+    # list every folder only once
+    folderIndices = {}
+    for checkName, checkFolder, checkFile in checks:
+        folderIndices[checkName] = getFolderIndex(configurationBase + checkFolder.format(configurationId=configurationId))
 
-    for insideOutside in ['O', 'I']:
-        print "\x1b[32m halfshell %s\x1b[0m" % insideOutside
+    problems = {}
 
-        for ladder in range(1, detectorLayerLadder+1):
+    for layer, detectorLayerLadder in enumerate(detectorLayerLadders, start=1):
+        print "\x1b[32m -> layer %d\x1b[0m"%layer
 
-            ladderString = '%2d:'%ladder
-            for section,modules in [['Bm',[4,3,2,1]],['Bp',[1,2,3,4]]]:
-                for module in modules:
+        for insideOutside in ['O', 'I']:
+            print "\x1b[32m halfshell %s\x1b[0m" % insideOutside
 
-                    if layer == 1:
-                        moduleTypes = ['H', 'F']
-                    else:
-                        moduleTypes = ['F']
+            for ladder in range(1, detectorLayerLadder+1):
 
-                    for moduleType in moduleTypes:
-                        detectorModuleName = detectorModuleNameFormat.format(
-                            Section=section,
-                            insideOutside=insideOutside,
-                            Ladder=ladder,
-                            Layer=layer,
-                            Module=module,
-                            ModuleType=moduleType,
-                        )
+                ladderString = '%2d:'%ladder
+                for section,modules in [['Bm',[4,3,2,1]],['Bp',[1,2,3,4]]]:
+                    for module in modules:
 
-                        for checkName,checkPaths in checks:
-                            globPath = configurationBase + checkPaths.format(
-                                configurationId=configurationId,
-                                detectorModuleName=detectorModuleName,
+                        if layer == 1:
+                            moduleTypes = ['H', 'F']
+                        else:
+                            moduleTypes = ['F']
+
+                        for moduleType in moduleTypes:
+                            detectorModuleName = detectorModuleNameFormat.format(
+                                Section=section,
+                                insideOutside=insideOutside,
+                                Ladder=ladder,
+                                Layer=layer,
+                                Module=module,
+                                ModuleType=moduleType,
                             )
-                            globFiles = glob.glob(globPath)
-
-                            if len(globFiles) != 1:
-                                ladderString += 'X'
-                                if detectorModuleName not in problems:
-                                    problems[detectorModuleName] = []
-                                problems[detectorModuleName].append(checkName)
-                            else:
-                                ladderString += '.'
-
-                    ladderString += ' '
-            print ladderString
-
-print "problematic modules:"
-for problem in problems.iteritems():
-    print problem
-if len(problems) < 1:
-    print "none :)"
+
+                            for checkName, checkFolder, checkFile in checks:
+                                fileKey = re.sub(r'_SEC[^_]*', '', checkFile.format(detectorModuleName=detectorModuleName))
+
+                                if folderIndices[checkName].get(fileKey, 0) != 1:
+                                    ladderString += 'X'
+                                    if detectorModuleName not in problems:
+                                        problems[detectorModuleName] = []
+                                    problems[detectorModuleName].append(checkName)
+                                else:
+                                    ladderString += '.'
+
+                        ladderString += ' '
+                print ladderString
+
+    print "problematic modules in configuration %s:"%configurationId
+    for detectorModuleName, problem in sorted(problems.items()):
+        print moduleIDsByPosition.get(getPositionKey(detectorModuleName), '?????'), detectorModuleName, problem
+    if len(problems) < 1:
+        print "none :)"
+    print ""
+
+    configurationReport = {
+        'configurationId': configurationId,
+        'path': configurationBase,
+        'missing': [{'moduleID': moduleIDsByPosition.get(getPositionKey(detectorModuleName), None), 'position': detectorModuleName, 'checks': problem} for detectorModuleName, problem in sorted(problems.items())],
+    }
+
+    # content of all files
+    if args.content:
+        startTime = time.time()
+        results = validateConfigurationFiles(configurationBase, configurationId, jobs=args.jobs)
+        invalidFiles = [result for result in results if len(result['errors']) > 0]
+        for result in invalidFiles:
+            result['moduleID'] = moduleIDsByPosition.get(getPositionKey(result['position']), None)
+        print "content of %d files checked in %1.1fs:"%(len(results), time.time() - startTime)
+        for result in invalidFiles:
+            print "\x1b[31m%s\x1b[0m %s"%(result['moduleID'] or '?????', result['file'])
+            for error in result['errors']:
+                print "    ", error
+        if len(invalidFiles) < 1:
+            print "all valid :)"
+        print ""
+        configurationReport['filesChecked'] = len(results)
+        configurationReport['invalid'] = invalidFiles
+
+    report['configurations'].append(configurationReport)
+
+if len(args.report) > 0:
+    with open(args.report, 'w') as reportFile:
+        json.dump(report, reportFile, indent=2, sort_keys=True)
+    print "report written to '\x1b[34m%s\x1b[0m'"%args.report